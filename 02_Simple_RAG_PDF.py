@@ -7,23 +7,30 @@
 """
 
 
-import os
+import argparse
 from loguru import logger
-from langchain_community.vectorstores import FAISS
-import os.path
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
+from rag.faiss_index import INDEX_TYPES
+from rag.ingest import update_index, format_plan
 # Настройка логирования с использованием loguru
 logger.add("log/02_Simple_RAG_PDF.log", format="{time} {level} {message}", level="DEBUG", rotation="100 KB", compression="zip")
 
 
-def get_index_db():
+def get_index_db(dry_run=False, workers=None, batch_size=64, index_type='flat', params=None):
     """
     Функция для получения или создания векторной Базы-Знаний.
-    Если база уже существует, она загружается из файла,
-    иначе происходит чтение PDF-документов и создание новой базы.
+    Если база уже существует, в нее добавляются только новые и измененные PDF-документы,
+    а кусочки удаленных документов удаляются (см. rag/ingest.py),
+    иначе происходит чтение всех PDF-документов и создание новой базы.
+    При dry_run только выводится отчет о том, что изменится.
+    PDF читаются в workers процессах, эмбеддинги считаются пачками по batch_size кусочков.
+    index_type и params задают тип индекса FAISS и параметры его построения (см. rag/faiss_index.py).
     """
     logger.debug('...get_index_db')
+    if dry_run:
+        _, plan = update_index(None, path_db_doc, path_pdf, dry_run=True, index_type=index_type, params=params)
+        print(format_plan(plan))
+        return None
+
     # Создание векторных представлений (Embeddings)
     logger.debug('Embeddings')
     from langchain_huggingface import HuggingFaceEmbeddings
@@ -35,58 +42,12 @@ def get_index_db():
         model_kwargs=model_kwargs
     )
 
-    db_file_name = path_db_doc
-    create_db = False
-
-    # Загрузка векторной Базы-Знаний из файла
-    logger.debug('Загрузка векторной Базы-Знаний из файла')
-    file_path = db_file_name + "/index.faiss"
-
-    # Проверка наличия файла с векторной Базой-Знаний
-    if os.path.exists(file_path):
-        logger.debug('Уже существует векторная База-знаний')
-        # Загрузка существующей Базы-Знаний
-        db = FAISS.load_local(db_file_name, embeddings, allow_dangerous_deserialization=True)
-
-    else:
-        logger.debug('Еще не создана векторная База-Знаний')
-        create_db = True
-        # Если базы нет, происходит создание новой путем чтения PDF-документов
-        # Document loaders
-        ## Document loaders: https://python.langchain.com/docs/integrations/document_loaders
-        ## PyPDFLoader: https://python.langchain.com/docs/modules/data_connection/document_loaders/pdf
-
-
-    if create_db: 
-        dir = path_pdf
-        logger.debug(f'Document loaders. dir={dir}')
-        documents = []
-        # Чтение всех PDF-файлов в указанной директории
-        for root, dirs, files in os.walk(dir):
-            for file in files:
-                if file.endswith(".pdf"):
-                    logger.debug(f'root={root} file={file}')
-                    loader = PyPDFLoader(os.path.join(root, file))
-                    documents.extend(loader.load())
-                
-
-        # Разделение документов на меньшие части (chunks)
-        logger.debug('Разделение на chunks')
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=10)
-        source_chunks = text_splitter.split_documents(documents)
-        logger.debug(type(source_chunks))
-        logger.debug(len(source_chunks))
-        # logger.debug(source_chunks[100].metadata)
-        # logger.debug(source_chunks[100].page_content)
-
-        # Создание векторной Базы-Знаний из chunks
-        logger.debug('Векторная База-Знаний')
-        db = FAISS.from_documents(source_chunks, embeddings)
-        db.add_documents
-        # Сохранение созданной Базы-Знаний в файл
-        logger.debug('Сохранение векторной Базы-Знаний в файл')
-        db.save_local(db_file_name)
-
+    # Загрузка и обновление векторной Базы-Знаний
+    ## Document loaders: https://python.langchain.com/docs/integrations/document_loaders
+    ## PyPDFLoader: https://python.langchain.com/docs/modules/data_connection/document_loaders/pdf
+    db, plan = update_index(embeddings, path_db_doc, path_pdf, workers=workers, batch_size=batch_size,
+                            index_type=index_type, params=params)
+    logger.debug(format_plan(plan))
     return db
 
 def get_message_content(topic, index_db, NUMBER_RELEVANT_CHUNKS):
@@ -141,8 +102,24 @@ path_db_doc = "index_db/db_internal"
 path_pdf = "pdf_2"
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Построение векторной Базы-Знаний и пример ответа')
+    parser.add_argument('--dry-run', action='store_true', help='только показать, какие документы изменятся')
+    parser.add_argument('--workers', type=int, default=None, help='количество процессов для чтения PDF')
+    parser.add_argument('--batch-size', type=int, default=64, help='размер пачки кусочков для эмбеддингов')
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat', help='тип индекса FAISS')
+    parser.add_argument('--nlist', type=int, default=None, help='ivfpq: количество кластеров')
+    parser.add_argument('--pq-m', type=int, default=None, help='ivfpq: количество подвекторов')
+    parser.add_argument('--hnsw-m', type=int, default=None, help='hnsw: количество связей вершины графа')
+    args = parser.parse_args()
+    index_params = {key: value for key, value in
+                    (('nlist', args.nlist), ('pq_m', args.pq_m), ('hnsw_m', args.hnsw_m)) if value}
+    if args.dry_run:
+        get_index_db(dry_run=True, index_type=args.index_type, params=index_params)
+        raise SystemExit(0)
+
     # Основной блок программы: инициализация, построение базы и генерация ответа
-    db = get_index_db()
+    db = get_index_db(workers=args.workers, batch_size=args.batch_size,
+                      index_type=args.index_type, params=index_params)
     NUMBER_RELEVANT_CHUNKS = 3 # Количество релевантных кусков для извлечения
     topic = 'О чем теорема Ферма? Для чего ее используют?' # Вопрос пользователя
     logger.debug(topic)
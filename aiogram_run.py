@@ -1,9 +1,40 @@
 import asyncio
-from create_bot import bot, dp, admins
+import multiprocessing
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from decouple import config
+from create_bot import (bot, dp, admins, outbox, load_answer_cache, scheduler, logger, warm_up, is_warmed_up,
+                        cancel_summaries, llm_pool, index_registry, embedding_service, open_dialogs_db,
+                        close_dialogs_db, SCHEDULER_SHUTDOWN_TIMEOUT)
 from db_handler.db_funk import get_all_users
-from db_handler.db_funk import create_table_users,create_table_dialog_history
+from db_handler.db_funk import (create_table_users, create_table_dialog_history, create_table_dialog_summary,
+                                create_table_dialog_mode, open_db, close_db)
 from handlers.user_router import user_router
 from aiogram.types import BotCommand, BotCommandScopeDefault
+from utils import metrics
+from utils.utils import log_duration
+
+# Режим получения обновлений: polling (long polling) или webhook
+BOT_MODE = config('BOT_MODE', default='polling')
+# Webhook: Telegram отправляет обновления на WEBHOOK_BASE_URL + WEBHOOK_PATH с заголовком WEBHOOK_SECRET,
+# сервер слушает WEBHOOK_HOST:WEBHOOK_PORT в WEBHOOK_WORKERS процессах (порт общий, SO_REUSEPORT)
+WEBHOOK_BASE_URL = config('WEBHOOK_BASE_URL', default='')
+WEBHOOK_PATH = config('WEBHOOK_PATH', default='/webhook')
+WEBHOOK_SECRET = config('WEBHOOK_SECRET', default='')
+WEBHOOK_HOST = config('WEBHOOK_HOST', default='0.0.0.0')
+WEBHOOK_PORT = config('WEBHOOK_PORT', default=8080, cast=int)
+WEBHOOK_WORKERS = config('WEBHOOK_WORKERS', default=1, cast=int)
+# Эндпоинт метрик /metrics (при METRICS_ENABLED): в режиме webhook - на порту webhook,
+# в режиме polling - отдельный сервер METRICS_HOST:METRICS_PORT
+METRICS_HOST = config('METRICS_HOST', default='127.0.0.1')
+METRICS_PORT = config('METRICS_PORT', default=9100, cast=int)
+
+# Бот запущен и готов обрабатывать сообщения (для проверки готовности /readyz)
+bot_ready = False
+# Фоновый прогрев моделей, запускается после старта бота
+warmup_task = None
+# Сервер метрик режима polling
+metrics_runner = None
 
 # Функция, которая настроит командное меню (дефолтное для всех пользователей)
 async def set_commands():
@@ -13,27 +44,59 @@ async def set_commands():
 
 
 # Функция, которая выполнится когда бот запустится
-async def start_bot():
-    await set_commands()
-    await create_table_users()
-    await create_table_dialog_history()
+async def start_bot(notify_admins: bool = True):
+    global bot_ready, warmup_task, metrics_runner
+    with log_duration('startup', logger.info):
+        with log_duration('startup: commands', logger.info):
+            await set_commands()
+        with log_duration('startup: database', logger.info):
+            await open_db()
+            await create_table_users()
+            await create_table_dialog_history()
+            await create_table_dialog_summary()
+            await create_table_dialog_mode()
+            await open_dialogs_db()
+        with log_duration('startup: answer cache', logger.info):
+            await load_answer_cache()
+    bot_ready = True
+    if metrics.METRICS_ENABLED and BOT_MODE != 'webhook':
+        metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+    # проверка серверов LLM и загрузка на них моделей идут в фоне
+    llm_pool.start()
+    # наблюдение за пересборкой Баз-Знаний
+    index_registry.start()
+    # модели загружаются в фоне, пока идет прогрев бот отвечает на сообщения заглушкой
+    warmup_task = asyncio.create_task(warm_up())
+    if not notify_admins:
+        return
     count_users = await get_all_users(count=True)
-    try:
-        for admin_id in admins:
-            await bot.send_message(admin_id, f'Я запущен🥳. Сейчас в базе данных <b>{count_users}</b> пользователей.')
-    except:
-        pass
+    await outbox.broadcast(admins, f'Я запущен🥳. Сейчас в базе данных <b>{count_users}</b> пользователей.')
 
 
 # Функция, которая выполнится когда бот завершит свою работу
-async def stop_bot():
-    try:
-        for admin_id in admins:
-            await bot.send_message(admin_id, 'Бот остановлен. За что?😔')
-    except:
-        pass
+async def stop_bot(notify_admins: bool = True):
+    global bot_ready
+    bot_ready = False
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    # запросы пользователей завершаются (или отменяются) до закрытия моделей и базы данных,
+    # иначе их ответы не попадут в историю
+    cancelled = await scheduler.close(SCHEDULER_SHUTDOWN_TIMEOUT)
+    if cancelled:
+        logger.warning(f'При остановке отменено запросов: {cancelled}')
+    await cancel_summaries()
+    await llm_pool.close()
+    await embedding_service.close()
+    await index_registry.close()
+    if notify_admins:
+        await outbox.broadcast(admins, 'Бот остановлен. За что?😔')
+    await close_dialogs_db()
+    await close_db()
 
-async def main():
+
+def setup_dispatcher():
     # регистрация роутеров
     dp.include_router(user_router)
     
@@ -41,6 +104,89 @@ async def main():
     dp.startup.register(start_bot)
     dp.shutdown.register(stop_bot)
 
+
+async def healthz(request: web.Request):
+    """Процесс жив."""
+    return web.json_response({'status': 'ok'})
+
+
+async def readyz(request: web.Request):
+    """Бот запущен (база данных открыта), модели прогреты, обновления принимаются."""
+    ready = bot_ready and is_warmed_up()
+    status = 200 if ready else 503
+    return web.json_response({'ready': ready, 'started': bot_ready, 'warmed_up': is_warmed_up(),
+                              'scheduler': scheduler.stats()}, status=status)
+
+
+def create_webhook_app() -> web.Application:
+    """
+    aiohttp-приложение для режима webhook.
+    Обновление проверяется по секретному токену, Telegram сразу получает ответ 200,
+    а обработка идет в фоновой задаче.
+    """
+    app = web.Application()
+    app.router.add_get('/healthz', healthz)
+    app.router.add_get('/readyz', readyz)
+    if metrics.METRICS_ENABLED:
+        app.router.add_get('/metrics', metrics.metrics_handler)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None,
+                         handle_in_background=True).register(app, path=WEBHOOK_PATH)
+    # запуск и остановка диспетчера (start_bot и stop_bot) вместе с приложением
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def serve_webhook(worker: int):
+    # администраторов уведомляет только первый процесс
+    dp['notify_admins'] = worker == 0
+    web.run_app(create_webhook_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                reuse_port=WEBHOOK_WORKERS > 1, print=None)
+
+
+def run_webhook_worker(worker: int):
+    setup_dispatcher()
+    serve_webhook(worker)
+
+
+async def set_webhook():
+    try:
+        await bot.set_webhook(f'{WEBHOOK_BASE_URL.rstrip("/")}{WEBHOOK_PATH}', secret_token=WEBHOOK_SECRET or None,
+                              allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=True)
+    finally:
+        await bot.session.close()
+
+
+def run_webhook():
+    """
+    Запуск в режиме webhook. Webhook регистрируется один раз, затем запускаются
+    WEBHOOK_WORKERS процессов с общим портом: ядро распределяет между ними входящие соединения.
+    Каждый процесс загружает свою копию моделей (см. INDEX_MMAP для общих страниц индексов).
+
+    Сообщения одного пользователя попадают в разные процессы, поэтому при нескольких процессах
+    данные пользователей читаются из базы без кэша, история пишется сразу (см. db_funk.MULTI_PROCESS),
+    а очередь запросов пользователя (FairScheduler) у каждого процесса своя: порядок обработки
+    сообщений пользователя, отбрасывание повторов и отмена генерации при завершении диалога
+    действуют только в пределах одного процесса.
+    """
+    setup_dispatcher()
+    asyncio.run(set_webhook())
+    if WEBHOOK_WORKERS <= 1:
+        serve_webhook(0)
+        return
+    logger.warning(f'Запуск {WEBHOOK_WORKERS} процессов webhook: кэши пользователей и отложенная запись истории '
+                   f'отключены, очередь и отмена запросов пользователя работают в пределах одного процесса')
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_webhook_worker, args=(worker,), name=f'webhook-{worker}')
+               for worker in range(WEBHOOK_WORKERS)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+async def main():
+    setup_dispatcher()
+
     # запуск бота в режиме long polling при запуске бот очищает все обновления, которые были за его моменты бездействия
     try:
         await bot.delete_webhook(drop_pending_updates=True)
@@ -50,4 +196,7 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main())
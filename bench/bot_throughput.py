@@ -0,0 +1,241 @@
+""" Нагрузочный тест бота без Telegram и Ollama.
+
+Синтетические сообщения пользователей подаются в диспетчер (dp.feed_update) и проходят
+через user_router целиком: база данных (временный SQLite), планировщик, эмбеддинги и поиск
+по небольшой Базе-Знаний, генерация и отправка ответа. Сессия бота подменяется заглушкой,
+которая отвечает на запросы Bot API с заданной задержкой, модели - заглушками из bench/stubs.py.
+С --ollama-backends N генерация идет через пул серверов LLM (rag/llm_pool.py) на N HTTP-заглушках
+Ollama (bench/ollama_stub.py), каждая обрабатывает --ollama-parallel запросов одновременно.
+
+Отчет: сообщений в секунду, перцентили времени ответа, задержки event loop
+(блокирующий вызов в обработчике сразу заметен по ним) и длительности этапов из utils/metrics.py.
+
+Пример:
+    python -m bench.bot_throughput --users 20 --messages 10 --llm-first-token 0.3 --json result.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from loguru import logger
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+# Кусочки Базы-Знаний для поиска (содержание не важно, важны размер и общие слова с вопросами)
+CORPUS = [f'Раздел {i}. Документ описывает настройку модуля {i % 17} и обработку {i % 5} в системе 1С, '
+          f'функция Обработка{i} вызывается из общего модуля Сервер{i % 11}.' for i in range(500)]
+QUESTIONS = ['Как настроить модуль {n}?', 'Где вызывается функция Обработка{n}?',
+             'Что делает общий модуль Сервер{n}?', 'Опиши обработку {n} в системе']
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API, которая не ходит в сеть: отвечает с задержкой latency и считает запросы."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self._message_id += 1
+            return Message(message_id=getattr(method, 'message_id', None) or self._message_id,
+                           date=datetime.now(), chat=Chat(id=method.chat_id, type='private'), text=method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def prepare_environment(tmp_dir: str, args):
+    """Настройки бота для теста: все файлы во временном каталоге, очереди без ограничений."""
+    os.environ.update({
+        'BOT_API_KEY': '123456:BENCHMARK',
+        'ADMINS': '1',
+        'LOG_DIR': f'{tmp_dir}/',
+        'RAG_DB_DIR': f'{tmp_dir}/rag',
+        'DB_BACKEND': 'sqlite',
+        'DB_PATH': f'{tmp_dir}/bench.db',
+        'DIALOGS_DB_PATH': f'{tmp_dir}/dialogs.db',
+        'ANSWER_CACHE_ENABLED': str(args.answer_cache),
+        'STREAM_RESPONSES': str(not args.no_stream),
+        'MAX_CONCURRENT_GENERATIONS': str(args.generations),
+        'SCHEDULER_MAX_QUEUE': '1000000',
+        'SCHEDULER_MAX_USER_QUEUE': '1000000',
+        'METRICS_ENABLED': 'True',
+        'LLM_HEALTH_INTERVAL': '0',
+        'LOG_STDERR': 'False',
+    })
+
+
+def build_index(db_dir: str, embeddings):
+    """Небольшая База-Знаний с лексическим индексом."""
+    from langchain_community.vectorstores import FAISS
+    from rag.lexical import LexicalIndex
+    ids = [f'bench:{i}' for i in range(len(CORPUS))]
+    db = FAISS.from_texts(CORPUS, embeddings, metadatas=[{'source': 'bench', 'page': i} for i in range(len(CORPUS))],
+                          ids=ids)
+    db.save_local(db_dir)
+    lexical = LexicalIndex()
+    lexical.add(ids, CORPUS)
+    lexical.save(db_dir)
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), text=text,
+        chat=Chat(id=user_id, type='private'),
+        from_user=User(id=user_id, is_bot=False, first_name=f'user{user_id}')))
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    """Запаздывание пробуждения event loop относительно заданного интервала."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+def percentiles(values) -> dict:
+    if not len(values):
+        return {}
+    values = np.asarray(values) * 1000
+    return {f'p{q}_ms': round(float(np.percentile(values, q)), 2) for q in (50, 95, 99)} | \
+        {'max_ms': round(float(values.max()), 2)}
+
+
+async def start_ollama_stubs(args) -> list:
+    """HTTP-заглушки Ollama для пула серверов LLM (адреса записываются в LLM_BACKENDS)."""
+    from bench.ollama_stub import OllamaStub, start_stub
+    runners, backends = [], []
+    for i in range(args.ollama_backends):
+        stub = OllamaStub(models=(), parallel=args.ollama_parallel, first_token=args.llm_first_token,
+                          token_interval=args.llm_token_interval, tokens=args.llm_tokens, seed=i)
+        runner, url = await start_stub(stub)
+        runners.append(runner)
+        backends.append(f'{url}||{args.ollama_parallel}')
+    if backends:
+        os.environ['LLM_BACKENDS'] = ','.join(backends)
+    return runners
+
+
+async def run(args) -> dict:
+    tmp_dir = tempfile.mkdtemp(prefix='bot_bench_')
+    prepare_environment(tmp_dir, args)
+    stub_runners = await start_ollama_stubs(args)
+    # отладочный вывод loguru в консоль не нужен (логи бота пишутся в файлы временного каталога)
+    logger.remove()
+
+    import create_bot
+    import aiogram_run
+    from bench.stubs import HashingEmbeddings, StubChatModel
+    from utils import metrics
+
+    # модели и сессия Telegram - заглушки
+    create_bot.embeddings.factory = lambda: HashingEmbeddings(latency=args.embed_latency)
+    if not args.ollama_backends:
+        llm = StubChatModel(first_token=args.llm_first_token, token_interval=args.llm_token_interval,
+                            tokens=args.llm_tokens)
+        create_bot.get_llm = lambda name: llm
+    session = FakeSession(args.telegram_latency)
+    session.middleware(metrics.TelegramMetricsMiddleware())
+    create_bot.bot.session = session
+    build_index(create_bot.index_db_path, create_bot.embeddings)
+
+    bot, dp = create_bot.bot, create_bot.dp
+    aiogram_run.setup_dispatcher()
+    await aiogram_run.start_bot(notify_admins=False)
+    await aiogram_run.warmup_task
+
+    update_ids = iter(range(1, 10 ** 9))
+    users = [1000 + i for i in range(args.users)]
+    for user_id in users:
+        await dp.feed_update(bot, make_update(next(update_ids), user_id, '/start'))
+        await dp.feed_update(bot, make_update(next(update_ids), user_id, 'Начать диалог'))
+
+    latencies = []
+    lag = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+
+    async def user_session(user_id: int):
+        for i in range(args.messages):
+            text = QUESTIONS[(user_id + i) % len(QUESTIONS)].format(n=(user_id * 7 + i) % 50)
+            start = time.perf_counter()
+            await dp.feed_update(bot, make_update(next(update_ids), user_id, text))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_session(user_id) for user_id in users))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    await aiogram_run.stop_bot(notify_admins=False)
+    for runner in stub_runners:
+        await runner.cleanup()
+
+    stages = {}
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        key = name + ''.join(f'[{value}]' for _, value in labels)
+        # длительности переводятся в миллисекунды, остальные величины (prompt_tokens) - как есть
+        scale, unit = (1000, '_ms') if name.endswith('_seconds') else (1, '')
+        stages[key] = {'count': histogram.count,
+                       **{f'p{q}{unit}': round(histogram.percentile(q) * scale, 2) for q in (50, 95, 99)}}
+    return {
+        'settings': vars(args),
+        'messages': len(latencies),
+        'elapsed_s': round(elapsed, 2),
+        'messages_per_s': round(len(latencies) / elapsed, 2),
+        'latency': percentiles(latencies),
+        'loop_lag': percentiles(lag),
+        'telegram_requests': dict(session.requests),
+        'stages': stages,
+        'tmp_dir': tmp_dir,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{report['messages']} сообщений за {report['elapsed_s']} с: {report['messages_per_s']} сообщений/с",
+             f"время ответа: {report['latency']}",
+             f"задержка event loop: {report['loop_lag']}",
+             f"запросы Bot API: {report['telegram_requests']}"]
+    lines += [f'  {name}: {values}' for name, values in report['stages'].items()]
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота с заглушками Telegram и моделей')
+    parser.add_argument('--users', type=int, default=10, help='количество одновременно пишущих пользователей')
+    parser.add_argument('--messages', type=int, default=5, help='сообщений от каждого пользователя (по очереди)')
+    parser.add_argument('--generations', type=int, default=2, help='MAX_CONCURRENT_GENERATIONS')
+    parser.add_argument('--llm-first-token', type=float, default=0.2, help='задержка первого токена LLM, с')
+    parser.add_argument('--llm-token-interval', type=float, default=0.005, help='интервал между токенами LLM, с')
+    parser.add_argument('--llm-tokens', type=int, default=50, help='длина ответа LLM в токенах')
+    parser.add_argument('--embed-latency', type=float, default=0.02, help='задержка вызова модели эмбеддингов, с')
+    parser.add_argument('--ollama-backends', type=int, default=0,
+                        help='генерация через пул LLM на N HTTP-заглушках Ollama (0 - заглушка модели в процессе)')
+    parser.add_argument('--ollama-parallel', type=int, default=1, help='одновременных генераций на заглушке Ollama')
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help='задержка запроса к Bot API, с')
+    parser.add_argument('--no-stream', action='store_true', help='ответ одним сообщением (STREAM_RESPONSES=False)')
+    parser.add_argument('--answer-cache', action='store_true', help='включить кэш ответов')
+    parser.add_argument('--json', help='файл для сохранения отчета в JSON')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(format_report(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
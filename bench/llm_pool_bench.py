@@ -0,0 +1,118 @@
+""" Нагрузочный тест пула серверов LLM (rag/llm_pool.py) на заглушках Ollama (bench/ollama_stub.py).
+
+Запускает --backends заглушек в текущем процессе и отправляет через пул --requests потоковых
+запросов, не больше --concurrency одновременно. Отчет: запросов в секунду, перцентили времени
+первого токена и полного ответа, распределение запросов по серверам, ошибки и загрузки моделей.
+
+--stop-backend N --stop-after S останавливает сервер N через S секунд после начала
+(проверка повтора запроса на другом сервере и размыкания цепи).
+
+Пример:
+    python -m bench.llm_pool_bench --backends 3 --parallel 2 --requests 200 --concurrency 16 --stop-backend 0 --stop-after 2
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+from loguru import logger
+
+from bench.ollama_stub import add_stub_arguments, start_stub, stub_from_args
+from rag.llm_pool import LLMBackend, LLMPool
+
+
+def percentiles(values) -> dict:
+    if not len(values):
+        return {}
+    values = np.asarray(values) * 1000
+    return {f'p{q}_ms': round(float(np.percentile(values, q)), 1) for q in (50, 95, 99)}
+
+
+async def run(args) -> dict:
+    stubs, runners, urls = [], [], []
+    for i in range(args.backends):
+        stub = stub_from_args(args, seed=i)
+        runner, url = await start_stub(stub)
+        stubs.append(stub)
+        runners.append(runner)
+        urls.append(url)
+    model = args.models.split(',')[0]
+    pool = LLMPool([LLMBackend(url, max_concurrency=args.parallel) for url in urls],
+                   keep_alive=args.keep_alive, retries=args.retries, failures=args.failures,
+                   cooldown=args.cooldown, health_interval=args.health_interval, resident_models=[model])
+    if args.health_interval:
+        await pool.check_all()
+        pool.start()
+    llm = pool.client(model)
+
+    first_tokens, totals, errors = [], [], Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def request(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            try:
+                async for _ in llm.astream([HumanMessage(content=f'вопрос {i}')]):
+                    if first is None:
+                        first = time.perf_counter() - start
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                return
+            first_tokens.append(first)
+            totals.append(time.perf_counter() - start)
+
+    async def stop_backend():
+        await asyncio.sleep(args.stop_after)
+        logger.info(f'остановка сервера {urls[args.stop_backend]}')
+        await runners[args.stop_backend].cleanup()
+
+    stopper = asyncio.create_task(stop_backend()) if args.stop_backend is not None else None
+    start = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    if stopper is not None:
+        await stopper
+    await pool.close()
+    for runner in runners:
+        await runner.cleanup()
+
+    return {
+        'settings': vars(args),
+        'elapsed_s': round(elapsed, 2),
+        'requests_per_s': round(len(totals) / elapsed, 2),
+        'completed': len(totals),
+        'errors': dict(errors),
+        'first_token': percentiles(first_tokens),
+        'total': percentiles(totals),
+        'backends': [{'url': url, 'requests': stub.requests, 'model_loads': stub.loads}
+                     for url, stub in zip(urls, stubs)],
+        'pool': pool.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Нагрузочный тест пула серверов LLM на заглушках Ollama')
+    parser.add_argument('--backends', type=int, default=2, help='количество серверов-заглушек')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8, help='одновременных запросов')
+    parser.add_argument('--keep-alive', default='30m')
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--failures', type=int, default=3)
+    parser.add_argument('--cooldown', type=float, default=30)
+    parser.add_argument('--health-interval', type=float, default=1)
+    parser.add_argument('--stop-backend', type=int, default=None, help='номер сервера, который будет остановлен')
+    parser.add_argument('--stop-after', type=float, default=1.0)
+    parser.add_argument('--json', help='файл для сохранения отчета в JSON')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=1))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,182 @@
+""" HTTP-заглушка сервера Ollama для тестов пула LLM (rag/llm_pool.py) и нагрузочных тестов.
+
+Поддерживаются запросы, которые делают бот и ChatOllama:
+- POST /api/chat - ответ из tokens слов (потоком NDJSON или одним JSON при "stream": false);
+- POST /api/generate без промпта - загрузка модели в память;
+- GET /api/tags, GET /api/ps - список моделей и загруженные модели.
+
+Как у Ollama: одновременно генерируется не больше parallel ответов (остальные ждут),
+незагруженная модель сначала загружается load_time секунд и выгружается через keep_alive
+секунд после последнего запроса (по умолчанию 5 минут, -1 - никогда).
+fail_rate - доля запросов /api/chat, на которые заглушка отвечает ошибкой 500.
+
+Пример:
+    python -m bench.ollama_stub --port 11435 --parallel 2 --first-token 0.3 --load-time 5
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+DEFAULT_KEEP_ALIVE = 300
+
+
+def parse_keep_alive(value) -> float:
+    """Время keep_alive в секундах: число, строка вида "30s", "5m", "1h" или -1 (не выгружать)."""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float('inf') if value < 0 else float(value)
+    match = re.fullmatch(r'(-?\d+(?:\.\d+)?)([smh]?)', value.strip())
+    if not match:
+        return DEFAULT_KEEP_ALIVE
+    number = float(match.group(1))
+    if number < 0:
+        return float('inf')
+    return number * {'': 1, 's': 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+
+class OllamaStub:
+    def __init__(self, models=('qwen2.5-coder:1.5b',), parallel: int = 1, first_token: float = 0.2,
+                 token_interval: float = 0.01, tokens: int = 50, load_time: float = 0.0, fail_rate: float = 0.0,
+                 seed: int = 0):
+        self.models = set(models)
+        self.first_token = first_token
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.load_time = load_time
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.slots = asyncio.Semaphore(parallel)
+        self.loaded = {}        # модель -> время выгрузки (time.monotonic)
+        self.loading = {}       # модель -> задача загрузки
+        self.requests = 0
+        self.loads = 0
+
+    def known(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+    async def ensure_loaded(self, model: str, keep_alive) -> float:
+        """Загрузка модели, если она не в памяти. Возвращает время загрузки (с)."""
+        now = time.monotonic()
+        duration = 0.0
+        if self.loaded.get(model, 0) <= now:
+            if model not in self.loading:
+                self.loads += 1
+                self.loading[model] = asyncio.ensure_future(asyncio.sleep(self.load_time))
+            start = time.perf_counter()
+            await asyncio.shield(self.loading[model])
+            self.loading.pop(model, None)
+            duration = time.perf_counter() - start
+        self.loaded[model] = time.monotonic() + parse_keep_alive(keep_alive)
+        return duration
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def _chunk(self, model: str, content: str, done: bool = False, **extra) -> dict:
+        return {'model': model, 'created_at': self._now(), 'message': {'role': 'assistant', 'content': content},
+                'done': done, **extra}
+
+    async def chat(self, request: web.Request):
+        body = await request.json()
+        model = body.get('model', '')
+        self.requests += 1
+        if not self.known(model):
+            return web.json_response({'error': f"model '{model}' not found"}, status=404)
+        if self.fail_rate and self.random.random() < self.fail_rate:
+            return web.json_response({'error': 'stub failure'}, status=500)
+
+        async with self.slots:
+            load_duration = await self.ensure_loaded(model, body.get('keep_alive'))
+            prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in body.get('messages', []))
+            summary = {'done_reason': 'stop', 'load_duration': int(load_duration * 1e9),
+                       'prompt_eval_count': prompt_tokens, 'eval_count': self.tokens}
+            words = [f'слово{i} ' for i in range(self.tokens)]
+            await asyncio.sleep(self.first_token)
+            if not body.get('stream', True):
+                await asyncio.sleep(self.token_interval * max(0, self.tokens - 1))
+                return web.json_response(self._chunk(model, ''.join(words), True, **summary))
+
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            await response.prepare(request)
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(self.token_interval)
+                await response.write(json.dumps(self._chunk(model, word)).encode() + b'\n')
+            await response.write(json.dumps(self._chunk(model, '', True, **summary)).encode() + b'\n')
+            await response.write_eof()
+            return response
+
+    async def generate(self, request: web.Request):
+        body = await request.json()
+        model = body.get('model', '')
+        if not self.known(model):
+            return web.json_response({'error': f"model '{model}' not found"}, status=404)
+        if body.get('prompt'):
+            return web.json_response({'error': 'stub supports only model loading'}, status=400)
+        if parse_keep_alive(body.get('keep_alive')) == 0:
+            self.loaded.pop(model, None)
+            load_duration = 0.0
+        else:
+            load_duration = await self.ensure_loaded(model, body.get('keep_alive'))
+        return web.json_response({'model': model, 'created_at': self._now(), 'response': '', 'done': True,
+                                  'done_reason': 'load', 'load_duration': int(load_duration * 1e9)})
+
+    async def tags(self, request: web.Request):
+        return web.json_response({'models': [{'name': model, 'model': model} for model in sorted(self.models)]})
+
+    async def ps(self, request: web.Request):
+        now = time.monotonic()
+        return web.json_response({'models': [{'name': model, 'model': model}
+                                             for model, until in self.loaded.items() if until > now]})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/api/chat', self.chat)
+        app.router.add_post('/api/generate', self.generate)
+        app.router.add_get('/api/tags', self.tags)
+        app.router.add_get('/api/ps', self.ps)
+        return app
+
+
+async def start_stub(stub: OllamaStub, host: str = '127.0.0.1', port: int = 0):
+    """Запуск заглушки в текущем event loop. Возвращает (AppRunner, адрес сервера)."""
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://{host}:{port}'
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--models', default='qwen2.5-coder:1.5b', help='модели через запятую')
+    parser.add_argument('--parallel', type=int, default=1, help='одновременных генераций (OLLAMA_NUM_PARALLEL)')
+    parser.add_argument('--first-token', type=float, default=0.2, help='задержка первого токена, с')
+    parser.add_argument('--token-interval', type=float, default=0.01, help='интервал между токенами, с')
+    parser.add_argument('--tokens', type=int, default=50, help='длина ответа в токенах')
+    parser.add_argument('--load-time', type=float, default=0.0, help='время загрузки модели, с')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля ответов с ошибкой 500')
+
+
+def stub_from_args(args, seed: int = 0) -> OllamaStub:
+    return OllamaStub(models=args.models.split(','), parallel=args.parallel, first_token=args.first_token,
+                      token_interval=args.token_interval, tokens=args.tokens, load_time=args.load_time,
+                      fail_rate=args.fail_rate, seed=seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Заглушка HTTP API Ollama')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(stub_from_args(args).app(), host=args.host, port=args.port)
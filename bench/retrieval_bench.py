@@ -0,0 +1,268 @@
+""" Бенчмарк построения Базы-Знаний и поиска по ней.
+
+Измеряется:
+- скорость индексации (страниц/с, кусочков/с) через rag.ingest.update_index;
+- размер индекса на диске и прирост памяти процесса после загрузки;
+- время холодной загрузки (FAISS.load_local и rag.faiss_index.load_index с mmap);
+- задержка запроса при разных k для векторного, лексического (BM25) и гибридного поиска;
+- качество поиска (recall@k и MRR) по размеченным вопросам.
+
+По умолчанию используется синтетический корпус (текстовые "PDF" с уникальными фактами на каждой
+странице и вопросами к ним) и детерминированные эмбеддинги из bench/stubs.py, поэтому тест
+воспроизводим и работает без сети. Для реального корпуса: --pdf-dir с PDF и --questions с JSON-списком
+{"question": ..., "source": путь относительно --pdf-dir, "page": номер страницы}, --embeddings e5.
+
+Результат сохраняется в JSON (--json), --baseline сравнивает с предыдущим прогоном.
+
+Пример:
+    python -m bench.retrieval_bench --docs 40 --pages 5 --k 1,5,10 --json retrieval.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+
+from rag import ingest
+from rag.embedding_service import search_by_vectors
+from rag.faiss_index import INDEX_TYPES, load_index
+from rag.index_registry import INDEX_FILES
+from rag.lexical import LEXICAL_NAME, load_lexical, reciprocal_rank_fusion
+
+# Слова для заполнения страниц синтетического корпуса
+VOCABULARY = ('документ справочник регистр обработка отчет модуль форма реквизит таблица запрос '
+              'проведение остатки номенклатура контрагент договор склад цена валюта период '
+              'настройка права пользователь роль обмен выгрузка загрузка журнал печать '
+              'сервер клиент кэш индекс транзакция блокировка ошибка версия конфигурация').split()
+PAGE_SEPARATOR = '\f'
+
+
+def load_text_pages(rel: str, full_path: str):
+    """Чтение синтетического "PDF": страницы текстового файла разделены символом перевода страницы."""
+    from langchain_core.documents import Document
+    with open(full_path, encoding='utf-8') as f:
+        pages = f.read().split(PAGE_SEPARATOR)
+    return rel, [Document(page_content=text, metadata={'source': full_path, 'page': page})
+                 for page, text in enumerate(pages)]
+
+
+def make_synthetic_corpus(pdf_dir: str, docs: int, pages: int, words: int = 250, seed: int = 0) -> list:
+    """
+    Создает синтетический корпус и размеченные вопросы.
+    На каждой странице есть уникальный идентификатор (вопрос с точным именем)
+    и уникальное сочетание слов (вопрос без имени).
+    """
+    rng = random.Random(seed)
+    questions = []
+    os.makedirs(pdf_dir, exist_ok=True)
+    for d in range(docs):
+        rel = f'doc{d:04d}.pdf'
+        texts = []
+        for p in range(pages):
+            ident = f'Реквизит{d}x{p}'
+            topic = ' '.join(rng.sample(VOCABULARY, 3))
+            filler = [' '.join(rng.choices(VOCABULARY, k=12)) + '.' for _ in range(words // 12)]
+            filler.insert(rng.randrange(len(filler) + 1), f'Параметр {ident} определяет {topic} для раздела {d}.')
+            texts.append(' '.join(filler))
+            questions.append({'question': f'Что определяет параметр {ident}?', 'source': rel, 'page': p})
+            questions.append({'question': f'Где описано {topic} раздела {d}?', 'source': rel, 'page': p})
+        with open(os.path.join(pdf_dir, rel), 'w', encoding='utf-8') as f:
+            f.write(PAGE_SEPARATOR.join(texts))
+    return questions
+
+
+def get_embeddings(name: str):
+    if name == 'stub':
+        from bench.stubs import HashingEmbeddings
+        return HashingEmbeddings(size=256)
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name='intfloat/multilingual-e5-large', model_kwargs={'device': 'cpu'})
+
+
+def rss_bytes():
+    """Текущий размер резидентной памяти процесса (Linux) или None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def percentiles_ms(values) -> dict:
+    values = np.asarray(values) * 1000
+    return {f'p{q}_ms': round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+
+def bench_ingest(embeddings, db_dir: str, pdf_dir: str, workers: int, batch_size: int,
+                 index_type: str, params: dict, loader=ingest.load_pdf) -> dict:
+    start = time.perf_counter()
+    _, plan = ingest.update_index(embeddings, db_dir, pdf_dir, workers=workers, batch_size=batch_size,
+                                  index_type=index_type, params=params, loader=loader)
+    elapsed = time.perf_counter() - start
+    manifest = ingest.load_manifest(db_dir)
+    pages = sum(entry['pages'] for entry in manifest['files'].values())
+    chunks = sum(len(entry['chunk_ids']) for entry in manifest['files'].values())
+    return {
+        'files': len(manifest['files']),
+        'pages': pages,
+        'chunks': chunks,
+        'seconds': round(elapsed, 2),
+        'pages_per_s': round(pages / elapsed, 1),
+        'chunks_per_s': round(chunks / elapsed, 1),
+    }
+
+
+def bench_load(embeddings, db_dir: str) -> dict:
+    """Размер на диске, время холодной загрузки и прирост памяти процесса."""
+    from langchain_community.vectorstores import FAISS
+    sizes = {name: os.path.getsize(os.path.join(db_dir, name))
+             for name in INDEX_FILES + (LEXICAL_NAME,) if os.path.exists(os.path.join(db_dir, name))}
+    result = {'disk_mb': {name: round(size / 2 ** 20, 3) for name, size in sizes.items()}}
+
+    for name, loader in (('load_local', lambda: FAISS.load_local(db_dir, embeddings,
+                                                                 allow_dangerous_deserialization=True)),
+                         ('mmap', lambda: load_index(db_dir, embeddings, mmap=True)),
+                         ('lexical', lambda: load_lexical(db_dir))):
+        before = rss_bytes()
+        start = time.perf_counter()
+        loaded = loader()
+        result[f'{name}_s'] = round(time.perf_counter() - start, 4)
+        after = rss_bytes()
+        if before is not None and after is not None:
+            result[f'{name}_rss_mb'] = round((after - before) / 2 ** 20, 2)
+        del loaded
+    return result
+
+
+def chunk_key(doc, pdf_dir: str):
+    return os.path.relpath(doc.metadata.get('source', ''), pdf_dir), doc.metadata.get('page')
+
+
+def rank_of(docs, target, pdf_dir: str):
+    for rank, doc in enumerate(docs, 1):
+        if chunk_key(doc, pdf_dir) == target:
+            return rank
+    return None
+
+
+def bench_search(embeddings, db_dir: str, pdf_dir: str, questions: list, ks: list, candidates: int) -> dict:
+    """Задержка и качество векторного, лексического и гибридного поиска."""
+    from langchain_community.vectorstores import FAISS
+    store = FAISS.load_local(db_dir, embeddings, allow_dangerous_deserialization=True)
+    lexical = load_lexical(db_dir)
+    max_k = max(ks)
+    vectors = embeddings.embed_documents([q['question'] for q in questions])
+
+    def dense(vector, question, k):
+        return search_by_vectors(store, [vector], k)[0]
+
+    def bm25(vector, question, k):
+        docs = [store.docstore.search(doc_id) for doc_id, _ in lexical.search(question, k)]
+        return [doc for doc in docs if not isinstance(doc, str)]
+
+    def hybrid(vector, question, k):
+        fused = reciprocal_rank_fusion([dense(vector, question, max(k, candidates)),
+                                        bm25(vector, question, max(k, candidates))],
+                                       key=lambda doc: doc.page_content)
+        return fused[:k]
+
+    methods = {'dense': dense}
+    if lexical is not None:
+        methods.update(bm25=bm25, hybrid=hybrid)
+
+    result = {}
+    for name, method in methods.items():
+        latency = {}
+        for k in ks:
+            timings = []
+            for question, vector in zip(questions, vectors):
+                start = time.perf_counter()
+                method(vector, question['question'], k)
+                timings.append(time.perf_counter() - start)
+            latency[f'k={k}'] = percentiles_ms(timings)
+
+        ranks = [rank_of(method(vector, q['question'], max_k), (q['source'], q['page']), pdf_dir)
+                 for q, vector in zip(questions, vectors)]
+        quality = {f'recall@{k}': round(float(np.mean([r is not None and r <= k for r in ranks])), 4) for k in ks}
+        quality['mrr'] = round(float(np.mean([1 / r if r else 0.0 for r in ranks])), 4)
+        result[name] = {'latency': latency, 'quality': quality}
+    return result
+
+
+def compare(result: dict, baseline: dict, prefix: str = '') -> list:
+    """Числовые значения, изменившиеся относительно предыдущего прогона."""
+    lines = []
+    for key, value in result.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            lines += compare(value, old or {}, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old != value:
+            change = f' ({(value - old) / old:+.1%})' if old else ''
+            lines.append(f'{prefix}{key}: {old} -> {value}{change}')
+    return lines
+
+
+def run(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix='retrieval_bench_')
+    db_dir = os.path.join(work_dir, 'db')
+    if args.pdf_dir:
+        pdf_dir = args.pdf_dir
+        with open(args.questions, encoding='utf-8') as f:
+            questions = json.load(f)
+        loader = ingest.load_pdf
+    else:
+        pdf_dir = os.path.join(work_dir, 'pdf')
+        questions = make_synthetic_corpus(pdf_dir, args.docs, args.pages, seed=args.seed)
+        loader = load_text_pages
+    embeddings = get_embeddings(args.embeddings)
+
+    params = {key: value for key, value in (('nlist', args.nlist), ('pq_m', args.pq_m)) if value}
+    ks = [int(k) for k in args.k.split(',')]
+    return {
+        'settings': {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+        'questions': len(questions),
+        'ingest': bench_ingest(embeddings, db_dir, pdf_dir, args.workers, args.batch_size, args.index_type, params,
+                               loader),
+        'load': bench_load(embeddings, db_dir),
+        'search': bench_search(embeddings, db_dir, pdf_dir, questions, ks, args.candidates),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Бенчмарк индексации и поиска по Базе-Знаний')
+    parser.add_argument('--pdf-dir', help='каталог с реальными PDF (по умолчанию - синтетический корпус)')
+    parser.add_argument('--questions', help='JSON с размеченными вопросами для --pdf-dir')
+    parser.add_argument('--docs', type=int, default=40, help='документов в синтетическом корпусе')
+    parser.add_argument('--pages', type=int, default=5, help='страниц в синтетическом документе')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--embeddings', choices=('stub', 'e5'), default='stub')
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--pq-m', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--k', default='1,5,10', help='значения k через запятую')
+    parser.add_argument('--candidates', type=int, default=20, help='кандидатов каждого поиска для гибридного')
+    parser.add_argument('--json', help='файл для сохранения результата')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args()
+    if args.pdf_dir and not args.questions:
+        parser.error('для --pdf-dir нужен --questions')
+    # построчный отладочный вывод индексации не нужен
+    logger.remove()
+    logger.add(sys.stderr, level='INFO')
+
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=1))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            print('\n'.join(compare(result, json.load(f))) or 'Изменений нет')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,80 @@
+""" Заглушки моделей для бенчмарков: работают без сети, GPU и Ollama.
+
+HashingEmbeddings - детерминированные эмбеддинги "мешок слов" (слова хэшируются в измерения),
+тексты с общими словами получаются близкими, поэтому поиск по ним осмысленный.
+StubChatModel - имитация ChatOllama с настраиваемой задержкой первого токена и скоростью генерации.
+"""
+
+import asyncio
+import copy
+import hashlib
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.lexical import tokenize
+
+
+class HashingEmbeddings(Embeddings):
+    """Детерминированные эмбеддинги по хэшам слов с имитацией задержки модели."""
+
+    def __init__(self, size: int = 256, latency: float = 0.0, per_text_latency: float = 0.0):
+        """
+        :param size: Размерность векторов.
+        :param latency: Задержка одного вызова (секунды), имитирует накладные расходы модели.
+        :param per_text_latency: Дополнительная задержка на каждый текст пачки.
+        """
+        self.size = size
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text: str):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.size] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        # блокирующая задержка, как у настоящей модели: вызывается в пуле потоков
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class StubChatModel:
+    """Имитация клиента ChatOllama (ainvoke, astream и bind)."""
+
+    def __init__(self, first_token: float = 0.2, token_interval: float = 0.01, tokens: int = 50):
+        """
+        :param first_token: Задержка до первого токена (секунды).
+        :param token_interval: Интервал между следующими токенами.
+        :param tokens: Количество токенов ответа.
+        """
+        self.first_token = first_token
+        self.token_interval = token_interval
+        self.tokens = tokens
+
+    def bind(self, **options) -> 'StubChatModel':
+        """Копия заглушки с параметрами модели; num_predict ограничивает количество токенов ответа."""
+        stub = copy.copy(self)
+        if options.get('num_predict'):
+            stub.tokens = min(self.tokens, options['num_predict'])
+        return stub
+
+    async def astream(self, messages, **kwargs):
+        await asyncio.sleep(self.first_token)
+        for i in range(self.tokens):
+            if i:
+                await asyncio.sleep(self.token_interval)
+            yield SimpleNamespace(content=f'слово{i} ')
+
+    async def ainvoke(self, messages, **kwargs):
+        parts = [chunk.content async for chunk in self.astream(messages)]
+        return SimpleNamespace(content=''.join(parts))
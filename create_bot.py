@@ -1,102 +1,307 @@
+import asyncio
+import functools
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-import aiosqlite  
 from decouple import config
-from loguru import logger
 
-from langchain_ollama import ChatOllama
-from langchain_community.vectorstores import FAISS
 from langchain_core.messages import HumanMessage
+import numpy as np
 
+from db_handler.db_funk import (create_table_answer_cache, get_answer_cache_entries, save_answer_cache_entry,
+                                get_user_mode_dialog, get_users_cache_stats, get_dialog_summary,
+                                get_unsummarized_history, save_dialog_summary, HISTORY_MAX_TURNS)
+from db_handler.dialog import DialogDatabase
+from rag.answer_cache import SemanticAnswerCache, make_namespace, normalize
+from rag.embedding_service import EmbeddingService
+from rag.faiss_index import load_index
+from rag.index_registry import IndexRegistry
+from rag.lazy_embeddings import LazyEmbeddings
+from rag.lexical import reciprocal_rank_fusion
+from rag.llm_pool import LLMPool, parse_backends
+from utils.cache import LRUCache, MISSING
+from utils import metrics
+from utils.logging_setup import setup_logging, payload, log_event
+from utils.outbox import Outbox
+from utils.scheduler import FairScheduler
+from utils.utils import estimate_tokens, log_duration
 
-logger.add(f"{config('LOG_DIR')}chat.log", format="{time} {level} {message}", level="DEBUG", rotation="100 KB", compression="zip")
 
-# настраиваем логирование и выводим в переменную для отдельного использования в нужных местах
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', filename=f'{config('LOG_DIR')}chat.log')
+# настраиваем логирование (loguru и logging пишут в chat.log через фоновую очередь, см. utils/logging_setup.py)
+# и выводим в переменную для отдельного использования в нужных местах
+setup_logging(config('LOG_DIR'))
 logger = logging.getLogger(__name__)
 
-def get_index_db():
+def get_embeddings():
     """
-    Функция для получения или создания векторной Базы-Знаний.
-    Если база уже существует, она загружается из файла,
-    иначе происходит чтение PDF-документов и создание новой базы.
+        Создание модели векторных представлений (Embeddings).
     """
-    logger.debug('...get_index_db')
-    # Создание векторных представлений (Embeddings)
     logger.debug('Embeddings')
     from langchain_huggingface import HuggingFaceEmbeddings
     model_id = 'intfloat/multilingual-e5-large'
     model_kwargs = {'device': 'cpu'} # Настройка для использования CPU (можно переключить на GPU)
     # model_kwargs = {'device': 'cuda'}
-    embeddings = HuggingFaceEmbeddings(
+    return HuggingFaceEmbeddings(
         model_name=model_id,
         model_kwargs=model_kwargs
     )
 
-    db_file_name = f'{config('RAG_DB_DIR')}/db_internal'
-    
-    # Загрузка векторной Базы-Знаний из файла
-    logger.debug('Загрузка векторной Базы-Знаний из файла')
-    file_path = db_file_name + "/index.faiss"
-    import os.path
-    # Проверка наличия файла с векторной Базой-Знаний
-    if os.path.exists(file_path):
-        logger.debug('Уже существует векторная База-знаний')
-        # Загрузка существующей Базы-Знаний
-        db = FAISS.load_local(db_file_name, embeddings, allow_dangerous_deserialization=True)
-
-    return db
 
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
-def get_text_response(question, history):
+async def open_dialogs_db():
+    """
+        Открытие базы диалогов (вызывается при запуске бота).
+        Соединение sqlite создается и используется только в потоке dialogs_executor.
+    """
+    global dialogs_db
+    if dialogs_db is None:
+        loop = asyncio.get_running_loop()
+        dialogs_db = await loop.run_in_executor(dialogs_executor, DialogDatabase, DIALOGS_DB_PATH)
+
+
+async def close_dialogs_db():
+    global dialogs_db
+    if dialogs_db is not None:
+        await asyncio.get_running_loop().run_in_executor(dialogs_executor, dialogs_db.close)
+        dialogs_db = None
+    dialog_settings_cache.clear()
+
+
+async def get_dialog_settings(mode):
+    """
+        Настройки диалога (режима) mode: имя, модель LLM и путь к векторной Базе-Знаний.
+        Если диалог не описан в базе диалогов или отключен, используются настройки по умолчанию.
+        Запрос к базе диалогов выполняется в потоке dialogs_executor, результат кэшируется.
+    """
+    settings = dialog_settings_cache.get(mode)
+    if settings is MISSING:
+        if dialogs_db is None:
+            raise RuntimeError('База диалогов не открыта (open_dialogs_db)')
+        dialog = await asyncio.get_running_loop().run_in_executor(dialogs_executor, dialogs_db.get_dialog, mode)
+        if dialog is None or not dialog['enabled']:
+            settings = {'name': mode, 'model_name': model_name, 'vector_db_path': index_db_path}
+        else:
+            settings = {'name': dialog['name'], 'model_name': dialog['model_name'],
+                        'vector_db_path': dialog['vector_db_path']}
+        dialog_settings_cache.set(mode, settings)
+    return settings
+
+
+async def get_user_dialog(user_id):
+    """
+        Настройки диалога, выбранного пользователем.
+    """
+    mode = await get_user_mode_dialog(user_id)
+    return await get_dialog_settings(mode['mode'] if mode else DEFAULT_DIALOG_MODE)
+
+
+def get_llm(name):
+    """
+        Клиент LLM для модели name (создается один раз на модель).
+        Запросы распределяются по серверам пула llm_pool.
+    """
+    if name not in llms:
+        llms[name] = llm_pool.client(name)
+    return llms[name]
+
+
+def is_warmed_up():
+    """
+        Завершен ли прогрев моделей (до этого на сообщения отвечает заглушка).
+    """
+    return warmed_up
+
+
+async def warm_up():
+    """
+        Фоновый прогрев после запуска бота: загрузка модели эмбеддингов и пробный эмбеддинг,
+        загрузка Базы-Знаний по умолчанию и короткая генерация, чтобы Ollama загрузила модель в память.
+        Ошибка этапа не останавливает прогрев: соответствующая модель загрузится при первом запросе.
+    """
+    global warmed_up
+    settings = await get_dialog_settings(DEFAULT_DIALOG_MODE)
+    with log_duration('warm-up', logger.info):
+        try:
+            with log_duration('warm-up: embeddings', logger.info):
+                await embedding_service.embed('warm-up')
+        except Exception as e:
+            logger.exception(e)
+        try:
+            with log_duration('warm-up: vector index', logger.info):
+                if settings['vector_db_path']:
+                    await index_registry.get(settings['name'], settings['vector_db_path'])
+        except Exception as e:
+            logger.exception(e)
+        try:
+            with log_duration('warm-up: llm', logger.info):
+                await get_llm(settings['model_name']).bind(num_predict=1).ainvoke([HumanMessage(content='ping')])
+        except Exception as e:
+            logger.exception(e)
+    warmed_up = True
+
+
+async def is_history_relevant(question, vector, history):
+    """
+        Проверка, зависит ли ответ на вопрос от предыдущих сообщений диалога.
+        Короткий вопрос при непустой истории считается уточнением, иначе вопрос сравнивается
+        по смыслу с предыдущими вопросами пользователя.
+    """
+    if history and history[-1].get('content') == question:
+        history = history[:-1]
+    previous = [msg['content'] for msg in history if msg.get('role') == 'user']
+    if not previous:
+        return False
+    if estimate_tokens(question) <= ANSWER_CACHE_FOLLOWUP_TOKENS:
+        return True
+    vectors = await embedding_service.embed_many(previous)
+    scores = np.stack([normalize(v) for v in vectors]) @ normalize(vector)
+    return bool(scores.max() >= ANSWER_CACHE_HISTORY_RELEVANCE)
+
+
+async def retrieve_docs(loaded, question, vector):
+    """
+        Поиск релевантных кусочков в Базе-Знаний.
+        Если у базы есть лексический индекс, кандидаты векторного поиска и BM25
+        объединяются методом RRF, после чего отбираются top-N.
+    """
+    if not HYBRID_SEARCH or loaded.lexical is None:
+        return await embedding_service.search(loaded.store, vector, NUMBER_RELEVANT_CHUNKS)
+    loop = asyncio.get_running_loop()
+    dense_docs, lexical_hits = await asyncio.gather(
+        embedding_service.search(loaded.store, vector, HYBRID_CANDIDATES),
+        loop.run_in_executor(rag_executor, loaded.lexical.search, question, HYBRID_CANDIDATES))
+    lexical_docs = [loaded.store.docstore.search(doc_id) for doc_id, _ in lexical_hits]
+    lexical_docs = [doc for doc in lexical_docs if not isinstance(doc, str)]
+    docs = reciprocal_rank_fusion([dense_docs, lexical_docs], k=HYBRID_RRF_K, key=lambda doc: doc.page_content)
+    return docs[:NUMBER_RELEVANT_CHUNKS]
+
+
+async def prepare_rag_request(question, history, dialog_settings):
+    """
+        Подготовка RAG-запроса: эмбеддинг вопроса, поиск в кэше ответов и по Базе-Знаний диалога.
+        Возвращает (вектор вопроса, пространство ключей кэша ответов или None, если ответ
+        не кэшируется, готовый ответ из кэша, контекст).
+    """
+    with metrics.timer('embedding_seconds'):
+        vector = await embedding_service.embed(question)
+    loaded = None
+    if dialog_settings['vector_db_path']:
+        loaded = await index_registry.get(dialog_settings['name'], dialog_settings['vector_db_path'])
+
+    namespace = None
+    if answer_cache is not None and not await is_history_relevant(question, vector, history):
+        namespace = make_namespace(dialog_settings['model_name'], RAG_PROMPT, loaded.version if loaded else '')
+        cached = answer_cache.lookup(namespace, vector)
+        if cached is not None:
+            logger.debug(f'answer cache hit: {cached[0]}')
+            metrics.inc('answer_cache_hits_total')
+            return vector, None, cached[1], None
+
+    if loaded is None:
+        return vector, namespace, None, ''
+    logger.debug('...prepare_rag_request: Similarity search')
+    with metrics.timer('retrieval_seconds'):
+        docs = await retrieve_docs(loaded, question, vector)
+    message_content = format_message_content(docs)
+    return vector, namespace, None, message_content
+
+
+async def remember_answer(namespace, question, vector, answer):
+    """
+        Сохранение ответа в кэш ответов (и в базу данных, если включено сохранение).
+    """
+    answer_cache.add(namespace, question, vector, answer)
+    if ANSWER_CACHE_PERSIST:
+        await save_answer_cache_entry(namespace, question,
+                                      np.asarray(vector, dtype=np.float32).tobytes(), answer)
+
+
+async def load_answer_cache():
+    """
+        Загрузка сохраненных ответов кэша.
+    """
+    if answer_cache is None or not ANSWER_CACHE_PERSIST:
+        return
+    await create_table_answer_cache()
+    for namespace, question, vector, answer in await get_answer_cache_entries(answer_cache.maxsize):
+        answer_cache.add(namespace, question, np.frombuffer(vector, dtype=np.float32), answer)
+    logger.debug(f'answer cache loaded: {len(answer_cache)}')
+
+
+async def get_text_response(question, history, dialog_settings=None):
+    """
+        Асинхронная RAG-генерация ответа.
+        Поиск по FAISS (вместе с расчетом эмбеддинга вопроса) выполняется в ограниченном пуле потоков,
+        генерация - асинхронным вызовом LLM, поэтому event loop бота не блокируется.
+        Количество одновременных генераций ограничено семафором rag_semaphore.
+        dialog_settings - настройки диалога (см. get_dialog_settings), по умолчанию диалог DEFAULT_DIALOG_MODE.
+    """
     logger.debug('RAG generation')
-    
-    message_content = get_message_content(question, index_db, NUMBER_RELEVANT_CHUNKS)
-    model_response = get_model_response(question, message_content, history)
-    
+    dialog_settings = dialog_settings or await get_dialog_settings(DEFAULT_DIALOG_MODE)
+    async with rag_semaphore:
+        vector, namespace, cached_answer, message_content = await prepare_rag_request(question, history,
+                                                                                      dialog_settings)
+        if cached_answer is not None:
+            return cached_answer
+        model_response = await get_model_response(question, message_content, history,
+                                                  dialog_settings['model_name'])
+
+    if namespace is not None:
+        await remember_answer(namespace, question, vector, model_response)
     return model_response
 
-def get_message_content(topic, index_db, NUMBER_RELEVANT_CHUNKS):
+
+async def stream_text_response(question, history, dialog_settings=None):
+    """
+        Потоковый вариант get_text_response: после поиска по Базе-Знаний
+        отдает ответ LLM частями по мере генерации.
+        Слот семафора rag_semaphore удерживается до конца генерации.
     """
-        Функция для извлечения релевантных кусочков текста из Базы-Знаний.
-        Выполняется поиск по схожести, извлекаются top-N релевантных частей.
+    logger.debug('RAG streaming generation')
+    dialog_settings = dialog_settings or await get_dialog_settings(DEFAULT_DIALOG_MODE)
+    async with rag_semaphore:
+        vector, namespace, cached_answer, message_content = await prepare_rag_request(question, history,
+                                                                                      dialog_settings)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+        model_response = ''
+        async for text in stream_model_response(question, message_content, history,
+                                                dialog_settings['model_name']):
+            model_response += text
+            yield text
+
+    if namespace is not None and model_response:
+        await remember_answer(namespace, question, vector, model_response)
+
+
+def format_message_content(docs):
+    """
+        Форматирование извлеченных кусочков текста для промпта.
     """
-    # Similarity search
     import re
-    logger.debug('...get_message_content: Similarity search')
-    docs = index_db.similarity_search(topic, k = NUMBER_RELEVANT_CHUNKS)
-    # Форматирование извлеченных данных
     message_content = re.sub(r'\n{2}', ' ', '\n '.join([f'\n#### {i+1} Relevant chunk ####\n' + str(doc.metadata) + '\n' + doc.page_content + '\n' for i, doc in enumerate(docs)]))
-    logger.debug(message_content)
+    logger.debug('context: %s', payload(message_content))
     return message_content
 
 
-def get_model_response(topic, message_content, dialog):
-    """
-        Функция для генерации ответа модели на основе переданного контекста и вопроса.
-        Используется LLM для создания ответа, используя переданный контекст.
-    """
-    logger.debug('...get_model_response')
+# Промпт
+# RAG_PROMPT = """Ты являешься помощником для выполнения заданий по ответам на вопросы. 
+# Вот контекст, который нужно использовать для ответа на вопрос:
+# {context} 
+# Внимательно подумайте над приведенным контекстом. 
+# Теперь просмотрите вопрос пользователя:
+# {question}
+# По указанному контексту сформулируй подробный ответ на запрос. 
+# Добавь названия файлов, по которым сформирован ответ
+# Ответ:"""
 
-    # Загрузка модели для обработки языка (LLM)
-    logger.debug('LLM')
-
-    # Промпт
-    # rag_prompt = """Ты являешься помощником для выполнения заданий по ответам на вопросы. 
-    # Вот контекст, который нужно использовать для ответа на вопрос:
-    # {context} 
-    # Внимательно подумайте над приведенным контекстом. 
-    # Теперь просмотрите вопрос пользователя:
-    # {question}
-    # По указанному контексту сформулируй подробный ответ на запрос. 
-    # Добавь названия файлов, по которым сформирован ответ
-    # Ответ:"""
-
-    rag_prompt = """Ты помощник программиста, помогаешь писать код.
+RAG_PROMPT = """Ты помощник программиста, помогаешь писать код.
     Вот контекст, который нужно использовать для ответа на вопрос:
     {context}    
     Вот история вашего общения:
@@ -107,32 +312,295 @@ def get_model_response(topic, message_content, dialog):
     Если пишешь пример выделяй его ``` ```. Все пояснения должны быть на русском языке. 
     Ответ:"""
 
-    # Формирование запроса для LLM
-    rag_prompt_formatted = rag_prompt.format(context=message_content, question=topic, hystory=dialog)
-    generation = llm.invoke([HumanMessage(content=rag_prompt_formatted)])
+
+SUMMARY_PROMPT = """Ты помощник программиста. Кратко перескажи диалог с пользователем.
+    Сохрани вопросы пользователя, принятые решения, важные детали (имена объектов, тексты ошибок, фрагменты кода)
+    и то, что осталось невыясненным. Пиши на русском языке, не больше 10 предложений.
+    Краткое содержание начала диалога:
+    {summary}
+    Продолжение диалога:
+    {dialog}
+    Краткое содержание всего диалога:"""
+
+
+def format_dialog_message(msg):
+    if msg.get('role') == 'system':
+        return f"Краткое содержание начала диалога: {msg.get('content')}"
+    return f"{msg.get('role')}: {msg.get('content')}"
+
+
+def format_dialog_history(dialog):
+    """
+        Представление истории диалога в виде строк "роль: текст" для промпта
+        (краткое содержание начала диалога - отдельной строкой).
+    """
+    return '\n'.join(format_dialog_message(msg) for msg in dialog)
+
+
+def schedule_summary(user_id, dialog, model=None):
+    """
+        Запуск фонового сжатия истории диалога (см. summarize_dialog), если сообщения после
+        краткого содержания заняли не меньше SUMMARY_TRIGGER_TOKENS токенов или HISTORY_MAX_TURNS сообщений.
+        dialog - история, попавшая в промпт, вместе с ответом на нее.
+        Для одного пользователя одновременно выполняется не больше одного сжатия.
+    """
+    if not SUMMARY_ENABLED or user_id in summary_tasks:
+        return
+    turns = [msg for msg in dialog if msg.get('role') != 'system']
+    if len(turns) <= SUMMARY_KEEP_TURNS:
+        return
+    tokens = sum(estimate_tokens(msg.get('content', '')) for msg in turns)
+    if tokens < SUMMARY_TRIGGER_TOKENS and len(turns) < HISTORY_MAX_TURNS:
+        return
+    task = asyncio.create_task(summarize_dialog(user_id, model))
+    summary_tasks[user_id] = task
+    task.add_done_callback(lambda _: summary_tasks.pop(user_id, None))
+
+
+async def summarize_dialog(user_id, model=None):
+    """
+        Сжатие истории диалога: сообщения, кроме последних SUMMARY_KEEP_TURNS, вместе с прежним кратким
+        содержанием пересказываются LLM, и новое содержание сохраняется в базу.
+        Следующие запросы получают в промпте краткое содержание и сообщения после него,
+        поэтому размер промпта не растет с длиной диалога.
+    """
+    start = time.perf_counter()
+    try:
+        with metrics.timer('summary_seconds'):
+            summary, last_id = await get_dialog_summary(user_id) or ('', 0)
+            # сообщения старше SUMMARY_MAX_MESSAGES последних в промпт уже не попадали и в содержание не входят
+            rows = await get_unsummarized_history(user_id, last_id, SUMMARY_MAX_MESSAGES)
+            rows = rows[:len(rows) - SUMMARY_KEEP_TURNS]
+            if not rows:
+                return
+            prompt = SUMMARY_PROMPT.format(summary=summary or 'нет',
+                                           dialog=format_dialog_history([msg for _, msg in rows]))
+            async with summary_semaphore:
+                generation = await get_llm(SUMMARY_MODEL or model or model_name).bind(
+                    num_predict=SUMMARY_MAX_TOKENS).ainvoke([HumanMessage(content=prompt)])
+            saved = await save_dialog_summary(user_id, generation.content.strip(), rows[-1][0])
+        log_event('summary', user_id, time.perf_counter() - start, messages=len(rows), saved=saved)
+        metrics.inc('dialog_summaries_total', labels={'result': 'ok' if saved else 'stale'})
+    except Exception as e:
+        logger.exception(e)
+        metrics.inc('dialog_summaries_total', labels={'result': 'error'})
+
+
+async def cancel_summaries():
+    """
+        Отмена фоновых сжатий истории (при остановке бота).
+    """
+    tasks = list(summary_tasks.values())
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+def build_rag_prompt(topic, message_content, dialog):
+    """
+        Формирование запроса для LLM из контекста, истории диалога и вопроса.
+    """
+    return [HumanMessage(content=RAG_PROMPT.format(context=message_content, question=topic,
+                                                   hystory=format_dialog_history(dialog)))]
+
+
+async def get_model_response(topic, message_content, dialog, model=None):
+    """
+        Функция для генерации ответа модели на основе переданного контекста и вопроса.
+        Используется LLM для создания ответа, используя переданный контекст.
+    """
+    logger.debug('...get_model_response')
+    prompt = build_rag_prompt(topic, message_content, dialog)
+    observe_prompt_size(prompt)
+    with metrics.timer('llm_seconds'):
+        generation = await get_llm(model or model_name).ainvoke(prompt)
     model_response = generation.content
-    logger.debug(model_response)
+    logger.debug('model response: %s', payload(model_response))
     return model_response
 
+
+async def stream_model_response(topic, message_content, dialog, model=None):
+    """
+        Потоковая генерация ответа модели: текст отдается частями по мере генерации токенов.
+    """
+    logger.debug('...stream_model_response')
+    prompt = build_rag_prompt(topic, message_content, dialog)
+    observe_prompt_size(prompt)
+    start = time.perf_counter()
+    first_token = True
+    async for chunk in get_llm(model or model_name).astream(prompt):
+        if chunk.content:
+            if first_token:
+                metrics.observe('llm_first_token_seconds', time.perf_counter() - start)
+                first_token = False
+            yield chunk.content
+    metrics.observe('llm_seconds', time.perf_counter() - start)
+
+
+def observe_prompt_size(prompt):
+    """
+        Размер промпта в токенах (оценка) для метрик.
+    """
+    if metrics.METRICS_ENABLED:
+        metrics.observe('prompt_tokens', sum(estimate_tokens(message.content) for message in prompt),
+                        buckets=PROMPT_TOKENS_BUCKETS)
+
+
 # model_name = "llama3.2:3b"
 model_name = "qwen2.5-coder:1.5b"
 
 NUMBER_RELEVANT_CHUNKS = 5# Количество релевантных кусков для извлечения
 
-llm = ChatOllama(model=model_name, temperature=0.5)
-llm_json_mode = ChatOllama(model=model_name, temperature=0.4, format="json")
+# Гибридный поиск: по HYBRID_CANDIDATES кандидатов из векторного и лексического (BM25) индексов
+# объединяются методом RRF с константой HYBRID_RRF_K
+HYBRID_SEARCH = config('HYBRID_SEARCH', default=True, cast=bool)
+HYBRID_CANDIDATES = config('HYBRID_CANDIDATES', default=20, cast=int)
+HYBRID_RRF_K = config('HYBRID_RRF_K', default=60, cast=int)
+
+# Пул потоков для блокирующих операций RAG (эмбеддинг вопроса и поиск по FAISS)
+rag_executor = ThreadPoolExecutor(max_workers=config('RAG_THREADS', default=2, cast=int),
+                                  thread_name_prefix='rag')
+# Глобальное ограничение количества одновременно выполняемых генераций
+MAX_CONCURRENT_GENERATIONS = config('MAX_CONCURRENT_GENERATIONS', default=2, cast=int)
+rag_semaphore = asyncio.Semaphore(MAX_CONCURRENT_GENERATIONS)
+
+# Планировщик запросов: у пользователя выполняется не более одного запроса, пользователи
+# обслуживаются по кругу; при SCHEDULER_MAX_QUEUE ожидающих запросах (или SCHEDULER_MAX_USER_QUEUE
+# у одного пользователя) новые отклоняются
+scheduler = FairScheduler(concurrency=config('SCHEDULER_CONCURRENCY', default=MAX_CONCURRENT_GENERATIONS, cast=int),
+                          max_queue=config('SCHEDULER_MAX_QUEUE', default=50, cast=int),
+                          max_user_queue=config('SCHEDULER_MAX_USER_QUEUE', default=3, cast=int))
+# при остановке бота выполняющиеся запросы дожидаются не дольше SCHEDULER_SHUTDOWN_TIMEOUT секунд
+SCHEDULER_SHUTDOWN_TIMEOUT = config('SCHEDULER_SHUTDOWN_TIMEOUT', default=20, cast=float)
+
+# Потоковая выдача ответа: редактирование сообщения не чаще STREAM_EDIT_INTERVAL секунд
+# и только если накопилось не меньше STREAM_MIN_CHARS новых символов
+STREAM_RESPONSES = config('STREAM_RESPONSES', default=True, cast=bool)
+STREAM_EDIT_INTERVAL = config('STREAM_EDIT_INTERVAL', default=1.0, cast=float)
+STREAM_MIN_CHARS = config('STREAM_MIN_CHARS', default=40, cast=int)
+
+# Сжатие истории диалога (см. summarize_dialog): когда сообщения после краткого содержания занимают
+# SUMMARY_TRIGGER_TOKENS токенов, все, кроме последних SUMMARY_KEEP_TURNS, пересказываются моделью
+# SUMMARY_MODEL (по умолчанию - модель диалога) в ответ не длиннее SUMMARY_MAX_TOKENS токенов.
+# Одновременно выполняется не больше SUMMARY_CONCURRENCY сжатий.
+SUMMARY_ENABLED = config('SUMMARY_ENABLED', default=True, cast=bool)
+SUMMARY_TRIGGER_TOKENS = config('SUMMARY_TRIGGER_TOKENS', default=1200, cast=int)
+SUMMARY_KEEP_TURNS = config('SUMMARY_KEEP_TURNS', default=4, cast=int)
+SUMMARY_MAX_MESSAGES = config('SUMMARY_MAX_MESSAGES', default=40, cast=int)
+SUMMARY_MAX_TOKENS = config('SUMMARY_MAX_TOKENS', default=300, cast=int)
+SUMMARY_MODEL = config('SUMMARY_MODEL', default='')
+summary_semaphore = asyncio.Semaphore(config('SUMMARY_CONCURRENCY', default=1, cast=int))
+# Выполняющиеся сжатия по пользователям
+summary_tasks = {}
+
+# Серверы LLM (Ollama): записи "адрес|модели|лимит" через запятую (см. rag/llm_pool.py), например
+# "http://localhost:11434|qwen2.5-coder:1.5b|2, http://gpu:11434||4". Лимит одновременных запросов
+# сервера (по умолчанию LLM_BACKEND_CONCURRENCY) стоит задавать равным его OLLAMA_NUM_PARALLEL.
+# Запрос идет на наименее загруженный сервер, при ошибке повторяется на другом (не больше LLM_RETRIES раз);
+# после LLM_CIRCUIT_FAILURES ошибок подряд сервер исключается на LLM_CIRCUIT_COOLDOWN секунд.
+# Каждые LLM_HEALTH_INTERVAL секунд серверы проверяются, модели LLM_RESIDENT_MODELS (по умолчанию - модель
+# по умолчанию) загружаются в память, если Ollama их выгрузила; LLM_KEEP_ALIVE - сколько Ollama держит
+# модель после запроса ("30m", секунды, -1 - не выгружать).
+llm_pool = LLMPool(
+    parse_backends(config('LLM_BACKENDS', default='http://localhost:11434'),
+                   default_concurrency=config('LLM_BACKEND_CONCURRENCY', default=1, cast=int)),
+    keep_alive=config('LLM_KEEP_ALIVE', default='30m'),
+    retries=config('LLM_RETRIES', default=1, cast=int),
+    failures=config('LLM_CIRCUIT_FAILURES', default=3, cast=int),
+    cooldown=config('LLM_CIRCUIT_COOLDOWN', default=30, cast=float),
+    health_interval=config('LLM_HEALTH_INTERVAL', default=15, cast=float),
+    resident_models=config('LLM_RESIDENT_MODELS', default=model_name,
+                           cast=lambda value: [name.strip() for name in value.split(',') if name.strip()]),
+    timeout=config('LLM_TIMEOUT', default=300, cast=float),
+)
+# Клиенты LLM по именам моделей (см. get_llm)
+llms = {}
+# Модели прогреты (см. warm_up)
+warmed_up = False
 
 logger.debug(msg="init complete")
 # получаем список администраторов из .env
 admins = [int(admin_id) for admin_id in config('ADMINS').split(',')]
 
-# инициируем объект, который будет отвечать за взаимодействие с базой данных
-db_path = 'my_database.db'  # Путь к файлу базы данных SQLite
-db_manager = aiosqlite.connect(db_path)
-
 # инициируем объект бота, передавая ему parse_mode=ParseMode.HTML по умолчанию
 bot = Bot(token=config('BOT_API_KEY'), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+# Исходящие сообщения: не больше OUTBOX_RATE в секунду во все чаты и OUTBOX_CHAT_RATE в секунду
+# в один чат (до OUTBOX_CHAT_BURST подряд), рассылки - не больше OUTBOX_BULK_RATE в секунду;
+# после ответа Telegram 429 сообщение отправляется повторно (не больше OUTBOX_MAX_RETRIES раз)
+outbox = Outbox(bot,
+                rate=config('OUTBOX_RATE', default=30, cast=float),
+                chat_rate=config('OUTBOX_CHAT_RATE', default=1, cast=float),
+                chat_burst=config('OUTBOX_CHAT_BURST', default=3, cast=int),
+                bulk_rate=config('OUTBOX_BULK_RATE', default=10, cast=float),
+                max_retries=config('OUTBOX_MAX_RETRIES', default=3, cast=int))
+
 # инициируем объект бота
 dp = Dispatcher()
-index_db = get_index_db()
\ No newline at end of file
+# Модель эмбеддингов загружается при прогреве (warm_up) или при первом запросе
+embeddings = LazyEmbeddings(get_embeddings)
+# База-Знаний по умолчанию (для диалогов без собственных настроек)
+index_db_path = f"{config('RAG_DB_DIR')}/db_internal"
+
+# Векторные Базы-Знаний диалогов загружаются при первом обращении,
+# при превышении INDEX_MEMORY_BUDGET_MB выгружаются давно не использованные.
+# Файлы загруженных баз проверяются каждые INDEX_WATCH_INTERVAL секунд (0 - не проверять):
+# пересобранная база загружается в фоне и после проверки заменяет старую (см. IndexRegistry.reload),
+# вручную перезагрузка выполняется командой администратора /reload_index
+# INDEX_MMAP - отображать index.faiss в память (страницы индекса общие для всех процессов бота),
+# INDEX_NPROBE и INDEX_EF_SEARCH - точность поиска для индексов ivfpq и hnsw (0 - значение FAISS)
+index_loader = functools.partial(load_index,
+                                 mmap=config('INDEX_MMAP', default=False, cast=bool),
+                                 nprobe=config('INDEX_NPROBE', default=0, cast=int),
+                                 ef_search=config('INDEX_EF_SEARCH', default=0, cast=int))
+index_registry = IndexRegistry(embeddings, rag_executor,
+                               memory_budget=config('INDEX_MEMORY_BUDGET_MB', default=2048, cast=int) * 2 ** 20,
+                               loader=index_loader,
+                               watch_interval=config('INDEX_WATCH_INTERVAL', default=30, cast=float))
+
+# Диалоги (режимы) бота: настройки хранятся в базе диалогов DialogDatabase
+DEFAULT_DIALOG_MODE = config('DEFAULT_DIALOG_MODE', default='get_help_developer')
+DIALOGS_DB_PATH = config('DIALOGS_DB_PATH', default='dialogs.db')
+# база диалогов открывается при запуске бота (open_dialogs_db), запросы к ней не блокируют event loop
+dialogs_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dialogs-db')
+dialogs_db = None
+dialog_settings_cache = LRUCache(maxsize=256, ttl=60)
+
+# Эмбеддинги вопросов собираются в пачки в течение EMBED_BATCH_WINDOW_MS миллисекунд
+embedding_service = EmbeddingService(
+    embeddings, rag_executor,
+    batch_window=config('EMBED_BATCH_WINDOW_MS', default=5, cast=float) / 1000,
+    max_batch=config('EMBED_MAX_BATCH', default=32, cast=int),
+    cache_size=config('EMBED_CACHE_SIZE', default=1024, cast=int),
+)
+
+# Кэш ответов по смыслу вопроса. Ключ включает модель, шаблон промпта и версию Базы-Знаний.
+ANSWER_CACHE_ENABLED = config('ANSWER_CACHE_ENABLED', default=True, cast=bool)
+ANSWER_CACHE_PERSIST = config('ANSWER_CACHE_PERSIST', default=False, cast=bool)
+# вопрос при непустой истории считается уточнением, если он не длиннее ANSWER_CACHE_FOLLOWUP_TOKENS токенов
+# или близок к одному из предыдущих вопросов не меньше чем на ANSWER_CACHE_HISTORY_RELEVANCE
+ANSWER_CACHE_FOLLOWUP_TOKENS = config('ANSWER_CACHE_FOLLOWUP_TOKENS', default=8, cast=int)
+ANSWER_CACHE_HISTORY_RELEVANCE = config('ANSWER_CACHE_HISTORY_RELEVANCE', default=0.85, cast=float)
+answer_cache = SemanticAnswerCache(
+    threshold=config('ANSWER_CACHE_THRESHOLD', default=0.95, cast=float),
+    maxsize=config('ANSWER_CACHE_SIZE', default=1000, cast=int),
+) if ANSWER_CACHE_ENABLED else None
+# Метрики (METRICS_ENABLED): длительность этапов обработки сообщения, размер промпта,
+# загрузка планировщика, доля попаданий в кэши и запросы к Telegram
+PROMPT_TOKENS_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+if metrics.METRICS_ENABLED:
+    bot.session.middleware(metrics.TelegramMetricsMiddleware())
+    metrics.register_gauge('scheduler_active', lambda: scheduler.stats()['active'], 'выполняющиеся запросы')
+    metrics.register_gauge('scheduler_queued', lambda: scheduler.stats()['queued'], 'запросы в очереди')
+    metrics.register_gauge('embedding_cache_hit_rate', lambda: embedding_service.cache.stats()['hit_rate'],
+                           'доля эмбеддингов вопросов из кэша')
+    metrics.register_gauge('users_cache_hit_rate', lambda: get_users_cache_stats()['hit_rate'],
+                           'доля обращений к users из кэша')
+    metrics.register_gauge('index_memory_bytes', index_registry.total_size, 'размер загруженных Баз-Знаний')
+    metrics.register_gauge('llm_backends_available',
+                           lambda: sum(b['healthy'] and not b['circuit_open'] for b in llm_pool.stats()),
+                           'доступные серверы LLM')
+    if answer_cache is not None:
+        metrics.register_gauge('answer_cache_hit_rate', lambda: answer_cache.stats()['hit_rate'],
+                               'доля ответов из кэша ответов')
@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+# Настройки SQLite для долгоживущих соединений:
+# WAL позволяет читать параллельно с записью, synchronous=NORMAL в режиме WAL
+# не делает fsync на каждый commit, остальное - кэш страниц и временные таблицы в памяти
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+)
+
+# Размер кэша подготовленных выражений sqlite3 для каждого соединения
+CACHED_STATEMENTS = 256
+
+
+class SQLitePool:
+    """
+    Пул долгоживущих соединений с SQLite.
+
+    Одно соединение используется для записи (запись сериализуется блокировкой),
+    несколько соединений - только для чтения и выбираются по кругу.
+    Соединения открываются один раз при старте бота и закрываются при остановке,
+    подготовленные выражения переиспользуются через кэш sqlite3.
+    """
+
+    def __init__(self, db_path: str, readers: int = 2):
+        """
+        :param db_path: Путь к файлу базы данных SQLite.
+        :param readers: Количество соединений для чтения.
+        """
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self._writer = None
+        self._readers = []
+        self._next_reader = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path, cached_statements=CACHED_STATEMENTS)
+        conn.row_factory = aiosqlite.Row
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    async def open(self):
+        """Открывает соединения (повторный вызов ничего не делает)."""
+        if self._writer is not None:
+            return
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            # соединение на запись открывается первым, чтобы включить WAL до открытия читателей
+            writer = await self._connect()
+            self._readers = [await self._connect(read_only=True) for _ in range(self.readers_count)]
+            self._next_reader = itertools.cycle(self._readers)
+            self._writer = writer
+
+    async def close(self):
+        """Закрывает все соединения."""
+        async with self._write_lock:
+            for conn in self._readers:
+                await conn.close()
+            if self._writer is not None:
+                await self._writer.close()
+            self._readers = []
+            self._writer = None
+
+    @asynccontextmanager
+    async def write(self):
+        """
+        Транзакция на запись: все выражения внутри блока фиксируются одним commit,
+        при исключении транзакция откатывается.
+        """
+        await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    async def execute(self, sql: str, params=()):
+        """Выполняет одно выражение на запись в отдельной транзакции."""
+        async with self.write() as conn:
+            cursor = await conn.execute(sql, params)
+            return cursor.rowcount
+
+    async def fetchall(self, sql: str, params=()):
+        """Выполняет запрос на чтение и возвращает все строки."""
+        await self.open()
+        return await next(self._next_reader).execute_fetchall(sql, params)
+
+    async def fetchone(self, sql: str, params=()):
+        """Выполняет запрос на чтение и возвращает первую строку или None."""
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
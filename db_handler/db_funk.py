@@ -1,144 +1,228 @@
-import json
-import aiosqlite
-from sqlalchemy import BigInteger, Integer, String, TIMESTAMP, JSON, Boolean
+from contextlib import nullcontext
+
 from decouple import config
 
-# Путь к базе данных SQLite
-db_path = config('DB_PATH')
+from db_handler.history_writer import HistoryWriter
+from db_handler.storage import create_storage
+from utils.utils import estimate_tokens
+from utils.cache import LRUCache, MISSING
+from utils import metrics
+
+# Хранилище данных: DB_BACKEND=sqlite - файл DB_PATH, DB_BACKEND=postgres - база PG_LINK
+# (пул от DB_POOL_MIN до DB_POOL_MAX соединений)
+DB_BACKEND = config('DB_BACKEND', default='sqlite')
+# Долгоживущие соединения с базой: открываются при старте бота и закрываются при остановке
+storage = create_storage(DB_BACKEND,
+                         db_path=config('DB_PATH', default=None),
+                         dsn=config('PG_LINK', default=None),
+                         readers=config('DB_READERS', default=2, cast=int),
+                         pool_min=config('DB_POOL_MIN', default=1, cast=int),
+                         pool_max=config('DB_POOL_MAX', default=10, cast=int))
+
+# Несколько процессов бота (BOT_MODE=webhook и WEBHOOK_WORKERS > 1): сообщения одного пользователя
+# попадают в разные процессы, поэтому состояние пользователя не должно храниться в памяти процесса -
+# кэши users и dialog_mode и отложенная запись истории в этом режиме отключены
+MULTI_PROCESS = config('BOT_MODE', default='polling') == 'webhook' and config('WEBHOOK_WORKERS', default=1, cast=int) > 1
+
+# Отложенная запись истории диалогов: сообщения всех пользователей пишутся в базу пачками
+# раз в HISTORY_FLUSH_MS миллисекунд или при накоплении HISTORY_FLUSH_ROWS сообщений (см. HistoryWriter)
+HISTORY_WRITE_BEHIND = config('HISTORY_WRITE_BEHIND', default=True, cast=bool) and not MULTI_PROCESS
+history_writer = HistoryWriter(storage, interval=config('HISTORY_FLUSH_MS', default=5, cast=float) / 1000,
+                               max_rows=config('HISTORY_FLUSH_ROWS', default=100, cast=int)) \
+    if HISTORY_WRITE_BEHIND else None
+
+# Ограничения истории диалога, которая попадает в промпт:
+# не больше HISTORY_MAX_TURNS последних сообщений и не больше HISTORY_TOKEN_BUDGET токенов
+HISTORY_MAX_TURNS = config('HISTORY_MAX_TURNS', default=20, cast=int)
+HISTORY_TOKEN_BUDGET = config('HISTORY_TOKEN_BUDGET', default=2000, cast=int)
+
+# Кэш записей таблицы users (в том числе отсутствующих пользователей).
+# Все изменения users проходят через функции этого модуля и сразу отражаются в кэше.
+# Если с одной базой PostgreSQL работают несколько независимых экземпляров бота, изменения из других
+# экземпляров видны не позже чем через USERS_CACHE_TTL секунд - для них TTL стоит уменьшить.
+# В режиме нескольких процессов (MULTI_PROCESS) кэш не используется (размер 0).
+USERS_CACHE_SIZE = 0 if MULTI_PROCESS else config('USERS_CACHE_SIZE', default=10000, cast=int)
+users_cache = LRUCache(maxsize=USERS_CACHE_SIZE, ttl=config('USERS_CACHE_TTL', default=600, cast=float))
+# Кэш выбранных пользователями режимов диалога (таблица dialog_mode)
+modes_cache = LRUCache(maxsize=USERS_CACHE_SIZE, ttl=config('USERS_CACHE_TTL', default=600, cast=float))
+
+
+# Функция для открытия соединений с базой данных
+async def open_db():
+    await storage.open()
+    if history_writer is not None:
+        history_writer.start()
+
+
+# Функция для закрытия соединений с базой данных (сначала записываются отложенные сообщения)
+async def close_db():
+    if history_writer is not None:
+        await history_writer.close()
+    await storage.close()
+
+
+# Функция для чтения истории пользователя вместе с еще не записанными в базу сообщениями
+def pending_history(user_id: int):
+    if history_writer is None:
+        return nullcontext([])
+    return history_writer.read(user_id)
+
+
 # Функция для создания таблицы пользователей
 async def create_table_users():
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            full_name TEXT,
-            user_login TEXT,
-            in_dialog BOOLEAN,
-            date_reg TIMESTAMP
-        )
-        ''')
-        await db.commit()
+    await storage.create_table_users()
 
 
 async def create_table_dialog_history():
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS dialog_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id BIGINT,
-            message TEXT,
-            data_message TEXT
-        )
-        ''')
-        await db.commit()
+    await storage.create_table_dialog_history()
+
+async def create_table_dialog_summary():
+    await storage.create_table_dialog_summary()
 
 async def create_table_dialog_mode():
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS dialog_mode (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id BIGINT,
-            mode TEXT
-        )
-        ''')
-        await db.commit()
+    await storage.create_table_dialog_mode()
+
+async def create_table_answer_cache():
+    await storage.create_table_answer_cache()
 
 # Функция для получения информации по конкретному пользователю
 async def get_user_data(user_id: int):
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user_data = await cursor.fetchone()
-        if user_data:
-            return dict(user_data)
-        return None
+    user_data = users_cache.get(user_id)
+    if user_data is MISSING:
+        user_data = await storage.get_user(user_id)
+        users_cache.set(user_id, user_data)
+    if user_data:
+        return dict(user_data)
+    return None
 
 # Функция для получения всех пользователей
 async def get_all_users(count=False):
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('SELECT * FROM users')
-        all_users = await cursor.fetchall()
-        if count:
-            return len(all_users)
-        else:
-            return [dict(user) for user in all_users]
+    if count:
+        return await storage.count_users()
+    return await storage.get_all_users()
 
 
 # Функция для добавления пользователя в базу данных
 async def insert_user(user_data: dict):
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('''
-        INSERT OR IGNORE INTO users (user_id, full_name, user_login, in_dialog, date_reg) 
-        VALUES (?, ?, ?, ?, ?)
-        ''', (user_data['user_id'], user_data['full_name'], user_data['user_login'], user_data['in_dialog'], user_data['date_reg']))
-        await db.commit()
+    inserted = await storage.insert_user(user_data['user_id'], user_data['full_name'], user_data['user_login'],
+                                         user_data['in_dialog'], user_data['date_reg'])
+    if inserted:
+        users_cache.set(user_data['user_id'], {key: user_data[key] for key in
+                                               ('user_id', 'full_name', 'user_login', 'in_dialog', 'date_reg')})
+    else:
+        # пользователь уже был в базе - актуальная запись будет прочитана при следующем обращении
+        users_cache.pop(user_data['user_id'])
+
+
+# Функция для получения истории диалога.
+# Если у диалога есть краткое содержание (см. create_bot.summarize_dialog), берутся только сообщения
+# после него, а само содержание возвращается первым сообщением с ролью system.
+# Еще не записанные в базу сообщения (отложенная запись) учитываются как самые новые.
+# Сообщения отбираются начиная с самых новых: не больше max_turns штук и пока суммарная оценка
+# токенов не превысит token_budget (самое новое сообщение возвращается всегда).
+# Результат возвращается в хронологическом порядке.
+async def get_dialog_history(user_id: int, max_turns: int = None, token_budget: int = None):
+    max_turns = HISTORY_MAX_TURNS if max_turns is None else max_turns
+    token_budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
 
-
-# Функция для получения истории диалога
-async def get_dialog_history(user_id: int):
     dialog_history_msg = []
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('SELECT message FROM dialog_history WHERE user_id = ?', (user_id,))
-        dialog_history = await cursor.fetchall()
-        for msg in dialog_history:
-            # message = json.loads(msg[0])  # msg[0] - это текст сообщения
-            message = json.loads(msg[0])
-            dialog_history_msg.append(message)
+    tokens = 0
+    with metrics.timer('history_fetch_seconds'):
+        async with pending_history(user_id) as pending:
+            summary = await storage.get_summary(user_id)
+            rows = await storage.get_history(user_id, max_turns, after_id=summary[1] if summary else 0)
+            messages = list(reversed(pending)) + [message for _, message in rows]
+    for message in messages[:max_turns]:
+        tokens += estimate_tokens(message.get('content', ''))
+        if dialog_history_msg and token_budget and tokens > token_budget:
+            break
+        dialog_history_msg.append(message)
+    if summary:
+        dialog_history_msg.append({'role': 'system', 'content': summary[0]})
+    dialog_history_msg.reverse()
     return dialog_history_msg
 
 
+# Функция для получения краткого содержания диалога: (текст, id последнего учтенного сообщения) или None
+async def get_dialog_summary(user_id: int):
+    return await storage.get_summary(user_id)
+
+
+# Функция для получения еще не вошедших в краткое содержание сообщений диалога
+# (не больше limit последних): список пар (id, сообщение) в хронологическом порядке
+async def get_unsummarized_history(user_id: int, after_id: int, limit: int):
+    rows = await storage.get_history(user_id, limit, after_id=after_id)
+    return list(reversed(rows))
+
+
+# Функция для сохранения краткого содержания диалога по сообщение last_id включительно.
+# Если диалог за это время очистили, содержание не сохраняется (возвращается False).
+async def save_dialog_summary(user_id: int, summary: str, last_id: int):
+    return await storage.save_summary(user_id, summary, last_id)
+
+
 # Функция для добавления сообщения в историю диалога
-async def add_message_to_dialog_history(user_id: int, message: dict, return_history=False, msgtext = ""):
-    # print(message)
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('''
-        INSERT INTO dialog_history (user_id, message, data_message) 
-        VALUES (?, ?, ?)
-        ''', (user_id, json.dumps(message), msgtext))
-        await db.commit()
+# (при отложенной записи - без ожидания базы, сообщение сразу видно в get_dialog_history)
+async def add_message_to_dialog_history(user_id: int, message: dict, return_history=False):
+    if history_writer is not None:
+        history_writer.add(user_id, message['role'], message['content'])
+    else:
+        await storage.add_history([(user_id, message['role'], message['content'])])
 
-        if return_history:
-            return await get_dialog_history(user_id)
+    if return_history:
+        return await get_dialog_history(user_id)
 
 
 # Функция для обновления статуса диалога пользователя
 async def update_dialog_status(user_id: int, status: bool):
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('''
-        UPDATE users SET in_dialog = ? WHERE user_id = ?
-        ''', (status, user_id))
-        await db.commit()
+    await storage.update_dialog_status(user_id, status)
+    users_cache.update(user_id, in_dialog=status)
 
 
-# Функция для очистки диалога
+# Функция для очистки диалога (удаление истории и смена статуса в одной транзакции)
 async def clear_dialog(user_id: int, dialog_status: bool):
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute('DELETE FROM dialog_history WHERE user_id = ?', (user_id,))
-        await db.commit()
-        await update_dialog_status(user_id, dialog_status)
+    async with pending_history(user_id):
+        if history_writer is not None:
+            history_writer.discard(user_id)
+        await storage.clear_dialog(user_id, dialog_status)
+    users_cache.update(user_id, in_dialog=dialog_status)
 
-# Функция для получения статуса диалога пользователя
+# Функция для получения статуса диалога пользователя (обычно без обращения к базе - из кэша)
 async def get_dialog_status(user_id: int):
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('SELECT in_dialog FROM users WHERE user_id = ?', (user_id,))
-        user_data = await cursor.fetchone()
-        if user_data:
-            return user_data[0]
-        return None
-    
+    user_data = await get_user_data(user_id)
+    if user_data:
+        return bool(user_data['in_dialog'])
+    return None
+
 # Функция для получения режима диалога пользователя
 async def get_user_mode_dialog(user_id: int):
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('SELECT TOP 1 * FROM dialog_mode WHERE user_id = ? order by id desc ', (user_id,))
-        user_data = await cursor.fetchone()
-        if user_data:
-            return dict(user_data)
-        return None
-    
+    user_data = modes_cache.get(user_id)
+    if user_data is MISSING:
+        user_data = await storage.get_mode(user_id)
+        modes_cache.set(user_id, user_data)
+    if user_data:
+        return dict(user_data)
+    return None
+
 # Функция для установки режима диалога пользователя
 async def set_user_mode_dialog(user_id: int, mode_dialog: str):
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute(' UPDATE dialog_mode SET mode = ? WHERE user_id = ?', (mode_dialog, user_id))
-        user_data = await cursor.fetchone()
-        if user_data:
-            return dict(user_data)
-        return None
\ No newline at end of file
+    await storage.set_mode(user_id, mode_dialog)
+    # id записи в кэше не нужен - при необходимости он будет прочитан из базы
+    modes_cache.pop(user_id)
+    return {'user_id': user_id, 'mode': mode_dialog}
+
+
+# Функция для получения сохраненных ответов кэша (последние limit записей).
+# Более старые записи удаляются.
+async def get_answer_cache_entries(limit: int):
+    return await storage.get_answer_cache(limit)
+
+
+# Функция для сохранения ответа в кэш
+async def save_answer_cache_entry(namespace: str, question: str, vector: bytes, answer: str):
+    await storage.save_answer_cache(namespace, question, vector, answer)
+
+
+# Функция для получения статистики кэша пользователей
+def get_users_cache_stats():
+    return users_cache.stats()
@@ -0,0 +1,137 @@
+""" Отложенная запись истории диалогов пачками (group commit).
+
+Сообщения всех пользователей копятся в буфере и записываются одной транзакцией,
+когда с первого сообщения пачки прошло interval секунд или набралось max_rows сообщений.
+Еще не записанные сообщения пользователя видны при чтении его истории (см. read),
+поэтому следующий промпт пользователя всегда содержит его последние сообщения.
+При остановке (close) буфер записывается полностью.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from loguru import logger
+
+from utils import metrics
+
+# Пауза перед повторной записью пачки после ошибки базы данных (с)
+RETRY_DELAY = 1.0
+
+
+class HistoryWriter:
+    """Буфер записи истории диалогов с периодической записью пачками."""
+
+    def __init__(self, storage, interval: float = 0.005, max_rows: int = 200):
+        """
+        :param storage: Хранилище (см. db_handler/storage.py), пачка пишется через storage.add_history.
+        :param interval: Максимальное время ожидания пачки (с).
+        :param max_rows: Количество сообщений, при котором пачка пишется сразу.
+        """
+        self.storage = storage
+        self.interval = interval
+        self.max_rows = max_rows
+        self._buffer = []                   # (user_id, role, content)
+        self._wakeup = asyncio.Event()      # в буфере есть сообщения
+        self._full = asyncio.Event()        # набралось max_rows сообщений
+        self._idle = asyncio.Event()        # запись пачки не выполняется
+        self._idle.set()
+        self._no_readers = asyncio.Event()
+        self._no_readers.set()
+        self._readers = 0
+        self._flushing = False
+        self._closing = False
+        self._task = None
+
+    def start(self):
+        """Запуск фоновой записи."""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    def add(self, user_id: int, role: str, content: str):
+        """Добавляет сообщение в буфер (без ожидания записи в базу)."""
+        self._buffer.append((user_id, role, content))
+        if len(self._buffer) >= self.max_rows:
+            self._full.set()
+        self._wakeup.set()
+
+    @asynccontextmanager
+    async def read(self, user_id: int):
+        """
+        Чтение истории пользователя с учетом буфера. Внутри блока пачка в базу не пишется,
+        поэтому каждое сообщение находится либо в базе, либо в буфере (но не там и там).
+        Возвращает еще не записанные сообщения пользователя в хронологическом порядке.
+        """
+        while self._flushing:
+            await self._idle.wait()
+        self._readers += 1
+        self._no_readers.clear()
+        try:
+            yield [{'role': role, 'content': content} for uid, role, content in self._buffer if uid == user_id]
+        finally:
+            self._readers -= 1
+            if not self._readers:
+                self._no_readers.set()
+
+    def discard(self, user_id: int):
+        """Удаляет из буфера сообщения пользователя (вызывается внутри read при очистке диалога)."""
+        self._buffer = [row for row in self._buffer if row[0] != user_id]
+
+    async def flush(self) -> bool:
+        """Записывает буфер одной транзакцией. Возвращает False при ошибке (сообщения остаются в буфере)."""
+        # новые читатели ждут окончания записи, текущие - дочитывают
+        self._flushing = True
+        self._idle.clear()
+        try:
+            await self._no_readers.wait()
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return True
+            start = time.perf_counter()
+            try:
+                await self.storage.add_history(rows)
+            except Exception as e:
+                logger.exception(e)
+                self._buffer[:0] = rows
+                return False
+            metrics.observe('history_flush_seconds', time.perf_counter() - start)
+            metrics.observe('history_flush_rows', len(rows), buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+            return True
+        finally:
+            self._flushing = False
+            self._idle.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._closing:
+                # сбор пачки: interval секунд или до max_rows сообщений
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            flushed = await self.flush()
+            if self._closing:
+                if self._buffer:
+                    logger.error(f'История диалогов: не записано {len(self._buffer)} сообщений')
+                return
+            if not flushed:
+                await asyncio.sleep(RETRY_DELAY)
+                self._wakeup.set()
+
+    async def close(self):
+        """Записывает оставшиеся сообщения и останавливает фоновую запись."""
+        if self._task is None:
+            await self.flush()
+            return
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        await self._task
+        self._task = None
+
+    def stats(self) -> dict:
+        return {'buffered': len(self._buffer)}
@@ -1,11 +1,20 @@
+import asyncio
+import time
+
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
-from create_bot import bot, get_text_response, logger
+from create_bot import (bot, admins, outbox, index_registry, get_text_response, stream_text_response, get_user_dialog,
+                        logger, scheduler, is_warmed_up, schedule_summary, STREAM_RESPONSES, STREAM_EDIT_INTERVAL,
+                        STREAM_MIN_CHARS)
 from db_handler.db_funk import (get_user_data, insert_user, clear_dialog,
-                                add_message_to_dialog_history, get_dialog_status)
-from keyboards.kbs import start_kb, stop_speak, select_dialog_mode
+                                add_message_to_dialog_history, get_dialog_status, set_user_mode_dialog)
+from keyboards.kbs import start_kb, stop_speak, select_dialog_mode, DIALOG_MODES
+from utils import metrics
+from utils.logging_setup import log_event
+from utils.scheduler import SchedulerBusy
 from utils.utils import get_now_time
+from utils.telegram_stream import StreamingReply, EMPTY_RESPONSE_TEXT
 from aiogram.utils.chat_action import ChatActionSender
 
 user_router = Router()
@@ -24,91 +33,179 @@ async def cmd_start(message: Message):
             'in_dialog': False,
             'date_reg': get_now_time()
         })
-        await message.answer(text=f'Привет, {message.from_user.full_name}! Давай начнем общаться. Для этого просто нажми на кнопку "Начать диалог"',
-                             reply_markup=start_kb())
+        await outbox.send(message.chat.id, f'Привет, {message.from_user.full_name}! Давай начнем общаться. '
+                                            f'Для этого просто нажми на кнопку "Начать диалог"',
+                          reply_markup=start_kb())
     else:
+        await scheduler.cancel_user(message.from_user.id)
         await clear_dialog(user_id=message.from_user.id, dialog_status=False)
-        await message.answer(text='Диалог очищен. Начнем общаться?', reply_markup=start_kb())
+        await outbox.send(message.chat.id, 'Диалог очищен. Начнем общаться?', reply_markup=start_kb())
+
+
+# Команда администратора: сводка метрик (перцентили длительности этапов, счетчики, кэши)
+@user_router.message(Command('metrics'), F.from_user.id.in_(admins))
+async def cmd_metrics(message: Message):
+    # сводка может быть длиннее лимита Telegram - outbox разобьет ее на несколько сообщений
+    await outbox.send(message.chat.id, metrics.format_summary(), parse_mode=None)
+
+
+# Команда администратора: перезагрузка загруженных Баз-Знаний с диска (после пересборки).
+# Пока новая версия загружается и проверяется, запросы идут к старой.
+@user_router.message(Command('reload_index'), F.from_user.id.in_(admins))
+async def cmd_reload_index(message: Message):
+    await outbox.send(message.chat.id, 'Перезагрузка Баз-Знаний ...', parse_mode=None)
+    results = await index_registry.reload_all(force=True)
+    statuses = {'reloaded': 'обновлена', 'unchanged': 'не изменилась'}
+    lines = [f'{path}: {statuses.get(result, "ошибка, используется прежняя версия - " + result)}'
+             for path, result in results.items()]
+    await outbox.send(message.chat.id, '\n'.join(lines) or 'Нет загруженных Баз-Знаний', parse_mode=None)
+
+
+# Команды администратора от остальных пользователей игнорируются,
+# иначе текст команды попал бы в handle_message как вопрос к Базе-Знаний
+@user_router.message(Command('metrics', 'reload_index'))
+async def cmd_admin_only(message: Message):
+    logger.debug(f'Команда администратора от пользователя {message.from_user.id} проигнорирована')
 
 
 # Хендлер для начала диалога
 @user_router.message(F.text.lower().contains('начать диалог'))
 async def start_speak(message: Message):
     async with ChatActionSender.typing(bot=bot, chat_id=message.from_user.id):
+        await scheduler.cancel_user(message.from_user.id)
         await clear_dialog(user_id=message.from_user.id, dialog_status=True)
-        await message.answer(text='Диалог начат. Введите ваше сообщение:', reply_markup=stop_speak())
+        await outbox.send(message.chat.id, 'Диалог начат. Введите ваше сообщение:', reply_markup=stop_speak())
 
 
 @user_router.message(F.text.lower().contains('завершить диалог'))
 async def start_speak(message: Message):
     async with ChatActionSender.typing(bot=bot, chat_id=message.from_user.id):
+        await scheduler.cancel_user(message.from_user.id)
         await clear_dialog(user_id=message.from_user.id, dialog_status=False)
-        await message.answer(text='Диалог очищен! Начнем общаться?', reply_markup=start_kb())
+        await outbox.send(message.chat.id, 'Диалог очищен! Начнем общаться?', reply_markup=start_kb())
 
 @user_router.message(F.text.lower().contains('выбрать режим диалога'))
 async def select_dialog_w(message: Message):
     async with ChatActionSender.typing(bot=bot, chat_id=message.from_user.id):
+        await scheduler.cancel_user(message.from_user.id)
         await clear_dialog(user_id=message.from_user.id, dialog_status=False)
-        await message.answer(text='Выбери вариант режима ', reply_markup=select_dialog_mode())
+        await outbox.send(message.chat.id, 'Выбери вариант режима ', reply_markup=select_dialog_mode())
 
 # Хендлер для обработки текстовых сообщений
 @user_router.message(F.text)
 async def handle_message(message: Message):
     logger.debug("new message")
-    await message.answer(text=f"{message.from_user.first_name}!  Начал думать над ответом. Подождите ...", reply_markup=stop_speak())
-    
     async with ChatActionSender.typing(bot=bot, chat_id=message.from_user.id):
-        check_open = await get_dialog_status(message.from_user.id)
+        with metrics.timer('db_status_seconds'):
+            check_open = await get_dialog_status(message.from_user.id)
         if check_open is False:
-            await message.answer(text='Для того чтоб начать общение со мной, пожалуйста, нажмите на кнопку '
-                                      '"Начать диалог".', reply_markup=start_kb())
+            await outbox.send(message.chat.id, 'Для того чтоб начать общение со мной, пожалуйста, нажмите на кнопку '
+                                               '"Начать диалог".', reply_markup=start_kb())
             return
+
+    if not is_warmed_up():
+        metrics.inc('requests_total', labels={'result': 'warming_up'})
+        await outbox.send(message.chat.id, 'Бот запускается и загружает модели. Повторите запрос через минуту',
+                          reply_markup=stop_speak())
+        return
+
+    # запрос ставится в очередь пользователя, повтор еще не обработанного вопроса отбрасывается
+    key = message.text.strip().lower()
+    if scheduler.is_pending(message.from_user.id, key):
+        metrics.inc('requests_total', labels={'result': 'duplicate'})
+        await outbox.send(message.chat.id, 'Этот вопрос уже обрабатывается. Подождите ...', reply_markup=stop_speak())
+        return
+    submitted = time.perf_counter()
+    try:
+        job = scheduler.submit(message.from_user.id, key, lambda: answer_message(message, submitted))
+    except SchedulerBusy:
+        metrics.inc('requests_total', labels={'result': 'busy'})
+        await outbox.send(message.chat.id, 'Сейчас слишком много запросов. Повторите запрос позже',
+                          reply_markup=stop_speak())
+        return
+
+    await outbox.send(message.chat.id, f"{message.from_user.first_name}!  Начал думать над ответом. Подождите ...",
+                      reply_markup=stop_speak())
+    try:
+        # shield: отмена самого обработчика (например, при остановке бота) не отменяет запрос
+        await asyncio.shield(job)
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling() or not job.cancelled():
+            raise
+        # запрос отменен завершением диалога (scheduler.cancel_user)
+        log_event('request', message.from_user.id, time.perf_counter() - submitted, result='cancelled')
+        metrics.inc('requests_total', labels={'result': 'cancelled'})
+    except Exception:
+        log_event('request', message.from_user.id, time.perf_counter() - submitted, level='ERROR', result='error')
+        metrics.inc('requests_total', labels={'result': 'error'})
+        raise
+    else:
+        log_event('request', message.from_user.id, time.perf_counter() - submitted, result='ok')
+        metrics.inc('requests_total', labels={'result': 'ok'})
+        metrics.observe('request_seconds', time.perf_counter() - submitted)
+
+
+async def answer_message(message: Message, submitted: float):
+    """
+        Формирование и отправка ответа на сообщение пользователя.
+        Выполняется планировщиком запросов, поэтому сообщения одного пользователя
+        обрабатываются по очереди и видят в истории ответы на предыдущие.
+        submitted - время постановки в очередь (для метрики ожидания).
+    """
+    metrics.observe('scheduler_wait_seconds', time.perf_counter() - submitted)
     async with ChatActionSender.typing(bot=bot, chat_id=message.from_user.id):
         
+        # настройки диалога, выбранного пользователем (База-Знаний и модель)
+        dialog_settings = await get_user_dialog(message.from_user.id)
+
         # формируем словарь с сообщением пользователя
         user_msg_dict = {"role": "user", "content": message.text}
 
         # сохраняем сообщение в базу данных и получаем историю диалога
         dialog_history = await add_message_to_dialog_history(user_id=message.from_user.id,
                                                              message=user_msg_dict,
-                                                             return_history=True,
-                                                             msgtext = message.text)
-
-        response_text = get_text_response(message.text, dialog_history)
-
-        try:
-            await message.answer(text=response_text, reply_markup=stop_speak(), parse_mode='Markdown', reply_to_message_id=message.message_id)
-        except:
-            await message.answer(text="Произошла ошибка. Повторите позже запрос", reply_markup=stop_speak())
+                                                             return_history=True)
+
+        if STREAM_RESPONSES:
+            # потоковый ответ: сообщение обновляется по мере генерации
+            reply = StreamingReply(bot=bot, chat_id=message.chat.id, reply_markup=stop_speak(), outbox=outbox,
+                                   reply_to_message_id=message.message_id,
+                                   edit_interval=STREAM_EDIT_INTERVAL, min_delta=STREAM_MIN_CHARS)
+            try:
+                response_text = await reply.run(stream_text_response(message.text, dialog_history, dialog_settings))
+            except Exception as e:
+                logger.exception(e)
+                await outbox.send(message.chat.id, "Произошла ошибка. Повторите позже запрос", reply_markup=stop_speak())
+                return
+        else:
+            response_text = await get_text_response(message.text, dialog_history, dialog_settings)
+
+            # длинный ответ отправляется несколькими сообщениями, неразобранный Markdown - без разметки
+            try:
+                await outbox.send(message.chat.id, response_text if response_text.strip() else EMPTY_RESPONSE_TEXT,
+                                  reply_markup=stop_speak(), parse_mode='Markdown',
+                                  reply_to_message_id=message.message_id)
+            except Exception as e:
+                logger.exception(e)
+                await outbox.send(message.chat.id, "Произошла ошибка. Повторите позже запрос", reply_markup=stop_speak())
+    # пустой ответ модели не сохраняется: в истории он стал бы пустой репликой ассистента,
+    # а пользователь видел только сообщение о том, что ответ не сформирован
+    if not response_text.strip():
+        logger.warning(f'Пустой ответ модели для пользователя {message.from_user.id}')
+        return
     # формируем словарь с сообщением ассистента
     assistant_msg = {"role": "assistant", "content": response_text}
     # сохраняем сообщение ассистента в базу данных
     await add_message_to_dialog_history(user_id=message.from_user.id, message=assistant_msg,
-                                        return_history=False, msgtext = message.text)
+                                        return_history=False)
+    # длинная история сжимается в фоне, следующий запрос получит краткое содержание
+    schedule_summary(message.from_user.id, dialog_history + [assistant_msg], dialog_settings['model_name'])
  
 
-@user_router.callback_query(F.data == 'get_help_developer')
-async def send_random_person(call: CallbackQuery):
-    print(call.from_user.id)
-    async with ChatActionSender(bot=bot, chat_id=call.from_user.id, action="typing"):
-        await call.message.answer('Не реализовано', reply_markup=select_dialog_mode())    
-
-# @user_router.callback_query(F.data == 'it_docs')
-# async def send_random_person(call: CallbackQuery):
-#     print(call.from_user.id)
-#     await message.answer(text='Не реализовано', reply_markup=select_dialog_mode())
-
-# @user_router.callback_query(F.data == 'it_one_c')
-# async def send_random_person(call: CallbackQuery):
-#     print(call.from_user.id)
-#     await message.answer(text='Не реализовано', reply_markup=select_dialog_mode())
-
-# @user_router.callback_query(F.data == 'all_docs')
-# async def send_random_person(call: CallbackQuery):
-#     print(call.from_user.id)
-#     await message.answer(text='Не реализовано', reply_markup=select_dialog_mode())
-
-# @user_router.callback_query(F.data == 'balabolka')
-# async def send_random_person(call: CallbackQuery):
-#     print(call.from_user.id)
-#     await message.answer(text='Не реализовано', reply_markup=select_dialog_mode())
\ No newline at end of file
+# Хендлер выбора режима диалога: у каждого режима своя База-Знаний и модель
+@user_router.callback_query(F.data.in_(DIALOG_MODES))
+async def select_mode(call: CallbackQuery):
+    await set_user_mode_dialog(user_id=call.from_user.id, mode_dialog=call.data)
+    await call.answer()
+    await outbox.send(call.message.chat.id, f'Выбран режим "{DIALOG_MODES[call.data]}". Начнем общаться?',
+                      reply_markup=start_kb())
@@ -22,13 +22,17 @@ def stop_speak():
         input_field_placeholder="Чтоб завершить диалог с ботом жмите 👇:"
     )
 
+# Режимы диалога: callback_data -> название кнопки
+DIALOG_MODES = {
+    'get_help_developer': "Помошник-программист",
+    'it_docs': "ИТ-документация",
+    'it_one_c': "1C документация",
+    'all_docs': "Общая информация",
+    'balabolka': "Без всего общалка",
+}
+
+
 def select_dialog_mode():
-    inline_kb_list = [
-        [InlineKeyboardButton(text="Помошник-программист", callback_data='get_help_developer')],
-        [InlineKeyboardButton(text="ИТ-документация", callback_data='it_docs')],
-        [InlineKeyboardButton(text="1C документация", callback_data='it_one_c')],
-        [InlineKeyboardButton(text="Общая информация", callback_data='all_docs')],
-        [InlineKeyboardButton(text="Без всего общалка", callback_data='balabolka')]
-    ]
+    inline_kb_list = [[InlineKeyboardButton(text=title, callback_data=mode)]
+                      for mode, title in DIALOG_MODES.items()]
     return InlineKeyboardMarkup(inline_keyboard=inline_kb_list)
-    
\ No newline at end of file
@@ -0,0 +1,93 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def make_namespace(model_name: str, prompt_template: str, index_version: str) -> str:
+    """
+    Пространство ключей кэша ответов.
+    Смена модели, шаблона промпта или пересборка векторной базы дают новое пространство,
+    поэтому старые ответы перестают находиться.
+    """
+    raw = '\x1f'.join((model_name, prompt_template, index_version))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def normalize(vector) -> np.ndarray:
+    """Нормирует вектор, чтобы скалярное произведение было косинусной близостью."""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """
+    Кэш ответов LLM с поиском по смыслу вопроса.
+
+    Ответ считается найденным, если косинусная близость эмбеддинга нового вопроса
+    к эмбеддингу ранее заданного вопроса из того же пространства ключей не ниже threshold.
+    Количество записей ограничено maxsize, вытесняются давно не использованные.
+    """
+
+    def __init__(self, threshold: float = 0.95, maxsize: int = 1000):
+        """
+        :param threshold: Минимальная косинусная близость вопросов для совпадения.
+        :param maxsize: Максимальное количество хранимых ответов.
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # (пространство, вопрос) -> (вектор, ответ)
+        self._matrices = {}             # пространство -> (ключи, матрица векторов)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _matrix(self, namespace: str):
+        if namespace not in self._matrices:
+            keys = [key for key in self._entries if key[0] == namespace]
+            matrix = np.stack([self._entries[key][0] for key in keys]) if keys else None
+            self._matrices[namespace] = (keys, matrix)
+        return self._matrices[namespace]
+
+    def lookup(self, namespace: str, vector):
+        """
+        Ищет ответ на близкий по смыслу вопрос.
+
+        :return: Кортеж (вопрос, ответ) или None.
+        """
+        keys, matrix = self._matrix(namespace)
+        if matrix is None:
+            self.misses += 1
+            return None
+        scores = matrix @ normalize(vector)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        key = keys[best]
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return key[1], self._entries[key][1]
+
+    def add(self, namespace: str, question: str, vector, answer: str):
+        """Сохраняет ответ на вопрос."""
+        key = (namespace, question)
+        self._entries[key] = (normalize(vector), answer)
+        self._entries.move_to_end(key)
+        self._matrices.pop(namespace, None)
+        while len(self._entries) > self.maxsize:
+            (evicted_namespace, _), _ = self._entries.popitem(last=False)
+            self._matrices.pop(evicted_namespace, None)
+
+    def stats(self) -> dict:
+        """Статистика использования кэша."""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
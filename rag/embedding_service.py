@@ -0,0 +1,168 @@
+import asyncio
+
+import numpy as np
+
+from utils.cache import LRUCache, MISSING
+
+
+class _MicroBatcher:
+    """
+    Накопитель запросов: собирает запросы, пришедшие в течение window секунд
+    (или до max_batch штук), и обрабатывает их одним вызовом handler.
+    """
+
+    def __init__(self, handler, window: float, max_batch: int):
+        """
+        :param handler: Корутина, которая получает список запросов и возвращает список результатов.
+        :param window: Время накопления пачки в секундах.
+        :param max_batch: Максимальный размер пачки.
+        """
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = []
+        self._timer = None
+        # выполняющиеся пачки: ссылки держатся до завершения, при остановке пачки отменяются
+        self._tasks = set()
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((item, future))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """Отменяет накопленные и выполняющиеся пачки (ожидающие результата запросы отменяются)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        for _, future in batch:
+            future.cancel()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class EmbeddingService:
+    """
+    Сервис эмбеддингов вопросов и поиска по векторной Базе-Знаний.
+
+    Одновременно пришедшие вопросы в течение нескольких миллисекунд собираются в пачку
+    и кодируются моделью одним вызовом, поиск по FAISS для пачки выполняется одним
+    матричным запросом. Векторы недавних вопросов хранятся в LRU-кэше.
+    Вычисления выполняются в пуле потоков executor.
+    """
+
+    def __init__(self, embeddings, executor, batch_window: float = 0.005, max_batch: int = 32,
+                 cache_size: int = 1024):
+        """
+        :param embeddings: Модель векторных представлений (langchain Embeddings).
+        :param executor: Пул потоков для вызовов модели и FAISS.
+        :param batch_window: Время накопления пачки в секундах.
+        :param max_batch: Максимальный размер пачки.
+        :param cache_size: Количество векторов вопросов в LRU-кэше.
+        """
+        self.embeddings = embeddings
+        self.executor = executor
+        self.cache = LRUCache(maxsize=cache_size)
+        self._embed_batcher = _MicroBatcher(self._embed_batch, batch_window, max_batch)
+        self._search_batcher = _MicroBatcher(self._search_batch, batch_window, max_batch)
+
+    async def embed(self, text: str):
+        """Эмбеддинг одного вопроса."""
+        vector = self.cache.get(text)
+        if vector is MISSING:
+            vector = await self._embed_batcher.submit(text)
+        return vector
+
+    async def embed_many(self, texts):
+        """Эмбеддинги нескольких текстов (попадают в одну пачку)."""
+        return await asyncio.gather(*(self.embed(text) for text in texts))
+
+    async def search(self, index_db, vector, k: int):
+        """Поиск k ближайших кусочков текста по эмбеддингу вопроса."""
+        return await self._search_batcher.submit((index_db, vector, k))
+
+    async def close(self):
+        """Остановка: отмена незавершенных пачек эмбеддингов и поиска."""
+        await self._embed_batcher.close()
+        await self._search_batcher.close()
+
+    async def _embed_batch(self, texts):
+        unique = list(dict.fromkeys(texts))
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(self.executor, self.embeddings.embed_documents, unique)
+        by_text = dict(zip(unique, vectors))
+        for text, vector in by_text.items():
+            self.cache.set(text, vector)
+        return [by_text[text] for text in texts]
+
+    async def _search_batch(self, requests):
+        # запросы к разным базам обрабатываются отдельными матричными запросами
+        groups = {}
+        for position, (index_db, vector, k) in enumerate(requests):
+            groups.setdefault(id(index_db), (index_db, []))[1].append((position, vector, k))
+
+        loop = asyncio.get_running_loop()
+        results = [None] * len(requests)
+        for index_db, items in groups.values():
+            found = await loop.run_in_executor(self.executor, search_by_vectors, index_db,
+                                               [vector for _, vector, _ in items],
+                                               max(k for _, _, k in items))
+            for (position, _, k), docs in zip(items, found):
+                results[position] = docs[:k]
+        return results
+
+
+def search_by_vectors(index_db, vectors, k: int):
+    """
+    Матричный поиск по FAISS-хранилищу langchain для нескольких векторов сразу.
+    Возвращает список документов для каждого вектора.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if getattr(index_db, '_normalize_L2', False):
+        import faiss
+        faiss.normalize_L2(matrix)
+    _, indices = index_db.index.search(matrix, k)
+    found = []
+    for row in indices:
+        docs = []
+        for i in row:
+            if i == -1:
+                continue
+            doc = index_db.docstore.search(index_db.index_to_docstore_id[i])
+            if not isinstance(doc, str):
+                docs.append(doc)
+        found.append(docs)
+    return found
@@ -0,0 +1,122 @@
+""" Типы индексов FAISS для векторной Базы-Знаний.
+
+flat  - точный поиск полным перебором (по умолчанию, как у FAISS.from_documents);
+ivfpq - инвертированные списки с продуктовым квантованием: требует обучения, быстрее
+        и компактнее на больших корпусах, поиск приближенный (точность задает nprobe);
+hnsw  - граф HNSW: обучения не требует, поиск приближенный (точность задает ef_search).
+
+Удаление векторов поддерживает только flat (см. supports_remove), остальные индексы
+при удалении документов пересобираются полностью.
+"""
+
+import os
+import pickle
+
+import faiss
+import numpy as np
+from loguru import logger
+
+INDEX_TYPES = ('flat', 'ivfpq', 'hnsw')
+
+# Параметры построения индексов по умолчанию
+DEFAULT_INDEX_PARAMS = {
+    'nlist': 256,           # ivfpq: количество кластеров
+    'pq_m': 64,             # ivfpq: количество подвекторов (должно делить размерность)
+    'pq_bits': 8,           # ivfpq: бит на подвектор
+    'hnsw_m': 32,           # hnsw: количество связей вершины графа
+    'ef_construction': 64,  # hnsw: ширина поиска при построении
+}
+
+# Рекомендуемое FAISS количество обучающих векторов на один кластер
+TRAIN_POINTS_PER_CENTROID = 39
+
+
+def index_params(params: dict = None) -> dict:
+    """Параметры построения с подставленными значениями по умолчанию."""
+    return {**DEFAULT_INDEX_PARAMS, **(params or {})}
+
+
+def train_size(index_type: str, params: dict = None) -> int:
+    """Количество векторов, которое нужно накопить для обучения индекса."""
+    if index_type != 'ivfpq':
+        return 0
+    return index_params(params)['nlist'] * TRAIN_POINTS_PER_CENTROID
+
+
+def create_faiss_index(index_type: str, vectors, params: dict = None):
+    """
+    Создает пустой индекс FAISS заданного типа и при необходимости обучает его на vectors.
+    Для ivfpq количество кластеров уменьшается, если обучающих векторов мало,
+    а если их меньше, чем нужно для обучения квантователя (2 ** pq_bits), создается flat:
+    на таком маленьком корпусе точный поиск и так быстрый.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f'Неизвестный тип индекса {index_type}, допустимые: {", ".join(INDEX_TYPES)}')
+    params = index_params(params)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+
+    if index_type == 'ivfpq' and len(vectors) < 2 ** params['pq_bits']:
+        logger.warning(f'Для обучения ivfpq нужно не меньше {2 ** params["pq_bits"]} векторов, '
+                       f'а их {len(vectors)}: создается индекс flat')
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, params['hnsw_m'])
+        index.hnsw.efConstruction = params['ef_construction']
+        return index
+
+    nlist = max(1, min(params['nlist'], len(vectors) // TRAIN_POINTS_PER_CENTROID))
+    quantizer = faiss.IndexFlatL2(dim)
+    index = faiss.IndexIVFPQ(quantizer, dim, nlist, params['pq_m'], params['pq_bits'])
+    index.train(vectors)
+    return index
+
+
+def index_type_of(index) -> str:
+    """Тип созданного индекса (ivfpq на маленьком корпусе создается как flat, см. create_faiss_index)."""
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivfpq'
+    return 'flat'
+
+
+def supports_remove(index) -> bool:
+    """
+    Можно ли удалять векторы из индекса через FAISS.delete langchain.
+    HNSW удаление не поддерживает, а IVF удаляет векторы без сдвига номеров оставшихся,
+    тогда как langchain перенумеровывает index_to_docstore_id с нуля: поиск вернул бы чужие кусочки.
+    """
+    return not isinstance(index, (faiss.IndexHNSW, faiss.IndexIVF))
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Параметры точности поиска для приближенных индексов."""
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def load_index(db_dir: str, embeddings, mmap: bool = False, nprobe: int = None, ef_search: int = None):
+    """
+    Загружает векторную Базу-Знаний, сохраненную FAISS.save_local.
+
+    При mmap=True файл index.faiss отображается в память только для чтения:
+    несколько процессов бота используют одни и те же страницы, а в память
+    подгружаются только реально нужные части индекса.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    if mmap:
+        flags = faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+        index = faiss.read_index(os.path.join(db_dir, 'index.faiss'), flags)
+    else:
+        index = faiss.read_index(os.path.join(db_dir, 'index.faiss'))
+    set_search_params(index, nprobe, ef_search)
+
+    with open(os.path.join(db_dir, 'index.pkl'), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
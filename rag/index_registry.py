@@ -0,0 +1,267 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+from rag.lexical import LEXICAL_NAME, load_lexical
+
+# Файлы векторной Базы-Знаний FAISS, сохраненной через save_local
+INDEX_FILES = ('index.faiss', 'index.pkl')
+
+
+def get_index_version(db_dir: str) -> str:
+    """
+    Версия векторной Базы-Знаний: размер и время изменения файлов индекса.
+    Используется в ключе кэша ответов, чтобы пересборка базы сбрасывала кэш.
+    """
+    parts = []
+    for name in INDEX_FILES:
+        stat = os.stat(os.path.join(db_dir, name))
+        parts.append(f'{stat.st_size}:{stat.st_mtime_ns}')
+    return '-'.join(parts)
+
+
+def get_index_size(db_dir: str) -> int:
+    """Оценка занимаемой индексом памяти по размеру его файлов (в байтах)."""
+    paths = [os.path.join(db_dir, name) for name in INDEX_FILES + (LEXICAL_NAME,)]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def get_files_version(db_dir: str) -> str:
+    """Версия всех файлов Базы-Знаний (вместе с лексическим индексом) для отслеживания пересборки."""
+    version = get_index_version(db_dir)
+    path = os.path.join(db_dir, LEXICAL_NAME)
+    if os.path.exists(path):
+        stat = os.stat(path)
+        version += f'-{stat.st_size}:{stat.st_mtime_ns}'
+    return version
+
+
+def load_index(db_dir: str, embeddings):
+    """Загружает векторную Базу-Знаний FAISS из каталога."""
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(db_dir, embeddings, allow_dangerous_deserialization=True)
+
+
+class LoadedIndex:
+    """Загруженная векторная База-Знаний и ее лексический индекс (None, если его нет)."""
+
+    def __init__(self, name: str, path: str, store, version: str, size: int, lexical=None, files_version: str = None):
+        self.name = name
+        self.path = path
+        self.store = store
+        self.version = version
+        self.size = size
+        self.lexical = lexical
+        self.files_version = files_version
+
+
+def validate_index(loaded: LoadedIndex, previous: LoadedIndex = None):
+    """
+    Проверка загруженной Базы-Знаний перед заменой: база не является контрольной точкой незавершенной
+    сборки (в манифесте нет partial), индекс не пуст, каждому вектору соответствует
+    документ, документы лексического индекса есть в базе, размерность векторов не изменилась
+    (иначе база собрана другой моделью эмбеддингов), пробный поиск выполняется.
+    При ошибке выбрасывает ValueError.
+    """
+    import numpy as np
+    from rag.ingest import load_manifest
+
+    manifest = load_manifest(loaded.path)
+    if manifest is not None and 'partial' in manifest:
+        raise ValueError('сборка базы не завершена')
+    store = loaded.store
+    index = store.index
+    if index.ntotal == 0:
+        raise ValueError('индекс пуст')
+    if index.ntotal != len(store.index_to_docstore_id):
+        raise ValueError(f'векторов {index.ntotal}, а документов {len(store.index_to_docstore_id)}')
+    missing = sum(isinstance(store.docstore.search(doc_id), str) for doc_id in store.index_to_docstore_id.values())
+    if missing:
+        raise ValueError(f'нет {missing} документов индекса')
+    if loaded.lexical is not None:
+        ids = set(store.index_to_docstore_id.values())
+        if any(doc_id not in ids for doc_id in loaded.lexical.doc_len):
+            raise ValueError('лексический индекс не соответствует векторному')
+    if previous is not None and index.d != previous.store.index.d:
+        raise ValueError(f'размерность векторов {index.d} вместо {previous.store.index.d}')
+    index.search(np.zeros((1, index.d), dtype='float32'), 1)
+
+
+class IndexRegistry:
+    """
+    Реестр векторных Баз-Знаний по диалогам.
+
+    База загружается при первом обращении и использует общую модель эмбеддингов.
+    Если суммарный размер загруженных баз превышает memory_budget байт,
+    выгружаются давно не использованные. Запросы, уже получившие базу,
+    дорабатывают с ней: выгрузка только убирает ссылку из реестра.
+
+    Пересобранная база загружается заново (reload) в фоне, пока запросы идут к старой версии.
+    Новая версия проверяется (validate_index) и заменяет старую в реестре одним присваиванием;
+    запросы, уже получившие старую версию, дорабатывают с ней, и ее память освобождается
+    после завершения последнего из них. Фоновое наблюдение (start) раз в watch_interval секунд
+    проверяет файлы загруженных баз и перезагружает базу, если ее файлы изменились
+    и не менялись в течение последней проверки (пересборка завершена).
+    """
+
+    def __init__(self, embeddings, executor, memory_budget: int, loader=load_index, watch_interval: float = 0):
+        """
+        :param embeddings: Общая модель векторных представлений.
+        :param executor: Пул потоков для загрузки баз с диска.
+        :param memory_budget: Допустимый суммарный размер загруженных баз в байтах.
+        :param loader: Функция загрузки базы (путь, эмбеддинги) -> хранилище.
+        :param watch_interval: Период (с) проверки файлов загруженных баз, 0 - без наблюдения.
+        """
+        self.embeddings = embeddings
+        self.executor = executor
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self.watch_interval = watch_interval
+        self._indexes = OrderedDict()   # путь -> LoadedIndex
+        self._locks = {}
+        self._reload_locks = {}
+        self._changed = {}              # путь -> версия файлов, замеченная при прошлой проверке
+        self._failed = {}               # путь -> версия файлов, не прошедшая проверку
+        self._watch_task = None
+
+    def __contains__(self, path: str):
+        return path in self._indexes
+
+    async def get(self, name: str, path: str) -> LoadedIndex:
+        """
+        Возвращает базу диалога name, расположенную в каталоге path, загружая ее при необходимости.
+        Одинаковые базы разных диалогов загружаются один раз.
+        """
+        loaded = self._indexes.get(path)
+        if loaded is not None:
+            self._indexes.move_to_end(path)
+            return loaded
+
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            loaded = self._indexes.get(path)
+            if loaded is None:
+                loaded = await self._load(name, path)
+                self._indexes[path] = loaded
+                self._evict(keep=path)
+        self._locks.pop(path, None)
+        return loaded
+
+    async def _load(self, name: str, path: str) -> LoadedIndex:
+        logger.debug(f'Загрузка векторной Базы-Знаний {name}: {path}')
+        files_version = get_files_version(path)
+        loop = asyncio.get_running_loop()
+        store = await loop.run_in_executor(self.executor, self.loader, path, self.embeddings)
+        lexical = await loop.run_in_executor(self.executor, load_lexical, path)
+        return LoadedIndex(name, path, store, get_index_version(path), get_index_size(path), lexical, files_version)
+
+    async def reload(self, path: str, force: bool = False) -> bool:
+        """
+        Загружает новую версию базы path, проверяет ее и заменяет старую в реестре.
+        Без force база, файлы которой не изменились, не перезагружается.
+        Возвращает True, если база заменена (False - база не загружена или не изменилась);
+        при ошибке загрузки или проверки старая версия остается, исключение передается вызывающему.
+        """
+        current = self._indexes.get(path)
+        if current is None:
+            # база еще не загружена - при первом обращении будет загружена новая версия
+            return False
+        lock = self._reload_locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            current = self._indexes.get(path)
+            version = get_files_version(path)
+            if current is None or (not force and version == current.files_version):
+                return False
+            start = time.perf_counter()
+            try:
+                loaded = await self._load(current.name, path)
+                await asyncio.get_running_loop().run_in_executor(self.executor, validate_index, loaded, current)
+                if get_files_version(path) != loaded.files_version:
+                    raise ValueError('файлы базы изменились во время загрузки')
+            except Exception:
+                self._failed[path] = version
+                raise
+            self._failed.pop(path, None)
+            self._changed.pop(path, None)
+            # замена одним присваиванием: новые запросы получают новую версию,
+            # выполняющиеся дорабатывают со старой
+            self._indexes[path] = loaded
+            self._evict(keep=path)
+        logger.info(f'Векторная База-Знаний {loaded.name} обновлена за {time.perf_counter() - start:.1f} с: '
+                    f'{loaded.store.index.ntotal} векторов')
+        return True
+
+    async def reload_all(self, force: bool = False) -> dict:
+        """Перезагрузка всех загруженных баз. Возвращает путь -> 'reloaded', 'unchanged' или текст ошибки."""
+        results = {}
+        for path in list(self._indexes):
+            try:
+                results[path] = 'reloaded' if await self.reload(path, force) else 'unchanged'
+            except Exception as e:
+                logger.warning(f'Новая версия Базы-Знаний {path} не загружена: {e!r}')
+                results[path] = f'{type(e).__name__}: {e}'
+        return results
+
+    async def _check_files(self):
+        for path in list(self._indexes):
+            try:
+                version = get_files_version(path)
+            except OSError:
+                # файлы заменяются - проверим в следующий раз
+                continue
+            loaded = self._indexes.get(path)
+            if loaded is None or version in (loaded.files_version, self._failed.get(path)):
+                self._changed.pop(path, None)
+                continue
+            # перезагрузка, только если файлы не менялись с прошлой проверки (на случай, если база
+            # скопирована в каталог не через rag.ingest, который заменяет каталог целиком)
+            if self._changed.get(path) != version:
+                self._changed[path] = version
+                continue
+            try:
+                await self.reload(path)
+            except Exception as e:
+                logger.warning(f'Новая версия Базы-Знаний {loaded.name} не загружена: {e!r}')
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                await self._check_files()
+            except Exception as e:
+                logger.exception(e)
+
+    def start(self):
+        """Запуск фонового наблюдения за файлами загруженных баз."""
+        if self.watch_interval and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_loop())
+
+    async def close(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.wait([self._watch_task])
+            self._watch_task = None
+
+    def _evict(self, keep: str):
+        while self.total_size() > self.memory_budget and len(self._indexes) > 1:
+            path = next(iter(self._indexes))
+            if path == keep:
+                self._indexes.move_to_end(path)
+                continue
+            evicted = self._indexes.pop(path)
+            logger.debug(f'Выгрузка векторной Базы-Знаний {evicted.name}: {path}')
+
+    def total_size(self) -> int:
+        """Суммарный размер загруженных баз в байтах."""
+        return sum(loaded.size for loaded in self._indexes.values())
+
+    def stats(self) -> dict:
+        """Список загруженных баз и их размер."""
+        return {
+            'loaded': [loaded.name for loaded in self._indexes.values()],
+            'size_mb': round(self.total_size() / 2 ** 20, 1),
+            'budget_mb': round(self.memory_budget / 2 ** 20, 1),
+        }
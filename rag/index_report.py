@@ -0,0 +1,116 @@
+""" Отчет о точности и скорости приближенных индексов FAISS.
+
+Векторы берутся из существующей плоской (flat) Базы-Знаний, по ним строятся индексы
+ivfpq и hnsw с разными параметрами, и для каждого варианта измеряются recall@k
+относительно точного поиска, время одного запроса и размер индекса.
+Векторы-запросы в индексы не добавляются: иначе ближайшим соседом запроса всегда был бы
+он сам, и recall приближенных индексов оказался бы завышен.
+
+Пример:
+    python -m rag.index_report rag_faiss/db_internal --k 5 --nprobe 1,8,32 --ef-search 16,64,256
+"""
+
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from rag.faiss_index import create_faiss_index, index_params, index_type_of, set_search_params
+
+
+def load_vectors(db_dir: str) -> np.ndarray:
+    """Все векторы плоского индекса Базы-Знаний."""
+    index = faiss.read_index(f'{db_dir}/index.faiss')
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    """recall@k относительно точного поиска и задержка одного запроса."""
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'recall': round(float(recall), 4),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+        'size_mb': round(faiss.serialize_index(index).nbytes / 2 ** 20, 2),
+    }
+
+
+def build_report(vectors: np.ndarray, k: int = 5, queries: int = 200, nprobe=(1, 8, 32),
+                 ef_search=(16, 64, 256), params: dict = None, seed: int = 0) -> list:
+    """
+    Строит индексы всех типов по vectors и сравнивает их с точным поиском.
+    Запросами служат случайно выбранные векторы базы (не больше половины), которые исключаются из индексов.
+    """
+    rng = np.random.default_rng(seed)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), size=min(queries, len(vectors) // 2), replace=False)] = True
+    sample = vectors[held_out]
+    vectors = vectors[~held_out]
+
+    flat = create_faiss_index('flat', vectors)
+    flat.add(vectors)
+    _, truth = flat.search(sample, k)
+    report = [{'type': 'flat', **measure(flat, sample, truth, k)}]
+
+    params = index_params(params)
+    for index_type, values, name in (('ivfpq', nprobe, 'nprobe'), ('hnsw', ef_search, 'ef_search')):
+        start = time.perf_counter()
+        index = create_faiss_index(index_type, vectors, params)
+        index.add(vectors)
+        build_s = round(time.perf_counter() - start, 2)
+        # на маленьком корпусе вместо ivfpq создается flat: строка отчета получает фактический тип
+        actual_type = index_type_of(index)
+        if actual_type != index_type:
+            report.append({'type': actual_type, 'requested': index_type, 'build_s': build_s,
+                           **measure(index, sample, truth, k)})
+            continue
+        for value in values:
+            set_search_params(index, **{name: value})
+            report.append({'type': index_type, name: value, 'build_s': build_s,
+                           **measure(index, sample, truth, k)})
+    return report
+
+
+def format_report(report: list) -> str:
+    lines = []
+    for row in report:
+        setting = ', '.join(f'{key}={value}' for key, value in row.items()
+                            if key in ('nprobe', 'ef_search', 'requested'))
+        lines.append(f"{row['type']:<6} {setting:<16} recall={row['recall']:<7} "
+                     f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms size={row['size_mb']}MB")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сравнение типов индексов FAISS с точным поиском')
+    parser.add_argument('db_dir', help='каталог плоской векторной Базы-Знаний')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--nprobe', default='1,8,32')
+    parser.add_argument('--ef-search', default='16,64,256')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--pq-m', type=int, default=None)
+    parser.add_argument('--hnsw-m', type=int, default=None)
+    parser.add_argument('--json', help='файл для сохранения отчета в JSON')
+    args = parser.parse_args()
+
+    build_params = {key: value for key, value in
+                    (('nlist', args.nlist), ('pq_m', args.pq_m), ('hnsw_m', args.hnsw_m)) if value}
+    result = build_report(load_vectors(args.db_dir), k=args.k, queries=args.queries,
+                          nprobe=[int(v) for v in args.nprobe.split(',')],
+                          ef_search=[int(v) for v in args.ef_search.split(',')],
+                          params=build_params)
+    print(format_report(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1)
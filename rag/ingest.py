@@ -0,0 +1,406 @@
+""" Построение векторной Базы-Знаний из PDF-документов.
+
+Рядом с index.faiss хранится манифест manifest.json: для каждого PDF-файла
+хэш содержимого, количество страниц и идентификаторы его кусочков (chunks) в индексе.
+При пересборке эмбеддинги считаются только для новых и измененных файлов,
+а кусочки удаленных файлов удаляются из индекса.
+
+Рабочий каталог базы во время сборки не изменяется: контрольные точки пишутся
+в каталог <база>.staging, а готовая база заменяет рабочий каталог целиком (swap_dir),
+поэтому бот никогда не видит недостроенную или частично замененную базу.
+
+PDF-файлы читаются параллельно в пуле процессов, эмбеддинги считаются пачками
+фиксированного размера и сразу добавляются в индекс, поэтому весь корпус
+целиком в памяти не держится.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from loguru import logger
+
+from rag.faiss_index import create_faiss_index, index_params, index_type_of, supports_remove, train_size
+from rag.lexical import LEXICAL_NAME, LexicalIndex, lexical_from_store, load_lexical
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Параметры разбиения документов на кусочки (chunks)
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 10
+
+
+def file_sha256(path: str) -> str:
+    """Хэш содержимого файла."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_pdfs(path_pdf: str) -> dict:
+    """Все PDF-файлы каталога (рекурсивно): относительный путь -> полный путь."""
+    found = {}
+    for root, dirs, files in os.walk(path_pdf):
+        for file in files:
+            if file.endswith(".pdf"):
+                full_path = os.path.join(root, file)
+                found[os.path.relpath(full_path, path_pdf)] = full_path
+    return found
+
+
+def load_manifest(db_dir: str):
+    """Загружает манифест базы или возвращает None, если его нет."""
+    path = os.path.join(db_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(db_dir: str, manifest: dict):
+    """Сохраняет манифест (через временный файл, чтобы не оставить его недописанным)."""
+    path = os.path.join(db_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def manifest_from_index(db, path_pdf: str) -> dict:
+    """
+    Восстанавливает манифест для базы, собранной без него, по метаданным source кусочков.
+    Файлы, которые есть в индексе, считаются неизмененными.
+    """
+    files = {}
+    for doc_id in db.index_to_docstore_id.values():
+        doc = db.docstore.search(doc_id)
+        source = doc.metadata.get('source') if not isinstance(doc, str) else None
+        if not source:
+            continue
+        rel = os.path.relpath(source, path_pdf)
+        entry = files.setdefault(rel, {'sha256': None, 'pages': 0, 'chunk_ids': []})
+        entry['chunk_ids'].append(doc_id)
+        entry['pages'] = max(entry['pages'], doc.metadata.get('page', 0) + 1)
+    for rel, entry in files.items():
+        full_path = os.path.join(path_pdf, rel)
+        if os.path.exists(full_path):
+            entry['sha256'] = file_sha256(full_path)
+    return {'version': MANIFEST_VERSION, 'files': files}
+
+
+def plan_changes(path_pdf: str, manifest: dict) -> dict:
+    """
+    Сравнивает PDF-файлы каталога с манифестом.
+
+    :return: Словарь со списками added, changed, removed, unchanged и хэшами текущих файлов.
+    """
+    current = scan_pdfs(path_pdf)
+    known = manifest['files'] if manifest else {}
+    plan = {'added': [], 'changed': [], 'removed': [], 'unchanged': [], 'hashes': {}, 'paths': current}
+    for rel, full_path in sorted(current.items()):
+        sha = file_sha256(full_path)
+        plan['hashes'][rel] = sha
+        if rel not in known:
+            plan['added'].append(rel)
+        elif known[rel]['sha256'] != sha:
+            plan['changed'].append(rel)
+        else:
+            plan['unchanged'].append(rel)
+    plan['removed'] = sorted(rel for rel in known if rel not in current)
+    return plan
+
+
+def format_plan(plan: dict) -> str:
+    """Текстовый отчет о планируемых изменениях."""
+    lines = []
+    for title in ('added', 'changed', 'removed'):
+        lines.append(f'{title}: {len(plan[title])}')
+        lines.extend(f'  {rel}' for rel in plan[title])
+    lines.append(f"unchanged: {len(plan['unchanged'])}")
+    return '\n'.join(lines)
+
+
+def chunk_ids_for(rel: str, sha: str, count: int):
+    """
+    Детерминированные идентификаторы кусочков файла. В идентификатор входит путь файла,
+    чтобы у одинаковых копий документа в разных каталогах кусочки были разными.
+    """
+    prefix = hashlib.sha256(f'{rel}\0{sha}'.encode('utf-8')).hexdigest()[:16]
+    return [f'{prefix}:{i}' for i in range(count)]
+
+
+def load_pdf(rel: str, full_path: str):
+    """Читает страницы PDF-файла (выполняется в отдельном процессе)."""
+    from langchain_community.document_loaders import PyPDFLoader
+    return rel, PyPDFLoader(full_path).load()
+
+
+def parse_pdfs(files, workers: int, loader=load_pdf):
+    """
+    Параллельное чтение PDF-файлов в пуле процессов.
+    Одновременно в работе не больше 2 * workers файлов, результаты отдаются по мере готовности,
+    поэтому в памяти не накапливается текст всего корпуса.
+
+    :param files: Список пар (относительный путь, полный путь).
+    :param loader: Функция чтения файла (rel, full_path) -> (rel, страницы). Передается в дочерние
+        процессы по имени, поэтому должна быть функцией верхнего уровня модуля.
+    """
+    files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for rel, full_path in itertools.islice(files, 2 * workers):
+            pending.add(executor.submit(loader, rel, full_path))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                for rel, full_path in itertools.islice(files, 1):
+                    pending.add(executor.submit(loader, rel, full_path))
+
+
+def iter_chunks(parsed, text_splitter, hashes: dict):
+    """
+    Разбиение прочитанных документов на кусочки.
+    Отдает (файл, кол-во страниц, кусочек, id кусочка, последний ли это кусочек файла).
+    """
+    for rel, pages in parsed:
+        chunks = text_splitter.split_documents(pages)
+        ids = chunk_ids_for(rel, hashes[rel], len(chunks))
+        if not chunks:
+            yield rel, len(pages), None, None, True
+        for i, (chunk, chunk_id) in enumerate(zip(chunks, ids)):
+            yield rel, len(pages), chunk, chunk_id, i == len(chunks) - 1
+
+
+def batched(iterable, size: int):
+    """Разбивает поток на пачки фиксированного размера."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def staging_dir(db_dir: str) -> str:
+    """Каталог контрольных точек сборки базы db_dir."""
+    return db_dir.rstrip('/\\') + '.staging'
+
+
+def swap_dir(new_dir: str, db_dir: str):
+    """
+    Заменяет каталог db_dir каталогом new_dir: прежний каталог переименовывается в <db_dir>.old,
+    new_dir - в db_dir, после чего прежняя версия удаляется (см. recover_dir).
+    """
+    db_dir = db_dir.rstrip('/\\')
+    old_dir = db_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(db_dir):
+        os.rename(db_dir, old_dir)
+    os.rename(new_dir, db_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def recover_dir(db_dir: str):
+    """Восстанавливает прежнюю версию базы, если сбой произошел между переименованиями swap_dir."""
+    db_dir = db_dir.rstrip('/\\')
+    old_dir = db_dir + '.old'
+    if not os.path.exists(db_dir) and os.path.exists(old_dir):
+        logger.warning(f'Восстановление Базы-Знаний {db_dir} из {old_dir}')
+        os.rename(old_dir, db_dir)
+
+
+def record_index_type(db, manifest: dict):
+    """
+    Записывает в манифест фактический тип индекса. Если вместо ivfpq создан flat (мало векторов),
+    при следующей сборке тип не совпадет с заданным и индекс будет перестроен как ivfpq.
+    """
+    actual = index_type_of(db.index)
+    if actual != manifest['index']['type']:
+        manifest['index'] = {'type': actual, 'params': {}}
+
+
+def save_checkpoint(db, db_dir: str, manifest: dict, lexical: LexicalIndex = None):
+    """
+    Сохраняет индекс, лексический индекс и манифест в каталог db_dir.
+    Все файлы сначала пишутся во временный каталог, который затем заменяет db_dir целиком,
+    поэтому индекс и манифест в db_dir всегда соответствуют друг другу.
+    """
+    tmp_dir = db_dir.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    db.save_local(tmp_dir)
+    if lexical is not None:
+        lexical.save(tmp_dir)
+    save_manifest(tmp_dir, manifest)
+    swap_dir(tmp_dir, db_dir)
+
+
+class IndexWriter:
+    """
+    Добавление пачек эмбеддингов в хранилище FAISS.
+
+    Если хранилища еще нет, индекс создается по первым векторам; для индексов,
+    которым нужно обучение (ivfpq), векторы сначала копятся до train_size штук.
+    """
+
+    def __init__(self, db, embeddings, index_type: str = 'flat', params: dict = None):
+        self.db = db
+        self.embeddings = embeddings
+        self.index_type = index_type
+        self.params = params
+        self._train_size = train_size(index_type, params)
+        self._buffer = []
+        self._buffered = 0
+
+    def add(self, texts, vectors, metadatas, ids):
+        if self.db is not None:
+            self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            return
+        self._buffer.append((texts, vectors, metadatas, ids))
+        self._buffered += len(texts)
+        if self._buffered >= self._train_size:
+            self.flush()
+
+    def flush(self):
+        """Создает индекс по накопленным векторам (даже если их меньше train_size)."""
+        if self.db is None and self._buffer:
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+            from langchain_community.vectorstores import FAISS
+            logger.debug(f'Создание индекса {self.index_type} по {self._buffered} векторам')
+            index = create_faiss_index(self.index_type, [v for _, vectors, _, _ in self._buffer for v in vectors],
+                                       self.params)
+            self.db = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+            buffer, self._buffer = self._buffer, []
+            for texts, vectors, metadatas, ids in buffer:
+                self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        return self.db
+
+
+def update_index(embeddings, db_dir: str, path_pdf: str, dry_run: bool = False, workers: int = None,
+                 batch_size: int = 64, checkpoint_every: int = 20, index_type: str = 'flat',
+                 params: dict = None, loader=load_pdf):
+    """
+    Создает или обновляет векторную Базу-Знаний db_dir по PDF-файлам каталога path_pdf.
+
+    Конвейер: чтение PDF в пуле процессов -> разбиение на кусочки (генератор) ->
+    эмбеддинги пачками по batch_size кусочков, каждая пачка сразу добавляется в индекс.
+    Каждые checkpoint_every пачек индекс и манифест сохраняются в каталог staging_dir(db_dir);
+    после сбоя повторный запуск продолжает с последней контрольной точки. Рабочий каталог
+    db_dir заменяется только готовой базой.
+
+    Вместе с векторным обновляется лексический индекс BM25 (см. rag/lexical.py).
+    Тип индекса index_type и параметры его построения params (см. rag/faiss_index.py)
+    записываются в манифест. Смена типа индекса, а также удаление документов из индекса,
+    который не поддерживает удаление (ivfpq, hnsw), приводят к полной пересборке.
+
+    :param dry_run: Только вывести в лог, что изменится, ничего не пересчитывая.
+    :param workers: Количество процессов для чтения PDF (по умолчанию - число ядер).
+    :param loader: Функция чтения файла (см. parse_pdfs).
+    :return: Кортеж (база или None при dry_run, план изменений).
+    """
+    from langchain_community.vectorstores import FAISS
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    index_settings = {'type': index_type, 'params': index_params(params) if index_type != 'flat' else {}}
+    recover_dir(db_dir)
+    # прерванная сборка продолжается с контрольной точки, иначе - с рабочей базы
+    staging = staging_dir(db_dir)
+    source_dir = db_dir
+    if os.path.exists(os.path.join(staging, 'index.faiss')) and load_manifest(staging) is not None:
+        logger.debug(f'Продолжение прерванной сборки с контрольной точки {staging}')
+        source_dir = staging
+    index_exists = os.path.exists(os.path.join(source_dir, 'index.faiss'))
+    db = None
+    manifest = load_manifest(source_dir)
+    if index_exists and manifest is None:
+        logger.debug('Манифест не найден, восстанавливается по индексу')
+        db = FAISS.load_local(source_dir, embeddings, allow_dangerous_deserialization=True)
+        manifest = manifest_from_index(db, path_pdf)
+    if not index_exists:
+        manifest = None
+    if manifest is not None and manifest.get('index', {'type': 'flat', 'params': {}}) != index_settings:
+        logger.debug(f'Тип индекса изменен на {index_type}, полная пересборка')
+        db = None
+        manifest = None
+
+    plan = plan_changes(path_pdf, manifest)
+    logger.debug('План обновления Базы-Знаний:\n' + format_plan(plan))
+    if dry_run:
+        return None, plan
+
+    if manifest is None:
+        manifest = {'version': MANIFEST_VERSION, 'files': {}}
+    elif db is None:
+        db = FAISS.load_local(source_dir, embeddings, allow_dangerous_deserialization=True)
+    manifest['index'] = index_settings
+    lexical = None
+    if db is not None:
+        lexical = load_lexical(source_dir) or lexical_from_store(db)
+
+    # Удаление кусочков удаленных и измененных файлов, а также файлов,
+    # обработка которых была прервана (их кусочки записаны в контрольной точке)
+    stale_ids = []
+    for rel in plan['removed'] + plan['changed']:
+        stale_ids.extend(manifest['files'].pop(rel)['chunk_ids'])
+    for ids in manifest.pop('partial', {}).values():
+        stale_ids.extend(ids)
+    if stale_ids and db is not None:
+        if supports_remove(db.index):
+            logger.debug(f'Удаление {len(stale_ids)} устаревших кусочков')
+            db.delete(stale_ids)
+            lexical.remove(stale_ids)
+        else:
+            logger.debug('Индекс не поддерживает удаление, полная пересборка')
+            db = None
+            lexical = None
+            manifest['files'] = {}
+            plan['added'] = sorted(plan['paths'])
+            plan['changed'] = []
+            plan['unchanged'] = []
+
+    # Эмбеддинги только для новых и измененных файлов
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    to_index = [(rel, plan['paths'][rel]) for rel in plan['added'] + plan['changed']]
+    parsed = parse_pdfs(to_index, workers or os.cpu_count() or 1, loader)
+    writer = IndexWriter(db, embeddings, index_type, params)
+    lexical = lexical or LexicalIndex()
+    partial = {}
+    for number, batch in enumerate(batched(iter_chunks(parsed, text_splitter, plan['hashes']), batch_size), 1):
+        items = [item for item in batch if item[2] is not None]
+        if items:
+            texts = [chunk.page_content for _, _, chunk, _, _ in items]
+            vectors = embeddings.embed_documents(texts)
+            metadatas = [chunk.metadata for _, _, chunk, _, _ in items]
+            ids = [chunk_id for _, _, _, chunk_id, _ in items]
+            writer.add(texts, vectors, metadatas, ids)
+            lexical.add(ids, texts)
+
+        for rel, pages, chunk, chunk_id, last in batch:
+            if chunk_id is not None:
+                partial.setdefault(rel, []).append(chunk_id)
+            if last:
+                logger.debug(f'Проиндексирован {rel}')
+                manifest['files'][rel] = {'sha256': plan['hashes'][rel], 'pages': pages,
+                                          'chunk_ids': partial.pop(rel, [])}
+
+        if writer.db is not None and number % checkpoint_every == 0:
+            logger.debug(f'Контрольная точка: {len(manifest["files"])} файлов')
+            record_index_type(writer.db, manifest)
+            save_checkpoint(writer.db, staging, {**manifest, 'partial': partial}, lexical)
+
+    db = writer.flush()
+    if db is None:
+        raise ValueError(f'В каталоге {path_pdf} нет PDF-документов для построения Базы-Знаний')
+    record_index_type(db, manifest)
+
+    if (plan['added'] or plan['changed'] or plan['removed'] or stale_ids or not index_exists
+            or source_dir != db_dir or not os.path.exists(os.path.join(db_dir, LEXICAL_NAME))):
+        logger.debug('Сохранение векторной Базы-Знаний в файл')
+        save_checkpoint(db, db_dir, manifest, lexical)
+    else:
+        save_manifest(db_dir, manifest)
+    shutil.rmtree(staging, ignore_errors=True)
+    return db, plan
@@ -0,0 +1,38 @@
+import threading
+
+from langchain_core.embeddings import Embeddings
+
+
+class LazyEmbeddings(Embeddings):
+    """
+    Модель векторных представлений, которая создается при первом использовании.
+
+    Загрузка модели (десятки секунд для e5-large) не задерживает импорт модулей бота
+    и выполняется при прогреве в фоне или при первом запросе.
+    """
+
+    def __init__(self, factory):
+        """
+        :param factory: Функция без аргументов, создающая модель эмбеддингов.
+        """
+        self.factory = factory
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def get_model(self):
+        """Возвращает модель, создавая ее при первом обращении (потокобезопасно)."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self.factory()
+        return self._model
+
+    def embed_documents(self, texts):
+        return self.get_model().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.get_model().embed_query(text)
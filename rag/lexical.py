@@ -0,0 +1,128 @@
+""" Лексический (BM25) индекс кусочков Базы-Знаний.
+
+Строится при индексации рядом с индексом FAISS (файл lexical.pkl) и дополняет
+векторный поиск точными совпадениями слов: имена объектов 1С, функций и т.п.,
+которые плохо различаются эмбеддингами. Результаты обоих поисков объединяются
+методом reciprocal rank fusion (RRF).
+"""
+
+import heapq
+import math
+import os
+import pickle
+import re
+from collections import Counter
+
+LEXICAL_NAME = 'lexical.pkl'
+
+# Слова: буквы, цифры и подчеркивание. Составные имена вида Справочники.Номенклатура
+# разбиваются по точке, поэтому находятся и по полному имени, и по его частям.
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list:
+    """Разбивает текст на слова в нижнем регистре."""
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1 or token.isdigit()]
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс с ранжированием BM25.
+
+    Документы идентифицируются теми же id, что и в docstore FAISS,
+    поэтому индекс обновляется инкрементально вместе с векторной базой.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}      # слово -> {id документа: частота слова}
+        self.doc_len = {}       # id документа -> количество слов
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, ids, texts):
+        """Добавляет документы (существующие с теми же id заменяются)."""
+        self.remove([doc_id for doc_id in ids if doc_id in self.doc_len])
+        for doc_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            for token, tf in counts.items():
+                self.postings.setdefault(token, {})[doc_id] = tf
+            length = sum(counts.values())
+            self.doc_len[doc_id] = length
+            self.total_len += length
+
+    def remove(self, ids):
+        """Удаляет документы из индекса."""
+        ids = set(ids) & self.doc_len.keys()
+        if not ids:
+            return
+        for token in list(self.postings):
+            posting = self.postings[token]
+            for doc_id in ids & posting.keys():
+                del posting[doc_id]
+            if not posting:
+                del self.postings[token]
+        for doc_id in ids:
+            self.total_len -= self.doc_len.pop(doc_id)
+
+    def search(self, query: str, k: int) -> list:
+        """
+        Поиск по словам запроса.
+
+        :return: Список (id документа, оценка BM25) по убыванию оценки, не более k.
+        """
+        if not self.doc_len:
+            return []
+        n = len(self.doc_len)
+        avg_len = self.total_len / n or 1
+        scores = {}
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, db_dir: str):
+        with open(os.path.join(db_dir, LEXICAL_NAME), 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_lexical(db_dir: str):
+    """Загружает лексический индекс Базы-Знаний или возвращает None, если его нет."""
+    path = os.path.join(db_dir, LEXICAL_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def lexical_from_store(db) -> LexicalIndex:
+    """Строит лексический индекс по всем документам FAISS-хранилища langchain."""
+    lexical = LexicalIndex()
+    ids = list(db.index_to_docstore_id.values())
+    lexical.add(ids, [db.docstore.search(doc_id).page_content for doc_id in ids])
+    return lexical
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60, key=lambda item: item) -> list:
+    """
+    Объединяет несколько ранжированных списков: элемент получает сумму 1 / (k + позиция)
+    по всем спискам, в которых встречается. Одинаковые (по key) элементы склеиваются.
+
+    :return: Элементы по убыванию суммарной оценки.
+    """
+    scores = {}
+    items = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            item_key = key(item)
+            items.setdefault(item_key, item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1 / (k + rank)
+    return [items[item_key] for item_key in sorted(scores, key=scores.get, reverse=True)]
@@ -0,0 +1,311 @@
+""" Пул серверов LLM (Ollama) с балансировкой нагрузки.
+
+Серверы задаются списком "адрес|модель|лимит" (см. parse_backends). Запрос к модели отправляется
+на подходящий сервер с наименьшей загрузкой (выполняющиеся запросы относительно лимита сервера),
+при ошибке повторяется на другом сервере. После failures ошибок подряд сервер исключается
+из балансировки на cooldown секунд (размыкатель цепи), затем снова получает запросы,
+но первая же ошибка опять исключает его; успешный ответ сбрасывает счетчик ошибок.
+
+Фоновая проверка (start) опрашивает /api/tags каждого сервера и загружает в память
+модели resident_models, если Ollama их выгрузила (запрос /api/generate без промпта с keep_alive),
+поэтому первый запрос пользователя не ждет загрузки модели.
+"""
+
+import asyncio
+import time
+
+from loguru import logger
+
+from utils import metrics
+
+
+class LLMBackend:
+    """Сервер Ollama: адрес, модели, лимит одновременных запросов и состояние размыкателя цепи."""
+
+    def __init__(self, url: str, models=None, max_concurrency: int = 1):
+        """
+        :param url: Адрес сервера, например http://localhost:11434.
+        :param models: Модели, которые обслуживает сервер (None - любые).
+        :param max_concurrency: Лимит одновременных запросов (обычно равен OLLAMA_NUM_PARALLEL сервера).
+        """
+        self.url = url.rstrip('/')
+        self.models = set(models) if models else None
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.healthy = True
+        self.loaded_models = set()
+        self.clients = {}
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def available(self, now: float) -> bool:
+        """Сервер исправен и цепь замкнута (или истекло время ожидания после размыкания)."""
+        return self.healthy and self.open_until <= now
+
+    def load(self) -> float:
+        return self.outstanding / self.max_concurrency
+
+    def __repr__(self):
+        return f'LLMBackend({self.url})'
+
+
+def parse_backends(value: str, default_concurrency: int = 1) -> list:
+    """
+    Разбор списка серверов: записи через запятую в формате "адрес|модели|лимит",
+    модели перечисляются через пробел, пустое значение - любые модели. Например:
+    "http://localhost:11434|qwen2.5-coder:1.5b|2, http://gpu:11434||4".
+    """
+    backends = []
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        url, models, limit = (item.split('|') + ['', ''])[:3]
+        backends.append(LLMBackend(url.strip(), models.split() or None,
+                                   int(limit) if limit.strip() else default_concurrency))
+    return backends
+
+
+class LLMPool:
+    """Пул серверов LLM: выбор наименее загруженного сервера, повтор на другом сервере и проверка серверов."""
+
+    def __init__(self, backends: list, keep_alive=None, retries: int = 1, failures: int = 3,
+                 cooldown: float = 30, health_interval: float = 15, resident_models=(), timeout: float = None,
+                 temperature: float = 0.5):
+        """
+        :param backends: Серверы (LLMBackend).
+        :param keep_alive: Сколько Ollama держит модель в памяти после запроса ("30m", секунды, -1 - всегда).
+        :param retries: Количество повторов запроса на других серверах.
+        :param failures: Ошибок подряд, после которых цепь сервера размыкается.
+        :param cooldown: Время (с), на которое сервер исключается из балансировки.
+        :param health_interval: Период (с) фоновой проверки серверов, 0 - без проверки.
+        :param resident_models: Модели, которые должны быть загружены на всех обслуживающих их серверах.
+        :param timeout: Таймаут HTTP-запроса к серверу (с).
+        """
+        if not backends:
+            raise ValueError('Не задан ни один сервер LLM')
+        self.backends = backends
+        # число в строке настройки ("-1", "600") Ollama принимает только как число
+        if isinstance(keep_alive, str) and keep_alive.lstrip('-').isdigit():
+            keep_alive = int(keep_alive)
+        self.keep_alive = keep_alive
+        self.retries = retries
+        self.failures = failures
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self.resident_models = tuple(resident_models)
+        self.timeout = timeout
+        self.temperature = temperature
+        self._released = asyncio.Condition()
+        self._health_task = None
+
+    def client(self, model: str):
+        """Клиент модели model с интерфейсом ChatOllama (ainvoke, astream), запросы идут через пул."""
+        return PooledChatModel(self, model)
+
+    def _chat_model(self, backend: LLMBackend, model: str, options=None):
+        """
+        Клиент ChatOllama модели model на сервере backend. options - параметры модели (num_predict и др.),
+        которые заменяют параметры клиента, остальные (temperature, keep_alive) сохраняются.
+        """
+        key = (model, tuple(sorted(options.items()))) if options else model
+        if key not in backend.clients:
+            if options:
+                backend.clients[key] = self._chat_model(backend, model).model_copy(update=options)
+            else:
+                from langchain_ollama import ChatOllama
+                backend.clients[key] = ChatOllama(model=model, base_url=backend.url, temperature=self.temperature,
+                                                  keep_alive=self.keep_alive,
+                                                  client_kwargs={'timeout': self.timeout})
+        return backend.clients[key]
+
+    def _pick(self, model: str, exclude) -> LLMBackend:
+        """
+        Наименее загруженный сервер модели со свободным слотом (при равной загрузке - сервер,
+        на котором модель уже в памяти). Если исправных серверов нет,
+        выбирается из всех (раньше других - сервер, цепь которого разомкнута дольше всех):
+        лучше попытаться, чем сразу отказать пользователю.
+        """
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.serves(model) and b not in exclude]
+        if not candidates:
+            raise LookupError(f'Нет сервера LLM для модели {model}')
+        available = [b for b in candidates if b.available(now)] or \
+            sorted(candidates, key=lambda b: b.open_until)[:1]
+        free = [b for b in available if b.outstanding < b.max_concurrency]
+        return min(free, key=lambda b: (b.load(), model not in b.loaded_models)) if free else None
+
+    def _can_retry(self, model: str, tried: list) -> bool:
+        """Остались ли попытки и другие серверы модели."""
+        return len(tried) <= self.retries and any(b.serves(model) and b not in tried for b in self.backends)
+
+    async def _acquire(self, model: str, exclude) -> LLMBackend:
+        async with self._released:
+            backend = self._pick(model, exclude)
+            while backend is None:
+                await self._released.wait()
+                backend = self._pick(model, exclude)
+            backend.outstanding += 1
+            return backend
+
+    async def _release(self, backend: LLMBackend, error: BaseException = None):
+        backend.outstanding -= 1
+        if error is None:
+            backend.failures = 0
+            backend.open_until = 0.0
+        elif isinstance(error, Exception):
+            backend.failures += 1
+            if backend.failures >= self.failures:
+                backend.open_until = time.monotonic() + self.cooldown
+                logger.warning(f'LLM {backend.url}: {backend.failures} ошибок подряд, '
+                               f'сервер исключен на {self.cooldown} с')
+        result = 'ok' if error is None else 'error' if isinstance(error, Exception) else 'cancelled'
+        metrics.inc('llm_requests_total', labels={'backend': backend.url, 'result': result})
+        async with self._released:
+            self._released.notify_all()
+
+    async def ainvoke(self, model: str, messages, options=None, **kwargs):
+        """
+        Генерация ответа целиком; при ошибке запрос повторяется на другом сервере.
+        options - параметры модели для этого запроса (см. _chat_model).
+        """
+        tried = []
+        while True:
+            backend = await self._acquire(model, tried)
+            try:
+                result = await self._chat_model(backend, model, options).ainvoke(messages, **kwargs)
+            except BaseException as e:
+                await asyncio.shield(self._release(backend, e))
+                tried.append(backend)
+                if not isinstance(e, Exception) or not self._can_retry(model, tried):
+                    raise
+                logger.warning(f'LLM {backend.url}: {e!r}, повтор на другом сервере')
+                continue
+            await self._release(backend)
+            return result
+
+    async def astream(self, model: str, messages, options=None, **kwargs):
+        """
+        Потоковая генерация. Запрос повторяется на другом сервере, только если ошибка
+        произошла до первого фрагмента ответа. options - параметры модели (см. _chat_model).
+        """
+        tried = []
+        while True:
+            backend = await self._acquire(model, tried)
+            started = False
+            try:
+                async for chunk in self._chat_model(backend, model, options).astream(messages, **kwargs):
+                    started = True
+                    yield chunk
+            except BaseException as e:
+                await asyncio.shield(self._release(backend, e))
+                tried.append(backend)
+                if started or not isinstance(e, Exception) or not self._can_retry(model, tried):
+                    raise
+                logger.warning(f'LLM {backend.url}: {e!r}, повтор на другом сервере')
+                continue
+            await self._release(backend)
+            return
+
+    async def check(self, session, backend: LLMBackend):
+        """Проверка сервера: список моделей (/api/tags), загруженные модели (/api/ps), загрузка resident_models."""
+        import aiohttp
+        timeout = aiohttp.ClientTimeout(total=10)
+        try:
+            async with session.get(f'{backend.url}/api/tags', timeout=timeout) as response:
+                response.raise_for_status()
+            async with session.get(f'{backend.url}/api/ps', timeout=timeout) as response:
+                response.raise_for_status()
+                backend.loaded_models = {model['name'] for model in (await response.json()).get('models', [])}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if backend.healthy:
+                logger.warning(f'LLM {backend.url} недоступен: {e!r}')
+            backend.healthy = False
+            return
+        if not backend.healthy:
+            logger.info(f'LLM {backend.url} снова доступен')
+            backend.failures = 0
+            backend.open_until = 0.0
+        backend.healthy = True
+
+        for model in self.resident_models:
+            if backend.serves(model) and model not in backend.loaded_models:
+                await self.preload(session, backend, model)
+
+    async def preload(self, session, backend: LLMBackend, model: str):
+        """Загрузка модели в память сервера без генерации (POST /api/generate без промпта)."""
+        import aiohttp
+        payload = {'model': model}
+        if self.keep_alive is not None:
+            payload['keep_alive'] = self.keep_alive
+        start = time.perf_counter()
+        try:
+            async with session.post(f'{backend.url}/api/generate', json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                response.raise_for_status()
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f'LLM {backend.url}: не удалось загрузить {model}: {e!r}')
+            return
+        backend.loaded_models.add(model)
+        logger.info(f'LLM {backend.url}: модель {model} загружена за {time.perf_counter() - start:.1f} с')
+
+    async def check_all(self):
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(self.check(session, backend) for backend in self.backends))
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(self.health_interval)
+
+    def start(self):
+        """Запуск фоновой проверки серверов."""
+        if self.health_interval and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.wait([self._health_task])
+            self._health_task = None
+
+    def stats(self) -> list:
+        """Состояние серверов."""
+        now = time.monotonic()
+        return [{'url': b.url, 'outstanding': b.outstanding, 'max_concurrency': b.max_concurrency,
+                 'healthy': b.healthy, 'circuit_open': b.open_until > now, 'loaded_models': sorted(b.loaded_models)}
+                for b in self.backends]
+
+
+class PooledChatModel:
+    """Клиент одной модели в пуле серверов: ainvoke и astream как у ChatOllama."""
+
+    def __init__(self, pool: LLMPool, model: str, options=None):
+        """
+        :param pool: Пул серверов.
+        :param model: Модель.
+        :param options: Параметры модели (num_predict и др.), которые заменяют параметры по умолчанию.
+        """
+        self.pool = pool
+        self.model = model
+        self.options = options or {}
+
+    def bind(self, **options) -> 'PooledChatModel':
+        """
+        Клиент той же модели с другими параметрами, например bind(num_predict=100).
+        Остальные параметры (temperature, keep_alive) не меняются.
+        """
+        return PooledChatModel(self.pool, self.model, {**self.options, **options})
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self.pool.ainvoke(self.model, messages, options=self.options, **kwargs)
+
+    def astream(self, messages, **kwargs):
+        return self.pool.astream(self.model, messages, options=self.options, **kwargs)
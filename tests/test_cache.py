@@ -0,0 +1,52 @@
+""" Тесты LRU-кэша с временем жизни записей (utils/cache.py). """
+
+from utils import cache as cache_module
+from utils.cache import LRUCache, MISSING
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1      # a использовалась позже b
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_none_is_cached_and_stats_are_counted():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', None)
+    assert cache.get('a') is None
+    assert cache.get('b', default='нет') == 'нет'
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    now[0] += 30
+    cache.set('b', 2)
+    now[0] += 31
+    assert cache.get('a') is MISSING
+    assert cache.get('b') == 2
+    assert len(cache) == 1
+    # повторная запись продлевает время жизни
+    cache.set('b', 3)
+    now[0] += 59
+    assert cache.get('b') == 3
+
+
+def test_update_and_pop():
+    cache = LRUCache(maxsize=10)
+    cache.set('user', {'in_dialog': False, 'name': 'Иван'})
+    cache.update('user', in_dialog=True)
+    cache.update('missing', in_dialog=True)
+    assert cache.get('user') == {'in_dialog': True, 'name': 'Иван'}
+    assert cache.get('missing') is MISSING
+    cache.pop('user')
+    cache.pop('user')
+    assert len(cache) == 0
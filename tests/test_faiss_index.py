@@ -0,0 +1,61 @@
+""" Тесты типов индексов FAISS (rag/faiss_index.py) при инкрементальном обновлении Базы-Знаний. """
+
+import os
+
+import faiss
+import numpy as np
+
+from bench.retrieval_bench import load_text_pages, make_synthetic_corpus
+from bench.stubs import HashingEmbeddings
+from rag import ingest
+from rag.faiss_index import index_type_of, supports_remove
+from rag.index_report import build_report
+
+PARAMS = {'nlist': 8, 'pq_m': 8}
+
+
+def build(db_dir, pdf_dir, embeddings):
+    db, plan = ingest.update_index(embeddings, db_dir, pdf_dir, workers=1, index_type='ivfpq', params=PARAMS,
+                                   loader=load_text_pages)
+    return db, plan
+
+
+def test_removing_a_file_keeps_ivfpq_ids_consistent(tmp_path):
+    pdf_dir, db_dir = str(tmp_path / 'pdf'), str(tmp_path / 'db')
+    make_synthetic_corpus(pdf_dir, docs=30, pages=4)
+    embeddings = HashingEmbeddings(size=64)
+    db, _ = build(db_dir, pdf_dir, embeddings)
+    assert index_type_of(db.index) == 'ivfpq'
+
+    os.remove(os.path.join(pdf_dir, 'doc0000.pdf'))
+    db, plan = build(db_dir, pdf_dir, embeddings)
+    assert plan['removed'] == ['doc0000.pdf']
+    assert index_type_of(db.index) == 'ivfpq'
+    assert db.index.ntotal == len(db.index_to_docstore_id)
+
+    # каждый оставшийся кусочек находится по собственному тексту (точный поиск по всем кластерам)
+    db.index.nprobe = PARAMS['nlist']
+    docs = [db.docstore.search(doc_id) for doc_id in db.index_to_docstore_id.values()]
+    assert not any(doc.metadata['source'].endswith('doc0000.pdf') for doc in docs)
+    vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+    mismatches = 0
+    for doc, vector in zip(docs, vectors):
+        found = db.similarity_search_by_vector(vector, k=5)
+        if doc.page_content not in [item.page_content for item in found]:
+            mismatches += 1
+    assert mismatches == 0
+
+
+def test_ivf_and_hnsw_indexes_do_not_support_remove():
+    dim = 8
+    assert supports_remove(faiss.IndexFlatL2(dim))
+    assert not supports_remove(faiss.IndexHNSWFlat(dim, 4))
+    assert not supports_remove(faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, 2, 2, 4))
+
+
+def test_report_labels_fallback_index_with_actual_type():
+    vectors = np.random.default_rng(0).standard_normal((300, 16)).astype(np.float32)
+    report = build_report(vectors, queries=100, params={'nlist': 4, 'pq_m': 4})
+    # 200 векторов меньше 2 ** pq_bits: вместо ivfpq строится flat
+    assert [row['type'] for row in report if row.get('requested') == 'ivfpq'] == ['flat']
+    assert not any(row['type'] == 'ivfpq' for row in report)
@@ -0,0 +1,139 @@
+""" Тесты отложенной записи истории диалогов (db_handler/history_writer.py). """
+
+import asyncio
+
+from db_handler.history_writer import HistoryWriter
+
+
+class FakeStorage:
+    """Хранилище в памяти; запись пачки можно задержать (gate) или сделать ошибочной (fail)."""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = None
+        self.fail = False
+        self.writing = asyncio.Event()
+
+    async def add_history(self, rows):
+        self.writing.set()
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise OSError('database is locked')
+        self.batches.append(list(rows))
+
+    def history(self, user_id):
+        return [{'role': role, 'content': content}
+                for batch in self.batches for uid, role, content in batch if uid == user_id]
+
+
+def test_messages_are_written_in_one_batch():
+    async def scenario():
+        storage = FakeStorage()
+        writer = HistoryWriter(storage, interval=0.01, max_rows=100)
+        writer.start()
+        writer.add(1, 'user', 'вопрос')
+        writer.add(2, 'user', 'другой вопрос')
+        writer.add(1, 'assistant', 'ответ')
+        await asyncio.sleep(0.05)
+        await writer.close()
+        return storage, writer.stats()
+
+    storage, stats = asyncio.run(scenario())
+    assert storage.batches == [[(1, 'user', 'вопрос'), (2, 'user', 'другой вопрос'), (1, 'assistant', 'ответ')]]
+    assert stats == {'buffered': 0}
+
+
+def test_full_batch_is_written_without_waiting_for_interval():
+    async def scenario():
+        storage = FakeStorage()
+        writer = HistoryWriter(storage, interval=60, max_rows=2)
+        writer.start()
+        writer.add(1, 'user', 'вопрос')
+        writer.add(1, 'assistant', 'ответ')
+        await asyncio.wait_for(storage.writing.wait(), 1)
+        await asyncio.sleep(0)
+        batches = list(storage.batches)
+        await writer.close()
+        return batches
+
+    assert asyncio.run(scenario()) == [[(1, 'user', 'вопрос'), (1, 'assistant', 'ответ')]]
+
+
+def test_read_sees_pending_messages_of_the_user():
+    async def scenario():
+        storage = FakeStorage()
+        writer = HistoryWriter(storage, interval=60)
+        writer.add(1, 'user', 'вопрос')
+        writer.add(2, 'user', 'чужой вопрос')
+        async with writer.read(1) as pending:
+            return pending
+
+    assert asyncio.run(scenario()) == [{'role': 'user', 'content': 'вопрос'}]
+
+
+def test_read_during_write_sees_each_message_exactly_once():
+    async def scenario():
+        storage = FakeStorage()
+        storage.gate = asyncio.Event()
+        writer = HistoryWriter(storage, interval=60)
+        writer.add(1, 'user', 'вопрос')
+        flush = asyncio.create_task(writer.flush())
+        await storage.writing.wait()
+
+        # пачка уже забрана из буфера, но еще не записана: чтение ждет окончания записи
+        async def read():
+            async with writer.read(1) as pending:
+                return storage.history(1) + pending
+        reader = asyncio.create_task(read())
+        await asyncio.sleep(0.01)
+        waited = not reader.done()
+        storage.gate.set()
+        await flush
+        return waited, await reader
+
+    waited, history = asyncio.run(scenario())
+    assert waited
+    assert history == [{'role': 'user', 'content': 'вопрос'}]
+
+
+def test_write_waits_for_current_readers():
+    async def scenario():
+        storage = FakeStorage()
+        writer = HistoryWriter(storage, interval=60)
+        writer.add(1, 'user', 'вопрос')
+        async with writer.read(1) as pending:
+            flush = asyncio.create_task(writer.flush())
+            await asyncio.sleep(0.01)
+            # пока читатель не закончил, сообщение остается в буфере и не записывается
+            in_storage = storage.history(1)
+            writer.discard(1)
+        await flush
+        return pending, in_storage, storage.batches
+
+    pending, in_storage, batches = asyncio.run(scenario())
+    assert pending == [{'role': 'user', 'content': 'вопрос'}]
+    assert in_storage == []
+    # очистка диалога внутри чтения удалила сообщение до записи
+    assert batches == []
+
+
+def test_failed_write_keeps_messages_and_close_flushes_them():
+    async def scenario():
+        storage = FakeStorage()
+        storage.fail = True
+        writer = HistoryWriter(storage, interval=60)
+        writer.add(1, 'user', 'первый')
+        flushed = await writer.flush()
+        writer.add(1, 'user', 'второй')
+        async with writer.read(1) as pending:
+            pass
+        storage.fail = False
+        await writer.close()
+        return flushed, pending, storage.batches
+
+    flushed, pending, batches = asyncio.run(scenario())
+    assert flushed is False
+    # порядок сообщений сохраняется
+    assert [message['content'] for message in pending] == ['первый', 'второй']
+    assert batches == [[(1, 'user', 'первый'), (1, 'user', 'второй')]]
@@ -0,0 +1,124 @@
+""" Тесты перезагрузки пересобранных Баз-Знаний без перезапуска бота (rag/index_registry.py). """
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bench.retrieval_bench import load_text_pages, make_synthetic_corpus
+from bench.stubs import HashingEmbeddings
+from rag import ingest
+from rag.index_registry import IndexRegistry, validate_index
+
+EMBEDDINGS = HashingEmbeddings(size=32)
+
+
+def build(db_dir, pdf_dir, embeddings=EMBEDDINGS):
+    ingest.update_index(embeddings, db_dir, pdf_dir, workers=1, loader=load_text_pages)
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    pdf_dir, db_dir = str(tmp_path / 'pdf'), str(tmp_path / 'db')
+    make_synthetic_corpus(pdf_dir, docs=3, pages=2)
+    build(db_dir, pdf_dir)
+    return pdf_dir, db_dir
+
+
+def run_with_registry(scenario, **kwargs):
+    async def main():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            registry = IndexRegistry(EMBEDDINGS, executor, memory_budget=2 ** 30, **kwargs)
+            try:
+                return await scenario(registry)
+            finally:
+                await registry.close()
+    return asyncio.run(main())
+
+
+def test_rebuilt_index_replaces_old_version(knowledge_base):
+    pdf_dir, db_dir = knowledge_base
+
+    async def scenario(registry):
+        old = await registry.get('mode', db_dir)
+        unchanged = await registry.reload(db_dir)
+        make_synthetic_corpus(pdf_dir, docs=5, pages=2)
+        build(db_dir, pdf_dir)
+        reloaded = await registry.reload(db_dir)
+        new = await registry.get('mode', db_dir)
+        # запрос, получивший старую версию, дорабатывает с ней
+        old_docs = old.store.similarity_search('параметр', k=1)
+        return unchanged, reloaded, old, new, old_docs
+
+    unchanged, reloaded, old, new, old_docs = run_with_registry(scenario)
+    assert unchanged is False and reloaded is True
+    assert new is not old and new.version != old.version
+    assert new.store.index.ntotal > old.store.index.ntotal
+    assert new.lexical is not None and len(new.lexical) == new.store.index.ntotal
+    assert old_docs
+
+
+def test_index_with_other_dimension_is_rejected(knowledge_base, tmp_path):
+    pdf_dir, db_dir = knowledge_base
+    other_dir = str(tmp_path / 'other')
+    build(other_dir, pdf_dir, HashingEmbeddings(size=16))
+
+    async def scenario(registry):
+        old = await registry.get('mode', db_dir)
+        ingest.swap_dir(other_dir, db_dir)
+        results = await registry.reload_all()
+        # версия, не прошедшая проверку, повторно не загружается наблюдением
+        await registry._check_files()
+        await registry._check_files()
+        return old, results, await registry.get('mode', db_dir)
+
+    old, results, current = run_with_registry(scenario)
+    assert 'размерность векторов 16 вместо 32' in results[db_dir]
+    assert current is old
+
+
+def test_watcher_reloads_after_files_stop_changing(knowledge_base):
+    pdf_dir, db_dir = knowledge_base
+
+    async def scenario(registry):
+        old = await registry.get('mode', db_dir)
+        make_synthetic_corpus(pdf_dir, docs=4, pages=2)
+        build(db_dir, pdf_dir)
+        await registry._check_files()
+        first = await registry.get('mode', db_dir)
+        await registry._check_files()
+        return old, first, await registry.get('mode', db_dir)
+
+    old, first, second = run_with_registry(scenario)
+    # изменение замечено при первой проверке, база заменена при второй
+    assert first is old
+    assert second is not old and second.store.index.ntotal > old.store.index.ntotal
+
+
+def test_validate_index_rejects_inconsistent_bases(knowledge_base):
+    pdf_dir, db_dir = knowledge_base
+
+    async def scenario(registry):
+        return await registry.get('mode', db_dir)
+
+    loaded = run_with_registry(scenario)
+    validate_index(loaded, loaded)
+
+    # контрольная точка незавершенной сборки
+    manifest = ingest.load_manifest(db_dir)
+    ingest.save_manifest(db_dir, {**manifest, 'partial': {'doc0000.pdf': []}})
+    with pytest.raises(ValueError, match='не завершена'):
+        validate_index(loaded)
+    ingest.save_manifest(db_dir, manifest)
+
+    # лексический индекс от другой сборки
+    loaded.lexical.add(['unknown'], ['текст'])
+    with pytest.raises(ValueError, match='лексический'):
+        validate_index(loaded)
+    loaded.lexical.remove(['unknown'])
+
+    # векторов больше, чем документов
+    mapping = loaded.store.index_to_docstore_id
+    mapping.pop(max(mapping))
+    with pytest.raises(ValueError, match='векторов'):
+        validate_index(loaded)
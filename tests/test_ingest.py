@@ -0,0 +1,105 @@
+""" Тесты инкрементальной сборки Базы-Знаний по манифесту (rag/ingest.py). """
+
+import os
+
+from bench.retrieval_bench import PAGE_SEPARATOR, load_text_pages, make_synthetic_corpus
+from bench.stubs import HashingEmbeddings
+from rag import ingest
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """Эмбеддинги, которые запоминают тексты, переданные модели."""
+
+    def __init__(self):
+        super().__init__(size=32)
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+def write(pdf_dir, rel, text):
+    with open(os.path.join(pdf_dir, rel), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def build(db_dir, pdf_dir, embeddings, **kwargs):
+    return ingest.update_index(embeddings, db_dir, pdf_dir, workers=1, loader=load_text_pages, **kwargs)
+
+
+def test_plan_changes(tmp_path):
+    pdf_dir = str(tmp_path)
+    for rel in ('a.pdf', 'b.pdf', 'c.pdf'):
+        write(pdf_dir, rel, f'содержимое {rel}')
+    os.makedirs(tmp_path / 'sub')
+    write(pdf_dir, os.path.join('sub', 'd.pdf'), 'вложенный')
+    write(pdf_dir, 'notes.txt', 'не PDF')
+
+    plan = ingest.plan_changes(pdf_dir, None)
+    assert plan['added'] == ['a.pdf', 'b.pdf', 'c.pdf', os.path.join('sub', 'd.pdf')]
+
+    manifest = {'files': {rel: {'sha256': sha} for rel, sha in plan['hashes'].items()}}
+    manifest['files']['gone.pdf'] = {'sha256': '0'}
+    write(pdf_dir, 'b.pdf', 'новое содержимое')
+    os.remove(os.path.join(pdf_dir, 'c.pdf'))
+    write(pdf_dir, 'e.pdf', 'новый файл')
+    plan = ingest.plan_changes(pdf_dir, manifest)
+    assert plan['added'] == ['e.pdf']
+    assert plan['changed'] == ['b.pdf']
+    assert plan['removed'] == ['c.pdf', 'gone.pdf']
+    assert plan['unchanged'] == ['a.pdf', os.path.join('sub', 'd.pdf')]
+
+
+def test_chunk_ids_depend_on_path_and_content():
+    ids = ingest.chunk_ids_for('a.pdf', 'sha', 3)
+    assert ids == ingest.chunk_ids_for('a.pdf', 'sha', 3)
+    assert len(set(ids)) == 3
+    # одинаковые копии документа в разных каталогах и новая версия файла получают свои id
+    assert not set(ids) & set(ingest.chunk_ids_for('copy/a.pdf', 'sha', 3))
+    assert not set(ids) & set(ingest.chunk_ids_for('a.pdf', 'sha2', 3))
+
+
+def test_only_new_and_changed_files_are_embedded(tmp_path):
+    pdf_dir, db_dir = str(tmp_path / 'pdf'), str(tmp_path / 'db')
+    make_synthetic_corpus(pdf_dir, docs=4, pages=2)
+    embeddings = CountingEmbeddings()
+    db, plan = build(db_dir, pdf_dir, embeddings)
+    assert len(plan['added']) == 4
+    manifest = ingest.load_manifest(db_dir)
+    total = sum(len(entry['chunk_ids']) for entry in manifest['files'].values())
+    assert db.index.ntotal == total == len(embeddings.texts)
+
+    # повторная сборка без изменений ничего не пересчитывает
+    embeddings.texts.clear()
+    _, plan = build(db_dir, pdf_dir, embeddings)
+    assert plan['unchanged'] == sorted(manifest['files']) and embeddings.texts == []
+
+    # измененный файл пересчитывается, удаленный убирается из индекса
+    write(pdf_dir, 'doc0001.pdf', PAGE_SEPARATOR.join(['Реквизит Обновленный описан заново.'] * 2))
+    os.remove(os.path.join(pdf_dir, 'doc0002.pdf'))
+    db, plan = build(db_dir, pdf_dir, embeddings)
+    assert plan['changed'] == ['doc0001.pdf'] and plan['removed'] == ['doc0002.pdf']
+    assert all('Обновленный' in text for text in embeddings.texts)
+
+    manifest = ingest.load_manifest(db_dir)
+    assert sorted(manifest['files']) == ['doc0000.pdf', 'doc0001.pdf', 'doc0003.pdf']
+    ids = [doc_id for entry in manifest['files'].values() for doc_id in entry['chunk_ids']]
+    assert sorted(ids) == sorted(db.index_to_docstore_id.values())
+    sources = {os.path.basename(db.docstore.search(doc_id).metadata['source']) for doc_id in ids}
+    assert 'doc0002.pdf' not in sources
+
+
+def test_manifest_is_restored_from_index_without_it(tmp_path):
+    pdf_dir, db_dir = str(tmp_path / 'pdf'), str(tmp_path / 'db')
+    make_synthetic_corpus(pdf_dir, docs=2, pages=2)
+    embeddings = CountingEmbeddings()
+    build(db_dir, pdf_dir, embeddings)
+    os.remove(os.path.join(db_dir, ingest.MANIFEST_NAME))
+
+    embeddings.texts.clear()
+    _, plan = build(db_dir, pdf_dir, embeddings)
+    # файлы, найденные в индексе по метаданным source, не пересчитываются
+    assert plan['unchanged'] == ['doc0000.pdf', 'doc0001.pdf']
+    assert embeddings.texts == []
+    assert ingest.load_manifest(db_dir) is not None
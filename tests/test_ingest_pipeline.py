@@ -0,0 +1,97 @@
+""" Тесты конвейера сборки Базы-Знаний: чтение в пуле процессов, контрольные точки и замена каталога (rag/ingest.py). """
+
+import os
+
+import pytest
+
+from bench.retrieval_bench import load_text_pages, make_synthetic_corpus
+from bench.stubs import HashingEmbeddings
+from rag import ingest
+
+
+class FailingEmbeddings(HashingEmbeddings):
+    """Эмбеддинги, которые падают на вызове номер fail_on (имитация сбоя посреди сборки)."""
+
+    def __init__(self, fail_on: int = None):
+        super().__init__(size=32)
+        self.fail_on = fail_on
+        self.calls = 0
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError('сбой модели')
+        self.texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+def build(db_dir, pdf_dir, embeddings):
+    return ingest.update_index(embeddings, db_dir, pdf_dir, workers=2, batch_size=4, checkpoint_every=1,
+                               loader=load_text_pages)
+
+
+def read_files(path):
+    result = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            result[name] = f.read()
+    return result
+
+
+def test_parse_pdfs_reads_every_file(tmp_path):
+    make_synthetic_corpus(str(tmp_path), docs=5, pages=3)
+    files = sorted(ingest.scan_pdfs(str(tmp_path)).items())
+    parsed = dict(ingest.parse_pdfs(files, workers=2, loader=load_text_pages))
+    assert sorted(parsed) == [rel for rel, _ in files]
+    assert all(len(pages) == 3 for pages in parsed.values())
+
+
+def test_swap_dir_and_recover_dir(tmp_path):
+    db_dir, new_dir = tmp_path / 'db', tmp_path / 'new'
+    db_dir.mkdir()
+    (db_dir / 'index').write_text('old')
+    new_dir.mkdir()
+    (new_dir / 'index').write_text('new')
+
+    ingest.swap_dir(str(new_dir), str(db_dir))
+    assert (db_dir / 'index').read_text() == 'new'
+    assert not new_dir.exists() and not (tmp_path / 'db.old').exists()
+
+    # сбой между переименованиями: рабочего каталога нет, прежняя версия в .old
+    os.rename(db_dir, tmp_path / 'db.old')
+    ingest.recover_dir(str(db_dir))
+    assert (db_dir / 'index').read_text() == 'new'
+    assert not (tmp_path / 'db.old').exists()
+
+
+def test_crash_keeps_live_index_and_resumes_from_staging(tmp_path):
+    pdf_dir, db_dir = str(tmp_path / 'pdf'), str(tmp_path / 'db')
+    make_synthetic_corpus(pdf_dir, docs=2, pages=2)
+    build(db_dir, pdf_dir, FailingEmbeddings())
+    live = read_files(db_dir)
+
+    make_synthetic_corpus(pdf_dir, docs=8, pages=2, seed=1)
+    failing = FailingEmbeddings(fail_on=4)
+    with pytest.raises(RuntimeError):
+        build(db_dir, pdf_dir, failing)
+    # рабочая база не изменилась, прогресс сохранен в контрольной точке
+    assert read_files(db_dir) == live
+    staging = ingest.staging_dir(db_dir)
+    checkpoint = ingest.load_manifest(staging)
+    assert checkpoint is not None and checkpoint['files']
+
+    resumed = FailingEmbeddings()
+    db, _ = build(db_dir, pdf_dir, resumed)
+    assert not os.path.exists(staging)
+    manifest = ingest.load_manifest(db_dir)
+    assert 'partial' not in manifest
+    assert sorted(manifest['files']) == [f'doc{d:04d}.pdf' for d in range(8)]
+    ids = [doc_id for entry in manifest['files'].values() for doc_id in entry['chunk_ids']]
+    # каждый кусочек в индексе ровно один раз
+    assert len(ids) == len(set(ids)) == db.index.ntotal
+    assert sorted(ids) == sorted(db.index_to_docstore_id.values())
+    # файлы, готовые к моменту сбоя, повторно не считаются
+    done_ids = [doc_id for entry in checkpoint['files'].values() for doc_id in entry['chunk_ids']]
+    done_texts = {db.docstore.search(doc_id).page_content for doc_id in done_ids}
+    assert done_texts and not done_texts & set(resumed.texts)
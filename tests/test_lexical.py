@@ -0,0 +1,58 @@
+""" Тесты лексического индекса BM25 и объединения результатов RRF (rag/lexical.py). """
+
+from rag.lexical import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_splits_dotted_names():
+    assert tokenize('Справочники.Номенклатура и НСИ, 1С v8') == ['справочники', 'номенклатура', 'нси', '1с', 'v8']
+
+
+def test_search_ranks_exact_term_first():
+    index = LexicalIndex()
+    index.add(['a', 'b', 'c'], ['проведение документа реализация',
+                                'Справочники.Номенклатура заполнение реквизитов',
+                                'заполнение табличной части документа'])
+    ids = [doc_id for doc_id, _ in index.search('номенклатура заполнение', k=3)]
+    assert ids[0] == 'b'
+    assert set(ids) == {'b', 'c'}
+    assert index.search('номенклатура', k=3)[0][1] > 0
+    assert index.search('отсутствующее', k=3) == []
+
+
+def test_add_replaces_and_remove_deletes():
+    index = LexicalIndex()
+    index.add(['a', 'b'], ['склад остатки', 'склад цена'])
+    index.add(['a'], ['договор контрагент'])
+    assert len(index) == 2
+    assert [doc_id for doc_id, _ in index.search('остатки', k=5)] == []
+    assert [doc_id for doc_id, _ in index.search('договор', k=5)] == ['a']
+
+    index.remove(['a', 'missing'])
+    assert len(index) == 1
+    assert index.search('договор', k=5) == []
+    # слова удаленного документа не остаются в индексе, длина корпуса пересчитана
+    assert 'контрагент' not in index.postings
+    assert index.total_len == index.doc_len['b'] == 2
+
+    index.remove(['b'])
+    assert len(index) == 0 and index.postings == {} and index.total_len == 0
+    assert index.search('склад', k=5) == []
+
+
+def test_reciprocal_rank_fusion():
+    vector = ['a', 'b', 'c']
+    lexical = ['c', 'd', 'a']
+    fused = reciprocal_rank_fusion([vector, lexical], k=60)
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 - одинаково, но выше элементов из одного списка
+    assert set(fused[:2]) == {'a', 'c'}
+    assert fused[2:] == ['b', 'd']
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_reciprocal_rank_fusion_merges_by_key():
+    vector = [('doc1', 0.9), ('doc2', 0.8)]
+    lexical = [('doc2', 12.0), ('doc3', 3.0)]
+    fused = reciprocal_rank_fusion([vector, lexical], key=lambda item: item[0])
+    assert [doc for doc, _ in fused] == ['doc2', 'doc1', 'doc3']
+    # из одинаковых элементов остается первый встреченный
+    assert fused[0] == ('doc2', 0.8)
@@ -0,0 +1,149 @@
+""" Тесты пула серверов LLM (rag/llm_pool.py) на заглушке Ollama (bench/ollama_stub.py). """
+
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from bench.ollama_stub import OllamaStub, start_stub
+from rag.llm_pool import LLMBackend, LLMPool
+
+MODEL = 'qwen2.5-coder:1.5b'
+PROMPT = [HumanMessage(content='вопрос')]
+
+
+def make_stub(**kwargs) -> OllamaStub:
+    kwargs.setdefault('first_token', 0)
+    kwargs.setdefault('token_interval', 0)
+    kwargs.setdefault('tokens', 3)
+    kwargs.setdefault('load_time', 0)
+    return OllamaStub(models=(MODEL,), **kwargs)
+
+
+async def start_stubs(*stubs):
+    started = [await start_stub(stub) for stub in stubs]
+    return [runner for runner, _ in started], [url for _, url in started]
+
+
+async def cleanup(runners):
+    for runner in runners:
+        await runner.cleanup()
+
+
+def test_least_loaded_backend_is_picked():
+    async def scenario():
+        stubs = [make_stub(parallel=2, first_token=0.2), make_stub(parallel=2, first_token=0.2)]
+        runners, urls = await start_stubs(*stubs)
+        pool = LLMPool([LLMBackend(url, max_concurrency=2) for url in urls], health_interval=0)
+        try:
+            client = pool.client(MODEL)
+            await asyncio.gather(*(client.ainvoke(PROMPT) for _ in range(4)))
+        finally:
+            await cleanup(runners)
+        return stubs, pool
+
+    stubs, pool = asyncio.run(scenario())
+    # 4 одновременных запроса распределяются поровну, слоты освобождаются
+    assert [stub.requests for stub in stubs] == [2, 2]
+    assert all(backend.outstanding == 0 for backend in pool.backends)
+
+
+def test_pick_prefers_lower_load_and_loaded_model():
+    busy, idle, loaded = LLMBackend('http://a', max_concurrency=4), LLMBackend('http://b', max_concurrency=4), \
+        LLMBackend('http://c', max_concurrency=4)
+    busy.outstanding = 2
+    loaded.loaded_models.add(MODEL)
+    pool = LLMPool([busy, idle, loaded], health_interval=0)
+    assert pool._pick(MODEL, []) is loaded
+    loaded.outstanding = 1
+    assert pool._pick(MODEL, []) is idle
+    # у всех серверов заняты все слоты - ждать освобождения
+    for backend in pool.backends:
+        backend.outstanding = backend.max_concurrency
+    assert pool._pick(MODEL, []) is None
+
+
+def test_retry_on_another_backend():
+    async def scenario():
+        broken, healthy = make_stub(fail_rate=1), make_stub()
+        runners, urls = await start_stubs(broken, healthy)
+        # сначала выбирается сервер с моделью в памяти - неисправный
+        backends = [LLMBackend(url) for url in urls]
+        backends[0].loaded_models.add(MODEL)
+        pool = LLMPool(backends, retries=1, health_interval=0)
+        try:
+            result = await pool.client(MODEL).ainvoke(PROMPT)
+        finally:
+            await cleanup(runners)
+        return broken, healthy, backends, result
+
+    broken, healthy, backends, result = asyncio.run(scenario())
+    assert result.content
+    assert broken.requests == 1 and healthy.requests == 1
+    assert backends[0].failures == 1 and backends[1].failures == 0
+
+
+def test_circuit_breaker_opens_after_failures():
+    async def scenario():
+        broken, healthy = make_stub(fail_rate=1), make_stub()
+        runners, urls = await start_stubs(broken, healthy)
+        backends = [LLMBackend(url) for url in urls]
+        backends[0].loaded_models.add(MODEL)
+        pool = LLMPool([backends[0]], retries=0, failures=2, cooldown=60, health_interval=0)
+        try:
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    await pool.client(MODEL).ainvoke(PROMPT)
+            assert backends[0].open_until > time.monotonic()
+            # сервер с разомкнутой цепью не выбирается, пока есть исправный
+            pool.backends.append(backends[1])
+            for _ in range(3):
+                await pool.client(MODEL).ainvoke(PROMPT)
+        finally:
+            await cleanup(runners)
+        return broken, healthy
+
+    broken, healthy = asyncio.run(scenario())
+    assert broken.requests == 2
+    assert healthy.requests == 3
+
+
+def test_open_circuit_is_tried_when_no_backend_is_available():
+    backend = LLMBackend('http://a')
+    backend.open_until = time.monotonic() + 60
+    pool = LLMPool([backend], health_interval=0)
+    assert pool._pick(MODEL, []) is backend
+
+
+def test_health_check_marks_down_and_recovers():
+    async def scenario():
+        stub = make_stub()
+        runner, url = await start_stub(stub)
+        port = int(url.rsplit(':', 1)[1])
+        backend = LLMBackend(url)
+        pool = LLMPool([backend], health_interval=0, resident_models=[MODEL])
+
+        await pool.check_all()
+        states = [(backend.healthy, MODEL in backend.loaded_models)]
+
+        await runner.cleanup()
+        await pool.check_all()
+        states.append((backend.healthy, MODEL in backend.loaded_models))
+        backend.failures, backend.open_until = 5, time.monotonic() + 60
+
+        runner, _ = await start_stub(stub, port=port)
+        try:
+            await pool.check_all()
+        finally:
+            await runner.cleanup()
+        states.append((backend.healthy, MODEL in backend.loaded_models))
+        return stub, backend, states
+
+    stub, backend, states = asyncio.run(scenario())
+    # модель загружена проверкой (resident_models), недоступный сервер исключен, после восстановления - снова в работе
+    assert states[0] == (True, True)
+    assert states[1][0] is False
+    assert states[2] == (True, True)
+    assert backend.failures == 0 and backend.open_until == 0.0
+    assert stub.loads >= 1
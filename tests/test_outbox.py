@@ -0,0 +1,148 @@
+""" Тесты отправки сообщений с ограничением частоты (utils/outbox.py). """
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from utils import outbox as outbox_module
+from utils.outbox import Outbox, TokenBucket
+from utils.telegram_stream import TELEGRAM_MESSAGE_LIMIT
+
+METHOD = SendMessage(chat_id=1, text='')
+
+
+class FakeBot:
+    """Бот без сети: запоминает запросы, ошибки для очередных запросов задаются списком errors."""
+
+    def __init__(self, errors=()):
+        self.default = SimpleNamespace(parse_mode='HTML')
+        self.sent = []
+        self.edited = []
+        self.errors = list(errors)
+        self.times = []
+
+    def _maybe_fail(self, kwargs):
+        self.times.append(time.monotonic())
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+
+    async def send_message(self, **kwargs):
+        self._maybe_fail(kwargs)
+        self.sent.append(kwargs)
+        return SimpleNamespace(message_id=len(self.sent), **kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        self._maybe_fail(kwargs)
+        self.edited.append(kwargs)
+        return True
+
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(outbox_module.time, 'monotonic', lambda: now[0])
+    bucket = TokenBucket(rate=2, burst=2)
+    # два места подряд без ожидания, третье - через 0.5 с, четвертое - через 1 с
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    assert not bucket.available()
+    now[0] += 2
+    assert bucket.available()
+    bucket.pause(5)
+    assert not bucket.available()
+    now[0] += 5
+    assert bucket.available()
+    assert TokenBucket(rate=0).reserve() == 0.0
+
+
+def test_messages_to_one_chat_are_paced():
+    async def scenario():
+        bot = FakeBot()
+        outbox = Outbox(bot, rate=100, chat_rate=20, chat_burst=1)
+        start = time.monotonic()
+        for i in range(5):
+            await outbox.send(1, f'сообщение {i}')
+        return bot, time.monotonic() - start
+
+    bot, elapsed = asyncio.run(scenario())
+    assert [message['text'] for message in bot.sent] == [f'сообщение {i}' for i in range(5)]
+    # 5 сообщений при 20 в секунду: не быстрее 4 интервалов по 50 мс
+    assert elapsed >= 0.19
+
+
+def test_long_text_is_split():
+    async def scenario():
+        bot = FakeBot()
+        outbox = Outbox(bot, rate=0, chat_rate=0)
+        messages = await outbox.send(1, 'я' * (2 * TELEGRAM_MESSAGE_LIMIT + 10), reply_markup='kb',
+                                     reply_to_message_id=7)
+        return bot, messages
+
+    bot, messages = asyncio.run(scenario())
+    assert len(messages) == 3
+    assert [len(message['text']) for message in bot.sent] == [TELEGRAM_MESSAGE_LIMIT, TELEGRAM_MESSAGE_LIMIT, 10]
+    # ответ на сообщение пользователя - первая часть, клавиатура - у последней
+    assert bot.sent[0]['reply_to_message_id'] == 7 and 'reply_to_message_id' not in bot.sent[1]
+    assert [message.get('reply_markup') for message in bot.sent] == [None, None, 'kb']
+
+
+def test_retry_after_pauses_chat_and_resends():
+    async def scenario():
+        bot = FakeBot(errors=[TelegramRetryAfter(METHOD, 'Too Many Requests', retry_after=0)])
+        outbox = Outbox(bot, rate=0, chat_rate=0)
+        await outbox.send(1, 'текст')
+        failing = FakeBot(errors=[TelegramRetryAfter(METHOD, 'Too Many Requests', retry_after=0)] * 3)
+        with pytest.raises(TelegramRetryAfter):
+            await Outbox(failing, rate=0, chat_rate=0, max_retries=2).send(1, 'текст')
+        return bot, failing
+
+    bot, failing = asyncio.run(scenario())
+    assert len(bot.times) == 2 and [message['text'] for message in bot.sent] == ['текст']
+    # первая попытка и max_retries повторов
+    assert len(failing.times) == 3 and failing.sent == []
+
+
+def test_unparsed_markup_is_sent_as_plain_text():
+    async def scenario():
+        error = TelegramBadRequest(METHOD, "Bad Request: can't parse entities: unexpected end")
+        bot = FakeBot(errors=[error])
+        await Outbox(bot, rate=0, chat_rate=0).send(1, '*незакрытый', parse_mode='Markdown')
+        other = FakeBot(errors=[TelegramBadRequest(METHOD, 'Bad Request: chat not found')])
+        with pytest.raises(TelegramBadRequest):
+            await Outbox(other, rate=0, chat_rate=0).send(1, 'текст')
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert bot.sent == [{'chat_id': 1, 'text': '*незакрытый', 'parse_mode': None}]
+
+
+def test_intermediate_edit_is_skipped_without_free_slot():
+    async def scenario():
+        bot = FakeBot()
+        outbox = Outbox(bot, rate=100, chat_rate=1, chat_burst=1)
+        first = await outbox.edit(1, 10, 'первый', wait=False)
+        skipped = await outbox.edit(1, 10, 'второй', wait=False)
+        throttled = FakeBot(errors=[TelegramRetryAfter(METHOD, 'Too Many Requests', retry_after=30)])
+        throttled_outbox = Outbox(throttled, rate=0, chat_rate=0)
+        after_429 = await throttled_outbox.edit(1, 10, 'третий', wait=False)
+        paused = not throttled_outbox._chat_bucket(1).available()
+        return bot, first, skipped, after_429, paused
+
+    bot, first, skipped, after_429, paused = asyncio.run(scenario())
+    assert first is True and skipped is None and after_429 is None and paused
+    assert [edit['text'] for edit in bot.edited] == ['первый']
+
+
+def test_broadcast_skips_unavailable_chats():
+    async def scenario():
+        bot = FakeBot(errors=[None, TelegramForbiddenError(METHOD, 'Forbidden: bot was blocked by the user'), None])
+        delivered = await Outbox(bot, rate=0, chat_rate=0, bulk_rate=0).broadcast([1, 2, 3], 'новость')
+        return bot, delivered
+
+    bot, delivered = asyncio.run(scenario())
+    assert delivered == 2
+    assert sorted(message['chat_id'] for message in bot.sent) == [1, 3]
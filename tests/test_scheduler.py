@@ -0,0 +1,149 @@
+""" Тесты планировщика запросов (utils/scheduler.py). """
+
+import asyncio
+
+import pytest
+
+from utils.scheduler import FairScheduler, SchedulerBusy
+
+
+def recorder(log, name, gate=None):
+    async def job():
+        log.append(f'start {name}')
+        if gate is not None:
+            await gate.wait()
+        await asyncio.sleep(0)
+        log.append(f'end {name}')
+        return name
+    return job
+
+
+def test_users_are_served_round_robin():
+    async def scenario():
+        log = []
+        scheduler = FairScheduler(concurrency=1, max_queue=10, max_user_queue=10)
+        futures = [scheduler.submit('a', f'a{i}', recorder(log, f'a{i}')) for i in range(3)]
+        futures.append(scheduler.submit('b', 'b0', recorder(log, 'b0')))
+        results = await asyncio.gather(*futures)
+        return log, results, scheduler.stats()
+
+    log, results, stats = asyncio.run(scenario())
+    # пользователь b не ждет всю очередь пользователя a
+    assert [entry for entry in log if entry.startswith('start')] == ['start a0', 'start b0', 'start a1', 'start a2']
+    assert results == ['a0', 'a1', 'a2', 'b0']
+    assert stats == {'active': 0, 'queued': 0, 'users_waiting': 0}
+
+
+def test_one_request_per_user_at_a_time():
+    async def scenario():
+        log = []
+        scheduler = FairScheduler(concurrency=4, max_queue=10, max_user_queue=10)
+        await asyncio.gather(*(scheduler.submit('a', i, recorder(log, i)) for i in range(3)))
+        return log
+
+    assert asyncio.run(scenario()) == ['start 0', 'end 0', 'start 1', 'end 1', 'start 2', 'end 2']
+
+
+def test_duplicate_request_is_not_queued_twice():
+    async def scenario():
+        log = []
+        gate = asyncio.Event()
+        scheduler = FairScheduler(concurrency=1, max_queue=10, max_user_queue=10)
+        first = scheduler.submit('a', 'вопрос', recorder(log, 'first', gate))
+        second = scheduler.submit('a', 'вопрос', recorder(log, 'second', gate))
+        pending = scheduler.is_pending('a', 'вопрос')
+        gate.set()
+        await first
+        return log, first is second, pending, scheduler.is_pending('a', 'вопрос')
+
+    log, same, pending_before, pending_after = asyncio.run(scenario())
+    assert same and pending_before and not pending_after
+    assert log == ['start first', 'end first']
+
+
+def test_queue_limits():
+    async def scenario():
+        gate = asyncio.Event()
+        scheduler = FairScheduler(concurrency=1, max_queue=2, max_user_queue=1)
+        scheduler.submit('a', 0, recorder([], 0, gate))     # выполняется
+        scheduler.submit('a', 1, recorder([], 1, gate))     # в очереди пользователя
+        with pytest.raises(SchedulerBusy):
+            scheduler.submit('a', 2, recorder([], 2, gate))
+        scheduler.submit('b', 0, recorder([], 0, gate))
+        with pytest.raises(SchedulerBusy):
+            scheduler.submit('c', 0, recorder([], 0, gate))
+        stats = scheduler.stats()
+        await scheduler.cancel_user('a')
+        await scheduler.cancel_user('b')
+        return stats
+
+    assert asyncio.run(scenario()) == {'active': 1, 'queued': 2, 'users_waiting': 1}
+
+
+def test_cancel_user_cancels_queued_and_running_requests():
+    async def scenario():
+        log = []
+        gate = asyncio.Event()
+        scheduler = FairScheduler(concurrency=1, max_queue=10, max_user_queue=10)
+        running = scheduler.submit('a', 0, recorder(log, 'a0', gate))
+        queued = scheduler.submit('a', 1, recorder(log, 'a1', gate))
+        other = scheduler.submit('b', 0, recorder(log, 'b0', gate))
+        await asyncio.sleep(0)
+        cancelled = await scheduler.cancel_user('a')
+        gate.set()
+        result = await other
+        return log, cancelled, running.cancelled(), queued.cancelled(), result, scheduler.stats()
+
+    log, cancelled, running_cancelled, queued_cancelled, result, stats = asyncio.run(scenario())
+    assert cancelled == 2 and running_cancelled and queued_cancelled
+    # запрос другого пользователя выполняется после отмены
+    assert result == 'b0'
+    assert log == ['start a0', 'start b0', 'end b0']
+    assert stats == {'active': 0, 'queued': 0, 'users_waiting': 0}
+
+
+def test_exception_is_delivered_to_the_caller():
+    async def scenario():
+        async def fail():
+            raise ValueError('ошибка')
+        scheduler = FairScheduler(concurrency=1, max_queue=10, max_user_queue=10)
+        failed = scheduler.submit('a', 0, fail)
+        after = scheduler.submit('a', 1, recorder([], 'after'))
+        with pytest.raises(ValueError):
+            await failed
+        return await after
+
+    assert asyncio.run(scenario()) == 'after'
+
+
+def test_close_waits_for_running_requests_and_cancels_queued():
+    async def scenario():
+        log = []
+        scheduler = FairScheduler(concurrency=1, max_queue=10, max_user_queue=10)
+        running = scheduler.submit('a', 0, recorder(log, 'a0'))
+        queued = scheduler.submit('b', 0, recorder(log, 'b0'))
+        cancelled = await scheduler.close(timeout=1)
+        with pytest.raises(SchedulerBusy):
+            scheduler.submit('c', 0, recorder(log, 'c0'))
+        return log, cancelled, running.result(), queued.cancelled(), scheduler.stats()
+
+    log, cancelled, result, queued_cancelled, stats = asyncio.run(scenario())
+    # выполняющийся запрос завершается, ожидающий отменяется
+    assert log == ['start a0', 'end a0'] and result == 'a0'
+    assert cancelled == 1 and queued_cancelled
+    assert stats == {'active': 0, 'queued': 0, 'users_waiting': 0}
+
+
+def test_close_cancels_requests_running_longer_than_timeout():
+    async def scenario():
+        log = []
+        scheduler = FairScheduler(concurrency=1, max_queue=10, max_user_queue=10)
+        running = scheduler.submit('a', 0, recorder(log, 'a0', asyncio.Event()))
+        await asyncio.sleep(0)
+        cancelled = await scheduler.close(timeout=0.01)
+        return log, cancelled, running.cancelled(), scheduler.stats()
+
+    log, cancelled, running_cancelled, stats = asyncio.run(scenario())
+    assert log == ['start a0']
+    assert cancelled == 1 and running_cancelled
+    assert stats['active'] == 0
@@ -0,0 +1,32 @@
+""" Тесты разбиения длинного текста на сообщения Telegram (utils/telegram_stream.py). """
+
+from utils.telegram_stream import TELEGRAM_MESSAGE_LIMIT, split_text
+
+
+def test_short_text_is_not_split():
+    assert split_text('ответ') == ['ответ']
+    assert split_text('') == ['']
+    assert split_text('я' * TELEGRAM_MESSAGE_LIMIT) == ['я' * TELEGRAM_MESSAGE_LIMIT]
+
+
+def test_text_without_spaces_is_cut_at_limit():
+    text = 'я' * (2 * TELEGRAM_MESSAGE_LIMIT + 100)
+    parts = split_text(text)
+    assert [len(part) for part in parts] == [TELEGRAM_MESSAGE_LIMIT, TELEGRAM_MESSAGE_LIMIT, 100]
+    assert ''.join(parts) == text
+
+
+def test_split_prefers_line_break_then_space():
+    lines = ['строка ответа номер %04d' % i for i in range(400)]
+    text = '\n'.join(lines)
+    parts = split_text(text)
+    assert all(len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    # части заканчиваются целыми строками, перенос на границе не теряет текст
+    assert '\n'.join(parts) == text
+    assert all(part.split('\n')[-1] in lines for part in parts)
+
+    words = ' '.join(['слово'] * 1500)
+    parts = split_text(words)
+    assert all(len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert all(part.strip(' ').split(' ')[-1] == 'слово' for part in parts)
+    assert ''.join(parts) == words
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+# Значение-маркер отсутствия записи в кэше (None может быть закэшированным значением)
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш с вытеснением давно неиспользуемых записей (LRU)
+    и временем жизни записи (TTL). Считает попадания и промахи.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        """
+        :param maxsize: Максимальное количество записей.
+        :param ttl: Время жизни записи в секундах (None - без ограничения).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        """Возвращает значение по ключу или default, если записи нет или она устарела."""
+        item = self._data.get(key, MISSING)
+        if item is not MISSING:
+            value, expires = item
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """Добавляет или заменяет значение, вытесняя самые старые записи при переполнении."""
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def update(self, key, **fields):
+        """Обновляет поля закэшированного словаря, если запись есть в кэше (без учета статистики)."""
+        item = self._data.get(key, MISSING)
+        if item is not MISSING and isinstance(item[0], dict):
+            value, expires = item
+            self._data[key] = ({**value, **fields}, expires)
+
+    def pop(self, key):
+        """Удаляет запись из кэша."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Статистика использования кэша."""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,87 @@
+""" Настройка логирования бота.
+
+Все записи (loguru и стандартного logging, в том числе aiogram) идут в loguru и пишутся в файл
+через очередь (enqueue=True): запись в файл, ротация и сжатие выполняются в фоновом потоке,
+а не в обработчике сообщения. Уровень по умолчанию - INFO (LOG_LEVEL=DEBUG для отладки).
+
+Большие тексты (найденные кусочки, ответы модели) выводятся через payload: обрезаются
+до LOG_PAYLOAD_CHARS символов, целиком попадает лишь доля LOG_PAYLOAD_SAMPLE_RATE записей.
+log_event пишет структурированную запись с полями (пользователь, этап, длительность),
+при LOG_JSON=True файл пишется в формате JSON Lines.
+"""
+
+import inspect
+import logging
+import random
+import sys
+
+from decouple import config
+from loguru import logger
+
+LOG_LEVEL = config('LOG_LEVEL', default='INFO').upper()
+LOG_ROTATION = config('LOG_ROTATION', default='20 MB')
+LOG_RETENTION = config('LOG_RETENTION', default=10, cast=int)
+LOG_JSON = config('LOG_JSON', default=False, cast=bool)
+LOG_STDERR = config('LOG_STDERR', default=True, cast=bool)
+LOG_PAYLOAD_CHARS = config('LOG_PAYLOAD_CHARS', default=500, cast=int)
+LOG_PAYLOAD_SAMPLE_RATE = config('LOG_PAYLOAD_SAMPLE_RATE', default=0.0, cast=float)
+
+
+class InterceptHandler(logging.Handler):
+    """Перенаправляет записи стандартного logging в loguru."""
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        # глубина кадра, чтобы в записи было место вызова, а не модуль logging
+        frame, depth = inspect.currentframe(), 0
+        while frame and (depth == 0 or frame.f_code.co_filename == logging.__file__):
+            frame = frame.f_back
+            depth += 1
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+
+
+def _format(record) -> str:
+    # поля из logger.bind / log_event выводятся после сообщения в виде ключ=значение
+    fields = ''.join(f' {key}={{extra[{key}]}}' for key in record['extra'])
+    return '{time:YYYY-MM-DD HH:mm:ss.SSS} {level} {name}:{line} {message}' + fields + '\n{exception}'
+
+
+def setup_logging(log_dir: str, filename: str = 'chat.log'):
+    """
+    Настраивает loguru и стандартный logging: файл log_dir + filename через очередь
+    с ротацией по LOG_ROTATION, хранением LOG_RETENTION файлов и сжатием в zip,
+    а также вывод в stderr (LOG_STDERR).
+    """
+    logger.remove()
+    if LOG_STDERR:
+        logger.add(sys.stderr, level=LOG_LEVEL, format=_format, enqueue=True)
+    logger.add(f'{log_dir}{filename}', level=LOG_LEVEL, format=_format, serialize=LOG_JSON, enqueue=True,
+               rotation=LOG_ROTATION, retention=LOG_RETENTION, compression='zip')
+    # уровень стандартного logging тот же, чтобы отключенные записи отбрасывались сразу
+    logging.basicConfig(handlers=[InterceptHandler()], level=LOG_LEVEL, force=True)
+
+
+def payload(text, limit: int = None) -> str:
+    """
+    Большой текст для записи в лог: обрезается до limit (по умолчанию LOG_PAYLOAD_CHARS) символов,
+    целиком выводится с вероятностью LOG_PAYLOAD_SAMPLE_RATE.
+    """
+    text = str(text)
+    limit = LOG_PAYLOAD_CHARS if limit is None else limit
+    if len(text) <= limit or (LOG_PAYLOAD_SAMPLE_RATE and random.random() < LOG_PAYLOAD_SAMPLE_RATE):
+        return text
+    return f'{text[:limit]}... [еще {len(text) - limit} символов]'
+
+
+def log_event(stage: str, user_id=None, duration: float = None, level: str = 'INFO', **fields):
+    """
+    Структурированная запись: этап stage, пользователь, длительность (в мс) и дополнительные поля.
+    """
+    if user_id is not None:
+        fields['user'] = user_id
+    if duration is not None:
+        fields['duration_ms'] = round(duration * 1000, 1)
+    logger.bind(stage=stage, **fields).opt(depth=1).log(level, stage)
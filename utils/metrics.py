@@ -0,0 +1,189 @@
+""" Метрики бота: гистограммы длительности этапов обработки сообщения, счетчики и показатели.
+
+Метрики собираются только при METRICS_ENABLED=True, иначе observe, inc и timer ничего не делают.
+Значения доступны в текстовом формате Prometheus (render_prometheus, HTTP-эндпоинт /metrics)
+и в виде краткой сводки с перцентилями p50/p95/p99 (format_summary, команда администратора).
+"""
+
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from decouple import config
+
+METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Количество последних значений, по которым считаются перцентили
+RESERVOIR_SIZE = 2048
+
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    """Гистограмма с корзинами Prometheus и последними значениями для перцентилей."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        """Перцентиль q (0..100) по последним значениям."""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+# Метрики по ключу (имя, метки)
+histograms = {}
+counters = {}
+# Показатели, значения которых вычисляются при чтении: имя -> функция без аргументов
+gauges = {}
+# Подписи метрик для Prometheus: имя -> (тип, описание)
+descriptions = {}
+
+
+def _key(name: str, labels: dict = None):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def describe(name: str, kind: str, text: str):
+    """Описание метрики (HELP и TYPE в формате Prometheus)."""
+    descriptions[name] = (kind, text)
+
+
+def observe(name: str, value: float, labels: dict = None, buckets=DEFAULT_BUCKETS):
+    """Добавляет значение в гистограмму name."""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = Histogram(buckets)
+    histogram.observe(value)
+
+
+def inc(name: str, value: float = 1, labels: dict = None):
+    """Увеличивает счетчик name."""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def register_gauge(name: str, func, text: str = ''):
+    """Регистрирует показатель, значение которого возвращает func при чтении метрик."""
+    gauges[name] = func
+    describe(name, 'gauge', text)
+
+
+@contextmanager
+def _timer(name: str, labels: dict = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels)
+
+
+def timer(name: str, labels: dict = None):
+    """Контекстный менеджер: длительность блока в секундах добавляется в гистограмму name."""
+    if not METRICS_ENABLED:
+        return _NULL_TIMER
+    return _timer(name, labels)
+
+
+def _format_labels(labels, extra: str = '') -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name not in described:
+            described.add(name)
+            text = descriptions.get(name, (kind, ''))[1]
+            if text:
+                lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+            lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+        bucket_labels = _format_labels(labels, 'le="+Inf"')
+        lines.append(f'{name}_bucket{bucket_labels} {histogram.count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+        lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name, func in sorted(gauges.items()):
+        header(name, 'gauge')
+        lines.append(f'{name} {func()}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_summary() -> str:
+    """Краткая сводка: перцентили гистограмм, счетчики и показатели."""
+    if not METRICS_ENABLED:
+        return 'Метрики отключены (METRICS_ENABLED=False)'
+    lines = []
+    for (name, labels), histogram in sorted(histograms.items()):
+        p50, p95, p99 = (histogram.percentile(q) for q in (50, 95, 99))
+        lines.append(f'{name}{_format_labels(labels)}: n={histogram.count} '
+                     f'p50={p50:.3f} p95={p95:.3f} p99={p99:.3f}')
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f'{name}{_format_labels(labels)}: {value:g}')
+    for name, func in sorted(gauges.items()):
+        lines.append(f'{name}: {func():g}')
+    return '\n'.join(lines) or 'Метрик пока нет'
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Длительность запросов к Telegram Bot API по методам (sendMessage, editMessageText и т.д.)."""
+
+    async def __call__(self, make_request, bot, method):
+        with timer('telegram_request_seconds', {'method': type(method).__name__}):
+            return await make_request(bot, method)
+
+
+async def metrics_handler(request):
+    """aiohttp-обработчик эндпоинта /metrics."""
+    from aiohttp import web
+    return web.Response(text=render_prometheus(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int):
+    """Отдельный HTTP-сервер метрик (для режима long polling). Возвращает AppRunner для остановки."""
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
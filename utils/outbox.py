@@ -0,0 +1,202 @@
+""" Отправка сообщений в Telegram с ограничением частоты (flood control).
+
+Каждое сообщение занимает место в общей очереди бота (не больше rate сообщений в секунду)
+и в очереди чата (не больше chat_rate сообщений в секунду, кратковременно - до chat_burst подряд).
+Места в очередях выдаются по порядку обращения (TokenBucket.acquire), поэтому сообщения
+одного чата отправляются в исходном порядке. Рассылки (broadcast) дополнительно ограничены bulk_rate,
+чтобы не занимать всю общую очередь, пока пользователи ждут ответов.
+
+Если Telegram все же ответил 429 (TelegramRetryAfter), чат (и рассылка) приостанавливается
+на указанное время и сообщение отправляется повторно. Текст, в котором Telegram не смог разобрать
+Markdown или HTML, отправляется без разметки, длинный текст - несколькими сообщениями.
+
+Редактирование сообщений (edit, в том числе при потоковом ответе) занимает места в тех же очередях;
+промежуточное обновление (wait=False) не ждет места в очереди и при его отсутствии пропускается.
+"""
+
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from loguru import logger
+
+from utils import metrics
+from utils.cache import LRUCache, MISSING
+from utils.telegram_stream import split_text
+
+
+class TokenBucket:
+    """Ограничение частоты: rate событий в секунду, до burst подряд (rate <= 0 - без ограничения)."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Занимает место в очереди и возвращает время (с), через которое оно наступит."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def available(self) -> bool:
+        """Есть ли свободное место без ожидания."""
+        if time.monotonic() < self.blocked_until:
+            return False
+        if self.rate <= 0:
+            return True
+        return min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate) >= 1
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу мест на seconds секунд (ответ Telegram 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        while (delay := self.blocked_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+
+class Outbox:
+    """Очередь исходящих сообщений бота с ограничением частоты, повтором после 429 и разбиением текста."""
+
+    def __init__(self, bot: Bot, rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 bulk_rate: float = 10, max_retries: int = 3, max_chats: int = 10000):
+        """
+        :param bot: Бот, через который отправляются сообщения.
+        :param rate: Сообщений в секунду во все чаты (лимит Telegram - около 30).
+        :param chat_rate: Сообщений в секунду в один чат (лимит Telegram - около 1).
+        :param chat_burst: Сколько сообщений в чат можно отправить подряд без ожидания.
+        :param bulk_rate: Сообщений в секунду для рассылок.
+        :param max_retries: Количество повторов сообщения после ответа 429.
+        :param max_chats: Количество чатов, для которых хранится состояние очереди.
+        """
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(rate, burst=1)
+        self.bulk_bucket = TokenBucket(bulk_rate, burst=1)
+        self._chats = LRUCache(maxsize=max_chats)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is MISSING:
+            bucket = TokenBucket(self.chat_rate, burst=self.chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def _acquire(self, chat_id: int, bulk: bool):
+        start = time.perf_counter()
+        if bulk:
+            await self.bulk_bucket.acquire()
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+        metrics.observe('outbox_wait_seconds', time.perf_counter() - start)
+
+    def _try_acquire(self, chat_id: int) -> bool:
+        """Занимает места в очереди чата и общей очереди, только если оба свободны сейчас."""
+        bucket = self._chat_bucket(chat_id)
+        if not (bucket.available() and self.global_bucket.available()):
+            return False
+        bucket.reserve()
+        self.global_bucket.reserve()
+        return True
+
+    async def _request(self, method, chat_id: int, bulk: bool, **kwargs):
+        """Запрос method (send_message, edit_message_text) с ожиданием места в очередях и повтором после 429."""
+        retries = 0
+        acquire = True
+        while True:
+            if acquire:
+                await self._acquire(chat_id, bulk)
+            acquire = True
+            try:
+                return await method(chat_id=chat_id, **kwargs)
+            except TelegramRetryAfter as e:
+                retries += 1
+                metrics.inc('outbox_retries_total', labels={'reason': 'retry_after'})
+                if retries > self.max_retries:
+                    raise
+                logger.warning(f'Telegram 429 для чата {chat_id}: повтор через {e.retry_after} с')
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                if bulk:
+                    self.bulk_bucket.pause(e.retry_after)
+            except TelegramBadRequest as e:
+                # разметка не разобрана - тот же текст отправляется без разметки
+                parse_mode = kwargs.get('parse_mode', self.bot.default.parse_mode)
+                if parse_mode is None or "can't parse entities" not in str(e):
+                    raise
+                metrics.inc('outbox_retries_total', labels={'reason': 'parse_mode'})
+                logger.warning(f'Разметка сообщения для чата {chat_id} не разобрана, отправка без разметки: {e}')
+                kwargs['parse_mode'] = None
+                # сообщение не было отправлено - место в очереди используется повторно
+                acquire = False
+
+    async def send(self, chat_id: int, text: str, reply_markup=None, reply_to_message_id: int = None,
+                   bulk: bool = False, **kwargs) -> list:
+        """
+        Отправляет текст в чат (при необходимости - несколькими сообщениями не длиннее лимита Telegram).
+        Ответом на reply_to_message_id будет первое сообщение, клавиатура reply_markup - у последнего.
+        Дополнительные аргументы (parse_mode и др.) передаются в Bot.send_message.
+        Возвращает отправленные сообщения.
+        """
+        parts = split_text(text)
+        messages = []
+        for i, part in enumerate(parts):
+            part_kwargs = dict(kwargs)
+            if i == 0 and reply_to_message_id is not None:
+                part_kwargs.update(reply_to_message_id=reply_to_message_id, allow_sending_without_reply=True)
+            if i == len(parts) - 1 and reply_markup is not None:
+                part_kwargs['reply_markup'] = reply_markup
+            messages.append(await self._request(self.bot.send_message, chat_id, bulk, text=part, **part_kwargs))
+        return messages
+
+    async def edit(self, chat_id: int, message_id: int, text: str, wait: bool = True, **kwargs):
+        """
+        Редактирует текст сообщения. Дополнительные аргументы передаются в Bot.edit_message_text.
+        wait=False - промежуточное обновление: если места в очередях сейчас нет или Telegram ответил 429,
+        обновление пропускается и возвращается None.
+        """
+        if wait:
+            return await self._request(self.bot.edit_message_text, chat_id, False, message_id=message_id,
+                                       text=text, **kwargs)
+        if not self._try_acquire(chat_id):
+            metrics.inc('outbox_skipped_edits_total')
+            return None
+        try:
+            return await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+        except TelegramRetryAfter as e:
+            metrics.inc('outbox_retries_total', labels={'reason': 'retry_after'})
+            self._chat_bucket(chat_id).pause(e.retry_after)
+            return None
+
+    async def broadcast(self, chat_ids, text: str, **kwargs) -> int:
+        """
+        Рассылка текста в чаты chat_ids через общую очередь с ограничением bulk_rate.
+        Ошибка отправки в один чат (например, пользователь заблокировал бота) не прерывает рассылку.
+        Возвращает количество чатов, в которые текст доставлен.
+        """
+
+        async def deliver(chat_id) -> bool:
+            try:
+                await self.send(chat_id, text, bulk=True, **kwargs)
+            except TelegramForbiddenError:
+                logger.info(f'Рассылка: чат {chat_id} недоступен')
+                return False
+            except Exception as e:
+                logger.warning(f'Рассылка: не удалось отправить сообщение в чат {chat_id}: {e!r}')
+                return False
+            return True
+
+        results = await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
+        return sum(results)
@@ -0,0 +1,169 @@
+import asyncio
+from collections import deque
+
+
+class SchedulerBusy(Exception):
+    """Очередь запросов переполнена."""
+
+
+class _Job:
+    def __init__(self, user_id, key, factory):
+        self.user_id = user_id
+        self.key = key
+        self.factory = factory
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+
+
+class FairScheduler:
+    """
+    Планировщик запросов пользователей к RAG.
+
+    У каждого пользователя своя очередь, и одновременно выполняется не более
+    одного его запроса. Пользователи с ожидающими запросами обслуживаются по кругу,
+    поэтому один активный пользователь не задерживает остальных.
+    Одинаковый запрос (по key), уже стоящий в очереди или выполняющийся, повторно не ставится.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, max_user_queue: int):
+        """
+        :param concurrency: Количество одновременно выполняемых запросов.
+        :param max_queue: Максимальное количество ожидающих запросов всех пользователей.
+        :param max_user_queue: Максимальное количество ожидающих запросов одного пользователя.
+        """
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_user_queue = max_user_queue
+        self._queues = {}       # пользователь -> очередь _Job
+        self._ready = deque()   # пользователи с ожидающими запросами по порядку обслуживания
+        self._active = {}       # пользователь -> выполняющийся _Job
+        self._queued = 0
+        self._closed = False
+
+    def _find(self, user_id, key):
+        active = self._active.get(user_id)
+        if active is not None and active.key == key:
+            return active
+        for job in self._queues.get(user_id, ()):
+            if job.key == key:
+                return job
+        return None
+
+    def is_pending(self, user_id, key) -> bool:
+        """Стоит ли такой запрос пользователя в очереди или выполняется."""
+        return self._find(user_id, key) is not None
+
+    def submit(self, user_id, key, factory) -> asyncio.Future:
+        """
+        Ставит запрос в очередь пользователя.
+
+        :param key: Ключ запроса для отбрасывания повторов.
+        :param factory: Функция без аргументов, возвращающая корутину запроса.
+        :return: Future с результатом корутины (отменяется при cancel_user).
+        :raises SchedulerBusy: Если очередь переполнена или планировщик остановлен.
+        """
+        existing = self._find(user_id, key)
+        if existing is not None:
+            return existing.future
+        if self._closed:
+            raise SchedulerBusy()
+        queue = self._queues.setdefault(user_id, deque())
+        if self._queued >= self.max_queue or len(queue) >= self.max_user_queue:
+            if not queue:
+                del self._queues[user_id]
+            raise SchedulerBusy()
+
+        job = _Job(user_id, key, factory)
+        queue.append(job)
+        self._queued += 1
+        if len(queue) == 1 and user_id not in self._active:
+            self._ready.append(user_id)
+        self._dispatch()
+        return job.future
+
+    def _dispatch(self):
+        while self._ready and len(self._active) < self.concurrency:
+            user_id = self._ready.popleft()
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+            self._queued -= 1
+            self._active[user_id] = job
+            job.task = asyncio.create_task(self._run(job))
+            job.task.add_done_callback(lambda task, job=job: self._finish(job, task))
+
+    @staticmethod
+    async def _run(job):
+        return await job.factory()
+
+    def _finish(self, job, task):
+        if self._active.get(job.user_id) is job:
+            del self._active[job.user_id]
+            if job.user_id in self._queues:
+                self._ready.append(job.user_id)
+        if not job.future.done():
+            if task.cancelled():
+                job.future.cancel()
+            elif task.exception() is not None:
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+        elif not task.cancelled():
+            task.exception()    # результат никому не нужен, но исключение не должно попасть в лог как необработанное
+        self._dispatch()
+
+    async def cancel_user(self, user_id) -> int:
+        """
+        Отменяет ожидающие и выполняющийся запросы пользователя
+        и дожидается завершения выполняющегося.
+
+        :return: Количество отмененных запросов.
+        """
+        queue = self._queues.pop(user_id, deque())
+        if user_id in self._ready:
+            self._ready.remove(user_id)
+        self._queued -= len(queue)
+        for job in queue:
+            job.future.cancel()
+        cancelled = len(queue)
+
+        active = self._active.get(user_id)
+        if active is not None:
+            active.task.cancel()
+            await asyncio.wait([active.task])
+            cancelled += 1
+        return cancelled
+
+    async def close(self, timeout: float = None) -> int:
+        """
+        Остановка планировщика: новые запросы не принимаются, ожидающие отменяются,
+        выполняющиеся дожидаются не дольше timeout секунд (None - без ограничения), затем отменяются.
+
+        :return: Количество отмененных запросов.
+        """
+        self._closed = True
+        queued = [job for queue in self._queues.values() for job in queue]
+        self._queues.clear()
+        self._ready.clear()
+        self._queued = 0
+        for job in queued:
+            job.future.cancel()
+
+        tasks = [job.task for job in self._active.values()]
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        return len(queued) + len(pending)
+
+    def stats(self) -> dict:
+        """Текущая загрузка планировщика."""
+        return {
+            'active': len(self._active),
+            'queued': self._queued,
+            'users_waiting': len(self._ready),
+        }
@@ -0,0 +1,167 @@
+import asyncio
+import time
+from contextlib import aclosing
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Текст, который показывается вместо пустого ответа модели
+EMPTY_RESPONSE_TEXT = 'Не удалось сформировать ответ'
+
+
+def split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """
+    Разбивает текст на части не длиннее limit символов.
+    Граница по возможности выбирается по переносу строки или пробелу.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(' ', 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    """
+    Потоковый ответ в Telegram: отправляет сообщение-заглушку и редактирует его
+    по мере поступления текста от LLM.
+
+    Редактирование выполняется не чаще edit_interval секунд и только если накопилось
+    не меньше min_delta символов. При превышении лимита Telegram текст продолжается
+    в новом сообщении. Итоговое редактирование выполняется с Markdown, а если Telegram
+    не смог разобрать разметку - простым текстом.
+    Если задан outbox (utils/outbox.py), новые сообщения и редактирования проходят через его
+    очереди с ограничением частоты.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, placeholder: str = '...', reply_markup=None,
+                 reply_to_message_id: int = None, edit_interval: float = 1.0, min_delta: int = 40, outbox=None):
+        self.bot = bot
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.placeholder = placeholder
+        self.reply_markup = reply_markup
+        self.reply_to_message_id = reply_to_message_id
+        self.edit_interval = edit_interval
+        self.min_delta = min_delta
+
+        self._message_id = None
+        self._text = ''         # текст текущего (последнего) сообщения
+        self._sent_text = ''    # текст, который уже отображается в текущем сообщении
+        self._full_text = ''    # весь ответ целиком
+        self._last_edit = 0.0
+
+    async def run(self, chunks) -> str:
+        """Выводит в чат асинхронный поток кусочков текста и возвращает полный ответ."""
+        await self._send_placeholder()
+        # aclosing: при отмене запроса генерация в модели прерывается сразу
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await self.feed(chunk)
+        return await self.finish()
+
+    async def feed(self, chunk: str):
+        """Добавляет кусочек текста и при необходимости обновляет сообщение."""
+        self._full_text += chunk
+        self._text += chunk
+
+        # Перенос продолжения ответа в новое сообщение при превышении лимита Telegram
+        while len(self._text) > TELEGRAM_MESSAGE_LIMIT:
+            head, tail = self._split_head(self._text)
+            self._text = head
+            await self._edit_final()
+            self._text = tail
+            self._message_id = None
+
+        if self._message_id is None:
+            if self._text:
+                await self._send_placeholder(self._text)
+            return
+
+        now = time.monotonic()
+        if (now - self._last_edit >= self.edit_interval
+                and len(self._text) - len(self._sent_text) >= self.min_delta):
+            await self._edit(self._text, final=False)
+
+    async def finish(self) -> str:
+        """Финальное обновление последнего сообщения с применением Markdown."""
+        if not self._full_text.strip():
+            self._text = EMPTY_RESPONSE_TEXT
+        if self._message_id is not None and self._text:
+            await self._edit_final()
+        return self._full_text
+
+    @staticmethod
+    def _split_head(text: str):
+        parts = split_text(text)
+        head = parts[0]
+        return head, text[len(head):].lstrip('\n')
+
+    async def _send_placeholder(self, text: str = None):
+        if self.outbox is not None:
+            message = (await self.outbox.send(self.chat_id, text or self.placeholder, parse_mode=None,
+                                              reply_markup=self.reply_markup,
+                                              reply_to_message_id=self.reply_to_message_id))[-1]
+        else:
+            message = await self.bot.send_message(chat_id=self.chat_id, text=text or self.placeholder,
+                                                  parse_mode=None, reply_markup=self.reply_markup,
+                                                  reply_to_message_id=self.reply_to_message_id)
+        self._message_id = message.message_id
+        self._sent_text = text or ''
+        self._last_edit = time.monotonic()
+        # отвечаем на сообщение пользователя только первым сообщением
+        self.reply_to_message_id = None
+
+    async def _edit_final(self):
+        try:
+            await self._edit(self._text, final=True, parse_mode='Markdown')
+        except TelegramBadRequest:
+            # Markdown не разобран - выводим без разметки
+            await self._edit(self._text, final=True)
+
+    async def _edit(self, text: str, final: bool, parse_mode: str = None):
+        if self.outbox is not None:
+            await self._edit_outbox(text, final, parse_mode)
+            return
+        while True:
+            try:
+                await self.bot.edit_message_text(text=text, chat_id=self.chat_id,
+                                                 message_id=self._message_id, parse_mode=parse_mode)
+                break
+            except TelegramRetryAfter as e:
+                # промежуточные обновления пропускаем, финальное дожидаемся
+                if not final:
+                    self._last_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if 'message is not modified' in str(e):
+                    break
+                if parse_mode is not None or final:
+                    raise
+                return
+        self._sent_text = text
+        self._last_edit = time.monotonic()
+
+    async def _edit_outbox(self, text: str, final: bool, parse_mode: str = None):
+        try:
+            # промежуточное обновление пропускается, если очередь чата занята; финальное ее дожидается
+            message = await self.outbox.edit(self.chat_id, self._message_id, text, wait=final, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in str(e):
+                if parse_mode is not None or final:
+                    raise
+                return
+        else:
+            if message is None:
+                return
+        self._sent_text = text
+        self._last_edit = time.monotonic()
@@ -1,3 +1,5 @@
+import time
+from contextlib import contextmanager
 from datetime import datetime
 import pytz
 
@@ -5,4 +7,22 @@ import pytz
 def get_now_time():
     now = datetime.now(pytz.timezone('Europe/Moscow'))
     # Convert to naive datetime
-    return now.replace(tzinfo=None)
\ No newline at end of file
+    return now.replace(tzinfo=None)
+
+# Среднее количество символов на один токен (грубая оценка для русского текста и кода)
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительная оценка количества токенов в тексте без загрузки токенизатора."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+@contextmanager
+def log_duration(name: str, log):
+    """Выводит через log время выполнения блока (этапа запуска, прогрева и т.п.)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        log(f'{name}: {time.perf_counter() - start:.2f} с')